@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# bench_tree_memory.py
+
+"""
+Measure the memory used per entry by an NLHTree and by a CompactTree
+holding the same synthetic BuildList content.
+
+    python3 benchmarks/bench_tree_memory.py [-n ENTRIES] [-s SEED]
+"""
+
+import gc
+import random
+import tracemalloc
+from argparse import ArgumentParser
+
+from xlattice import HashTypes
+from buildlist.builder import TreeBuilder
+from buildlist.compact import CompactTreeBuilder
+
+
+def synthetic_lines(count, seed, hashtype=HashTypes.SHA2):
+    """
+    Yield the lines of a serialized tree with count files spread over
+    nested directories, the same for the same seed.
+    """
+    rng = random.Random(seed)
+    hex_len = 40 if hashtype == HashTypes.SHA1 else 64
+    names = ['%s%d.%s' % (stem, ndx, ext)
+             for stem in ('main', 'util', 'test', 'data')
+             for ndx in range(16) for ext in ('py', 'c', 'txt')]
+    yield 'dataDir'
+    written = 0
+    dir_no = 0
+    while written < count:
+        depth = rng.randint(1, 4)
+        for level in range(1, depth + 1):
+            yield ' ' * level + 'dir%d_%d' % (dir_no, level)
+        dir_no += 1
+        batch = min(count - written, rng.randint(1, 64))
+        for name in sorted(rng.sample(names, min(batch, len(names)))):
+            yield '%s%s %0*x' % (' ' * (depth + 1), name, hex_len,
+                                 rng.getrandbits(4 * hex_len))
+            written += 1
+
+
+def measure(builder_class, count, seed):
+    """ Return the bytes allocated to build the tree, and the tree. """
+    gc.collect()
+    tracemalloc.start()
+    builder = builder_class(HashTypes.SHA2)
+    for line in synthetic_lines(count, seed):
+        builder.add_line(line)
+    tree = builder.tree
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return used, tree
+
+
+def main():
+    """ Report bytes per entry for each representation. """
+    parser = ArgumentParser(description='memory per BuildList entry')
+    parser.add_argument('-n', '--entries', type=int, default=100000,
+                        help='number of files in the synthetic tree')
+    parser.add_argument('-s', '--seed', type=int, default=42,
+                        help='seed for the synthetic tree')
+    args = parser.parse_args()
+
+    for label, builder_class in [('NLHTree', TreeBuilder),
+                                 ('CompactTree', CompactTreeBuilder)]:
+        used, tree = measure(builder_class, args.entries, args.seed)
+        print("%-12s %10d bytes  %7.1f bytes/file" % (
+            label, used, used / args.entries))
+        del tree
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# run_suite.py
+
+"""
+Run bl_bench over synthetic trees of 1k, 10k, 100k and 1M files, each
+in its own process so that peak RSS is measured per size, and collect
+the reports into one JSON document.
+
+    python3 benchmarks/run_suite.py [-m MAX_FILES] [-o OUTPUT] [-P WORKERS]
+                                    [-E ENCODING] [-C CONTENT]
+
+The two larger trees use the 'tiny' size distribution to keep the data
+directory, which is written twice more into U and the populated copy,
+to a few hundred MB.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# (file count, size distribution)
+SUITE = [(1000, 'source'), (10000, 'source'),
+         (100000, 'tiny'), (1000000, 'tiny')]
+
+BL_BENCH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'src', 'bl_bench')
+
+
+def main():
+    """ Run each size in turn, printing a line of progress for each. """
+    parser = ArgumentParser(description='run bl_bench at each suite size')
+    parser.add_argument('-m', '--max_files', type=int, default=100000,
+                        help='skip sizes above this (default 100000)')
+    parser.add_argument('-o', '--output', default='bench_suite.json',
+                        help='where to write the combined report')
+    parser.add_argument('-P', '--workers', type=int, default=1,
+                        help='threads for hashing and populating')
+    parser.add_argument('-s', '--seed', type=int, default=42,
+                        help='seed for the synthetic trees')
+    parser.add_argument('-E', '--encoding', default='none',
+                        help='compress what is put into U with this')
+    parser.add_argument('-C', '--content', default='random',
+                        help='random bytes or compressible text')
+    parser.add_argument('-1', '--using_sha1', action='store_true',
+                        help='use SHA1 rather than SHA256')
+    args = parser.parse_args()
+
+    reports = []
+    for count, sizes in SUITE:
+        if count > args.max_files:
+            continue
+        cmd = [sys.executable, BL_BENCH, '-n', str(count), '-S', sizes,
+               '-s', str(args.seed), '-P', str(args.workers),
+               '-E', args.encoding, '-C', args.content]
+        if args.using_sha1:
+            cmd.append('-1')
+        print("%8d files ..." % count, end='', flush=True)
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        report = json.loads(out.stdout.decode('utf-8'))
+        reports.append(report)
+        print(" list_gen %.1f files/s, peak RSS %d KB, U ratio %s" % (
+            report['results']['list_gen']['files_per_s'],
+            max(r['peak_rss_kb'] for r in report['results'].values()),
+            report['u_store']['ratio']))
+
+    with open(args.output, 'w') as file:
+        json.dump(reports, file, indent=2, sort_keys=True)
+        file.write('\n')
+    print("wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,8 +21,12 @@ setup(name='buildlist',
       py_modules=[],
       include_package_data=False,
       zip_safe=False,
-      scripts=['src/fix_builds', 'src/bl_check', 'src/bl_createtestdata1',
-               'src/bl_listgen', 'src/bl_srcgen'],
+      scripts=['src/fix_builds', 'src/bl_agent', 'src/bl_bench',
+               'src/bl_check',
+               'src/bl_createtestdata1',
+               'src/bl_diff', 'src/bl_history', 'src/bl_listgen',
+               'src/bl_srcgen',
+               'src/bl_uindex', 'src/bl_verify_all'],
       ext_modules=[],
       description='digitally signed indented list of content keys',
       url='https://jddixon.github.io/buildlist',
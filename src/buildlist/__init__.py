@@ -4,6 +4,7 @@
 
 import base64
 import binascii
+import io
 import shutil
 import time
 
@@ -13,8 +14,6 @@ try:
 except ImportError:
     from scandir import scandir
 
-import hashlib
-
 from Crypto.PublicKey import RSA
 from Crypto.Hash import SHA  # , SHA256
 from Crypto.Signature import PKCS1_PSS
@@ -28,11 +27,32 @@ from xlattice import HashTypes, check_hashtype
 from xlu import UDir
 from xlutil import make_ex_re, parse_timestamp, timestamp
 
+from buildlist.agent import AgentClient, connect_agent
+from buildlist.binfmt import BinaryBuildList, write_binary
+from buildlist.builder import TreeBuilder
+from buildlist.check import DataDirCheck, check_tree_against_dir
+from buildlist.chunks import find_missing_files, path_to_manifest
+from buildlist.compact import CompactTree, CompactTreeBuilder
+from buildlist.delta import put_list, read_list
+from buildlist.diff import DiffEntry, diff_trees
+from buildlist.hashing import (HashingWriter, file_bin_hash, new_hash,
+                               tree_from_file_system)
+from buildlist.history import BuildHistory, BuildRecord, record_build
+from buildlist.merkle import merkle_diff, merkle_digests
+from buildlist import stats
+from buildlist.populate import populate_from_u
+from buildlist.stat_cache import StatCache
+from buildlist.stats import StatsCollector
+from buildlist.store import USaveStats, save_tree_to_u_dir
+from buildlist.uindex import UIndex, note_keys_put
+from buildlist.verify import ListCheck
+from buildlist.walker import iter_tree_lines, walk_leaves
+
 __all__ = ['__version__', '__version_date__',
            # FUNCTIONS
            'check_dirs_in_path',
-           "generate_rsa_key",
-           "read_rsa_key", 'rm_f_dir_contents',
+           "generate_rsa_key", 'project_version',
+           "read_rsa_key", 'rm_f_dir_contents', 'signing_key',
            # PARSER FUNCTIONS
            'accept_content_line',
            'accept_list_line', 'expect_list_line',
@@ -40,7 +60,10 @@ __all__ = ['__version__', '__version_date__',
            'expect_timestamp',
            'expect_title',
            # CLASSES
-           'BuildList',
+           'AgentClient', 'BinaryBuildList', 'BuildHistory', 'BuildList',
+           'BuildRecord', 'CompactTree', 'DataDirCheck', 'DiffEntry',
+           'ListCheck', 'StatCache', 'StatsCollector', 'UIndex',
+           'USaveStats',
            'BLIntegrityCheckFailure', 'BLParseFailed', 'BLError', ]
 
 __version__ = '0.10.9'
@@ -103,6 +126,43 @@ def read_rsa_key(path_to_file):
         key = RSA.importKey(file.read())
     return key
 
+
+def signing_key(key_file, agent_socket=None, agent_fingerprint=None):
+    """
+    Return what list_gen() signs with:  None if key_file is '', an
+    AgentClient if agent_socket is given and a signing agent listening
+    there holds the key expected, and otherwise the key read from
+    key_file.  The agent's key must have agent_fingerprint, if that is
+    given, and otherwise match the key in key_file.  The caller should
+    close an AgentClient when done with it.
+    """
+    if key_file == '':
+        return None
+    if agent_socket:
+        client = connect_agent(key_file, agent_socket, agent_fingerprint)
+        if client is not None:
+            return client
+    return read_rsa_key(key_file)
+
+
+def project_version(dvcz_dir, title):
+    """
+    Return the project version from projConfig.toml in dvcz_dir, or
+    '0.0.0' if there is none, and title with ' vVERSION' appended if
+    there is.
+    """
+    version = '0.0.0'
+#   path_to_version = os.path.join(dvcz_dir, 'version')
+#   if os.path.exists(path_to_version):
+#       with open(path_to_version, 'r') as file:
+#           version = file.readline().strip()
+    path_to_cfg = os.path.join(dvcz_dir, 'projConfig.toml')
+    if os.path.exists(path_to_cfg):
+        pmap = load(path_to_cfg)
+        version = pmap['project']['version']
+        title = title + ' v' + version
+    return version, title
+
 # PARSER ------------------------------------------------------------
 
 
@@ -117,17 +177,24 @@ class BLParseFailed(RuntimeError):
 
 
 def accept_list_line(file):
-    """ Read the next line, drop any terminating character(s), and return. """
+    """
+    Read the next line from file, opened in binary mode, drop any
+    terminating CRLF or LF, and return it as a string.  Returns an empty
+    string at end of file.
+    """
     line = file.readline()
     len_line = len(line)
     if len_line:
-        if line.endswith(BuildList.NEWLINE):
+        if line.endswith(BuildList.CRLF):
             line = line[:len_line - 2]
         elif line.endswith(BuildList.NEWLINE):
             line = line[:len_line - 1]
         else:
             raise BLParseFailed("expected LF")
-    return line
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError:
+        raise BLParseFailed("line is not valid UTF-8")
 
 
 def expect_list_line(file, err_msg):
@@ -139,24 +206,35 @@ def expect_list_line(file, err_msg):
 
 
 def expect_title(file, digest):
-    """ Read the title line, adding it to the SHA hash. """
+    """
+    Read the title line, adding it and a LF to the SHA hash.  Return
+    the title.
+    """
 
     line = expect_list_line(file, "missing title")
     # DEBUG
     # print("TITLE: %s" % line)
     # END
-    digest.update(line)
+    digest.update(line.encode('utf-8') + BuildList.NEWLINE)
+    return line
 
 
 def expect_timestamp(file, digest):
-    """ Read the timestamp, adding it to the SHA hash. """
+    """
+    Read the timestamp, adding it and a LF to the SHA hash.  Return the
+    timestamp as an int.
+    """
 
     line = expect_list_line(file, "missing timestamp")
-    tstamp = parse_timestamp(line)        # can raise ValueError
+    try:
+        tstamp = parse_timestamp(line)
+    except ValueError:
+        raise BLParseFailed("bad timestamp: '%s'" % line)
     # DEBUG
     # print("TIMESTAMP: %s" % tstamp)
     # END
-    digest.update(tstamp)
+    digest.update(line.encode('utf-8') + BuildList.NEWLINE)
+    return tstamp
 
 
 def expect_str(file, string):
@@ -169,17 +247,29 @@ def expect_str(file, string):
     # END
 
 
-def accept_content_line(file, digest, string, root_path, u_path):
+def accept_content_line(file, digest, string, root_path, u_path,
+                        builder=None, failures=None):
     """
     Accept either a content line or a delimiter (string).  Anything else
-    raises an exception.  Returns True if content line matched, False
-    if delimiter detected; otherwise raises a BLParseFailed.
+    raises an exception.  Returns the content line if one was read,
+    False if the delimiter was detected; otherwise raises a
+    BLParseFailed.  A content line is added to the SHA hash together
+    with its LF.
+
+    If builder, a TreeBuilder, is supplied, the content line is added
+    to the tree it is building.  This is required if either root_path
+    or u_path is set, as it tracks the path to each file.
+
+    If root_path is not None, compares the content hash with that of
+    the file at the relative path under root_path.
 
-    NOT IMPLEMENTED: If root_path is not None, compares the content hash
-    with that of the file at the relative path.
+    If u_path is not None, verifies that the content key matches that
+    of a file present in u_path, which may be a path to a UDir or the
+    UDir itself, whole or as chunks.
 
-    NOT IMPLEMENTED: If u_path is not None, verifies that the content key
-    matches that of a file present in u_path.
+    A file failing either check raises a BLIntegrityCheckFailure unless
+    failures is a list, in which case a (path, reason) pair is appended
+    to it instead.
     """
     line = accept_list_line(file)        # may raise BLParseFailed
     if line == string:
@@ -187,25 +277,51 @@ def accept_content_line(file, digest, string, root_path, u_path):
         # print("STR: " + line)
         # END
         return False
+    if not line:
+        raise BLParseFailed("expected content line or " + string)
 
-    # Parse the content line
+    # Parse the content line: either a directory name or a file name
+    # followed by its content hash, in either case indented
     parts = line.split()
-    if len(parts) != 2:
+    if len(parts) not in [1, 2]:
         err_msg = "bad content line: '%s'" % line
         raise BLParseFailed(err_msg)
     # DEBUG
     # print("CONTENT: %s" % line)
     # END
-    digest.update(line)
-
-    # These values are never used:
-    # b64hash = parts[0]
-    # path = parts[1]
+    digest.update(line.encode('utf-8') + BuildList.NEWLINE)
+
+    if builder is None:
+        if root_path or u_path:
+            raise BLError("checking content lines requires a TreeBuilder")
+        return line
+    try:
+        leaf = builder.add_line(line)
+    except ValueError as exc:
+        raise BLParseFailed(str(exc))
+    if leaf is None or not (root_path or u_path):
+        return line
+
+    path, bin_hash = leaf
+    reason = None
+    if u_path:
+        u_dir = u_path if isinstance(u_path, UDir) else UDir.discover(u_path)
+        key = binascii.b2a_hex(bin_hash).decode('utf-8')
+        if not u_dir.exists(key) and \
+                not os.path.exists(path_to_manifest(u_dir.u_path, key)):
+            reason = 'not in U'
+    if root_path and not reason:
+        path_to_file = os.path.join(root_path, path)
+        if not os.path.isfile(path_to_file):
+            reason = 'missing'
+        elif file_bin_hash(path_to_file, builder.hashtype) != bin_hash:
+            reason = 'changed'
+    if reason:
+        if failures is None:
+            raise BLIntegrityCheckFailure("%s: %s" % (path, reason))
+        failures.append((path, reason))
 
-    # XXX NO CHECK AGAINST root_path
-    # XXX NO CHECK AGAINST u_path
-
-    return True
+    return line
 
 # -- CLASSES --------------------------------------------------------
 
@@ -231,6 +347,7 @@ class BuildList(object):
     BLOCK_SIZE = 2**18         # 256KB, for no particular reason
     CONTENT_END = '# END CONTENT #'
     CONTENT_START = '# BEGIN CONTENT #'
+    CRLF = '\r\n'.encode('utf-8')
     NEWLINE = '\n'.encode('utf-8')
 
     # XXX DROP by v1.0.0
@@ -245,7 +362,8 @@ class BuildList(object):
             raise BLError("sk is nil or not a valid RSA public key")
         self._public_key = sk_
 
-        if (not tree) or (not isinstance(tree, NLHTree)):
+        # an empty CompactTree is falsy, so test the type alone
+        if not isinstance(tree, (NLHTree, CompactTree)):
             raise BLError('tree is nil or not a valid NLHTree')
 
         self._tree = tree
@@ -257,6 +375,42 @@ class BuildList(object):
         self._when = 0         # seconds from the Epoch; a 64-bit value
         self._dig_sig = None
         self._ex_re = None
+        self._u_stats = None
+        self._merkle = None     # (tree, directory path -> digest)
+
+    @property
+    def u_stats(self):
+        """
+        Return the USaveStats from the last save_to_u_dir(), or None if
+        the files in this BuildList have not been saved to U.
+        """
+        return self._u_stats
+
+    @u_stats.setter
+    def u_stats(self, value):
+        """ Record how the files were saved to U, if not by this list. """
+        self._u_stats = value
+
+    @property
+    def merkle_digests(self):
+        """
+        Return a dict mapping the path of each directory in the tree to
+        its Merkle digest.  The digests are computed once and kept with
+        the tree they describe until the tree property hands out an
+        NLHTree, which may then be changed in place.
+        """
+        if self._merkle is None or self._merkle[0] is not self._tree:
+            self._merkle = (self._tree, merkle_digests(self._tree))
+        return self._merkle[1]
+
+    @property
+    def root_digest(self):
+        """
+        Return the Merkle digest of the whole tree.  Two BuildLists with
+        the same hashtype have the same content exactly when their root
+        digests are equal.
+        """
+        return self.merkle_digests['']
 
     @property
     def dig_sig(self):
@@ -309,7 +463,13 @@ class BuildList(object):
 
     @property
     def tree(self):
-        """ Return the NLHTree associated with this BuildList. """
+        """
+        Return the NLHTree associated with this BuildList.  An NLHTree
+        can be changed in place by the caller, so the Merkle digests
+        kept for it are dropped.
+        """
+        if not isinstance(self._tree, CompactTree):
+            self._merkle = None
         return self._tree
 
     @property
@@ -327,65 +487,139 @@ class BuildList(object):
         # Xxx validation
         self._when = value
 
-    def _get_build_list_sha1(self):
-        sha = SHA.new()
-        # add public key and then LF to hash
-        pem_ck = self._public_key.exportKey('PEM')
-        sha.update(pem_ck)
-        sha.update(BuildList.NEWLINE)
+    def _signed_lines(self):
+        """
+        Yield the fields covered by the digital signature, in order and
+        without line endings.  The digest is taken over each of these
+        followed by a LF; the serialization is these joined by LFs,
+        followed by a LF and the signature if the list is signed.
+        """
 
-        # add title and LF to hash
-        sha.update(self._title.encode('utf-8'))
-        sha.update(BuildList.NEWLINE)
+        # public key (with embedded newlines)
+        yield self._public_key.exportKey('PEM').decode('utf-8')
+
+        # title
+        yield self._title
 
-        # add timestamp and LF to hash
-        sha.update(self.timestamp.encode('utf-8'))
-        sha.update(BuildList.NEWLINE)
+        # timestamp
+        yield self.timestamp
 
-        # add CONTENT_START and LF line to hash
-        sha.update((BuildList.CONTENT_START + '\n').encode('utf-8'))
+        # content start line
+        yield BuildList.CONTENT_START
 
-        # add serialized NLHTree to hash, each line terminated by LF
-        sha.update(self._tree.__str__().encode('utf-8'))
+        # NLHTree, a line at a time
+        yield from iter_tree_lines(self._tree)
 
-        # add CONTENT_END and LF line to hash
-        sha.update((BuildList.CONTENT_END + '\n').encode('utf-8'))
+        # content end line
+        yield BuildList.CONTENT_END
 
-        # add LF to hash
-        sha.update(BuildList.NEWLINE)
+        # empty line
+        yield ''
+
+    def _get_build_list_sha1(self):
+        sha = SHA.new()
+        # add each signed field and then LF to hash, without ever
+        # rendering the tree as a whole
+        for line in self._signed_lines():
+            sha.update(line.encode('utf-8'))
+            sha.update(BuildList.NEWLINE)
         return sha
 
-    def sign(self, sk_priv):
+    def _check_signing_key(self, sk_priv):
         """
-        Sign the BuildList using the RSA private key.
-
-        sk_priv is the RSA private key used for siging the BuildList.
+        Raise unless the BuildList is unsigned and sk_priv is the RSA
+        private key matching its public key, or an AgentClient holding
+        that key.
         """
 
         if self._dig_sig is not None:
             raise BLError("buildlist has already been signed")
+        self._check_key_matches(sk_priv)
 
-        # Verify that the public key (sk) is the public part of sk_priv,
-        # the private RSA key.
+    def _check_key_matches(self, sk_priv):
+        """
+        Raise unless sk_priv, an RSA private key or AgentClient, matches
+        the BuildList's public key.
+        """
         # pylint: disable=protected-access
-        if (not sk_priv) or (not isinstance(sk_priv, RSA._RSAobj)):
+        if (not sk_priv) or (not isinstance(sk_priv, (RSA._RSAobj,
+                                                      AgentClient))):
             raise BLError("sk_priv is nil or not a valid RSA key")
         if sk_priv.publickey() != self._public_key:
             raise BLError("sk_priv does not match BuildList's public key")
 
+    @staticmethod
+    def _signer(sk_priv):
+        """
+        Return an object whose sign() method signs a SHA digest with
+        sk_priv: an AgentClient signs for itself.
+        """
+        if isinstance(sk_priv, AgentClient):
+            return sk_priv
+        return PKCS1_PSS.new(sk_priv)
+
+    def sign(self, sk_priv):
+        """
+        Sign the BuildList using the RSA private key.
+
+        sk_priv is the RSA private key used for siging the BuildList,
+        or an AgentClient connected to a signing agent holding it.
+        """
+
+        self._check_signing_key(sk_priv)
+
         # the time is part of what is signed, so we need to set it now
         # XXX truncating loses microseconds
         now = int(time.time())      # seconds from Epoch
         self._when = now
 
-        sha = self._get_build_list_sha1()
+        with stats.phase('sign'):
+            sha = self._get_build_list_sha1()
 
-        # Sign the list using SHA1 and RSA.  What we are signing is the
-        # in-memory binary data structure.
-        signer = PKCS1_PSS.new(sk_priv)
-        self._dig_sig = signer.sign(sha)
+            # Sign the list using SHA1 and RSA.  What we are signing is
+            # the in-memory binary data structure.
+            self._dig_sig = self._signer(sk_priv).sign(sha)
+
+    def _get_root_sha1(self):
+        """
+        Return the digest signed by sign_root(): public key, title,
+        timestamp, and the root Merkle digest in hex, each followed by
+        a LF.
+        """
+        sha = SHA.new()
+        for field in [self._public_key.exportKey('PEM').decode('utf-8'),
+                      self._title, self.timestamp,
+                      binascii.b2a_hex(self.root_digest).decode('utf-8')]:
+            sha.update(field.encode('utf-8'))
+            sha.update(BuildList.NEWLINE)
+        return sha
 
-    def verify(self):
+    def sign_root(self, sk_priv):
+        """
+        Return a base64-encoded RSA signature over the public key, title,
+        timestamp and root Merkle digest.  This is independent of the
+        signature over the full serialization and is not part of it;
+        it is for callers which keep it alongside, and can be checked
+        with verify_root() without serializing the tree.  Sign the
+        BuildList first: sign() resets the timestamp.
+        """
+        self._check_key_matches(sk_priv)
+        sig = self._signer(sk_priv).sign(self._get_root_sha1())
+        return base64.b64encode(sig).decode('utf-8')
+
+    def verify_root(self, root_sig):
+        """
+        Check root_sig, as returned by sign_root(), against this
+        BuildList.
+        """
+        try:
+            sig = base64.b64decode(root_sig)
+        except (binascii.Error, TypeError, ValueError):
+            return False
+        return PKCS1_PSS.new(self.public_key).verify(
+            self._get_root_sha1(), sig)
+
+    def verify(self, sha=None):
         """
         Check that the BuildList is signed and the signature is correct.
 
@@ -394,24 +628,34 @@ class BuildList(object):
         document and the SHA1 hash of the serialized document, taking
         the hash over the fields in standard order (pubkey, title,
         timestamp, and content lines).
+
+        sha may be the digest computed by parse_stream(), in which case
+        the hash is not recomputed.
         """
         success = False
 
         if self._dig_sig:
 
-            sha = self._get_build_list_sha1()
-            verifier = PKCS1_PSS.new(self.public_key)
-            success = verifier.verify(sha, self._dig_sig)
+            with stats.phase('verify'):
+                if sha is None:
+                    sha = self._get_build_list_sha1()
+                verifier = PKCS1_PSS.new(self.public_key)
+                success = verifier.verify(sha, self._dig_sig)
 
         return success
 
     # EQUALITY ------------------------------------------------------
     def __eq__(self, other):
+        # pylint: disable=protected-access
         if (not other) or (not isinstance(other, BuildList)) or \
                 self.title != other.title or \
                 self.public_key != other.public_key:
             return False
-        if self.tree != other.tree or \
+        # comparing root Merkle digests is O(1) once they are known;
+        # the root digest does not cover the root's name
+        if self.hashtype != other.hashtype or \
+                self._tree.name != other._tree.name or \
+                self.root_digest != other.root_digest or \
                 self._when != other.when:
             return False
 
@@ -427,17 +671,26 @@ class BuildList(object):
     @staticmethod
     def create_from_file_system(title, path_to_dir, sk_,
                                 hashtype=HashTypes.SHA2,
-                                ex_re=None, match_re=None):
-        """ Create a BuildList describing a particular directory. """
+                                ex_re=None, match_re=None, workers=1,
+                                cache=None):
+        """
+        Create a BuildList describing a particular directory.
+
+        If workers is greater than one, file contents are hashed using
+        a pool of that many threads.  If cache, a StatCache, is supplied,
+        files which have not changed since they were last hashed are
+        not read.  Either way the resulting tree is the same.
+        """
 
         _ = match_re            # UNUSED, SUPPRESS WARNING
         if (not path_to_dir) or (not os.path.isdir(path_to_dir)):
             raise BLError(
                 "%s does not exist or is not a directory" % path_to_dir)
 
-        tree = NLHTree.create_from_file_system(path_to_dir,
-                                               # accept default deltaIndent
-                                               hashtype=hashtype, ex_re=ex_re)
+        tree = tree_from_file_system(path_to_dir,
+                                     # accept default deltaIndent
+                                     hashtype=hashtype, ex_re=ex_re,
+                                     workers=workers, cache=cache)
         return BuildList(title, sk_, tree)
 
     @staticmethod
@@ -454,6 +707,106 @@ class BuildList(object):
         strings = string.split('\n')
         return BuildList.parse_from_strings(strings, hashtype)
 
+    @staticmethod
+    def parse_stream(file, hashtype, root_path=None, u_path=None,
+                     failures=None, digest=None, compact=False):
+        """
+        Parse a BuildList read line by line from file, which must have
+        been opened in binary mode.  The serialization is never held in
+        memory as a whole: content lines are added to the NLHTree as
+        they are read.
+
+        As each file is read, if root_path is set the file's content
+        hash is checked against the file under that directory, and if
+        u_path is set the content key is looked for in U.  Failures
+        raise BLIntegrityCheckFailure unless failures is a list, in
+        which case (path, reason) pairs are appended to it.
+
+        If digest, a fresh Crypto.Hash.SHA object, is supplied, the
+        signed fields are fed to it as they are read, so that it can be
+        passed to verify() without another pass over the tree.
+
+        If compact is set, the content is kept in a CompactTree rather
+        than an NLHTree, which takes a fraction of the memory.
+        """
+
+        check_hashtype(hashtype)
+        if digest is None:
+            digest = SHA.new()
+        if u_path and not isinstance(u_path, UDir):
+            u_path = UDir.discover(u_path)
+
+        # expect a PEM-encoded public key with embedded newlines
+        line = expect_list_line(file, "missing public key")
+        if not line.startswith('-----BEGIN'):
+            raise BLParseFailed("expected PEM-encoded public key")
+        pem_lines = [line]
+        while not line.startswith('-----END'):
+            line = expect_list_line(file, "incomplete public key")
+            pem_lines.append(line)
+        try:
+            my_ck = RSA.importKey('\n'.join(pem_lines))
+        except (ValueError, IndexError, TypeError):
+            raise BLParseFailed("can't import public key")
+        digest.update(my_ck.exportKey('PEM'))
+        digest.update(BuildList.NEWLINE)
+
+        my_title = expect_title(file, digest)
+        my_when = expect_timestamp(file, digest)
+
+        # expect CONTENT-START
+        start_line = expect_list_line(file, "expected BEGIN CONTENT line")
+        if (start_line != BuildList.CONTENT_START) and\
+                (start_line != BuildList.OLD_CONTENT_START):
+            raise BLParseFailed("expected BEGIN CONTENT line")
+        digest.update((BuildList.CONTENT_START + '\n').encode('utf-8'))
+
+        # expect a serialized NLHTree followed by a CONTENT END
+        if compact:
+            builder = CompactTreeBuilder(hashtype)
+        else:
+            builder = TreeBuilder(hashtype)
+        while True:
+            line = accept_content_line(file, digest, BuildList.CONTENT_END,
+                                       root_path, u_path, builder, failures)
+            if line is False:
+                break
+        if builder.tree is None:
+            raise BLParseFailed("BuildList has no content")
+        digest.update((BuildList.CONTENT_END + '\n').encode('utf-8'))
+
+        # expect an empty line; to_string() drops it if unsigned
+        space = file.readline()
+        if space and space != BuildList.NEWLINE and space != BuildList.CRLF:
+            raise BLParseFailed("expected an empty line")
+        digest.update(BuildList.NEWLINE)
+
+        # accept a digital signature if it is present
+        my_dig_sig = file.readline().strip()
+
+        bld = BuildList(my_title, my_ck, builder.tree)
+        bld.when = my_when
+        if my_dig_sig:
+            try:
+                bld.dig_sig = binascii.a2b_base64(my_dig_sig)
+            except binascii.Error:
+                raise BLParseFailed("bad digital signature")
+        return bld
+
+    @staticmethod
+    def parse_from_u(u_path, key, hashtype, **kwargs):
+        """
+        Parse the BuildList with the content key given from U.  If it
+        was stored as a delta, it is reconstructed first and checked
+        against the key, raising BLIntegrityCheckFailure on mismatch.
+        Other keyword arguments are passed to parse_stream().
+        """
+        try:
+            data = read_list(u_path, key, hashtype)
+        except RuntimeError as exc:
+            raise BLIntegrityCheckFailure(str(exc))
+        return BuildList.parse_stream(io.BytesIO(data), hashtype, **kwargs)
+
     @staticmethod
     def _expect_field(strings, ndx):
         """
@@ -544,43 +897,87 @@ class BuildList(object):
 
     def to_strings(self):
         """ Serialize the BuildList as an array of strings. """
+        return list(self.iter_lines())
 
-        strings = []
-
-        # public key (with embedded newlines)
-        pem_ck = self.public_key.exportKey('PEM').decode('utf-8')
-        strings.append(pem_ck)
-
-        # title
-        strings.append(self.title)
-
-        # timestamp
-        strings.append(self.timestamp)
-
-        # content start line
-        strings.append(BuildList.CONTENT_START)
+    def iter_lines(self):
+        """
+        Yield the serialized BuildList one field at a time, without line
+        endings.  The first field is the PEM-encoded public key, which
+        has embedded newlines; each content line is a separate field.
+        """
 
-        # NLHTree
-        # XXX use self.tree.to_strings and then extend(), yes ?
-        tree_lines = self.tree.__str__().split('\n')
-        if (len(tree_lines) > 1) and (tree_lines[-1] == ''):
-            tree_lines = tree_lines[0:-1]
-        strings += tree_lines
+        yield from self._signed_lines()
 
-        # content end line
-        strings.append(BuildList.CONTENT_END)
+        # dig sig
+        if self._dig_sig:
+            yield self.dig_sig
 
-        # empty line
-        strings.append('')
+    def write_to(self, file, sk_priv=None):
+        """
+        Write the serialized BuildList, exactly to_string() encoded as
+        UTF-8, to file, which must be open in binary mode.  Fields are
+        written as they are generated.  Returns the number of bytes
+        written.
+
+        If sk_priv is supplied the BuildList is signed as it is written,
+        exactly as sign() would sign it, the signature digest being
+        taken in the same pass over the tree.  Wrap file in a
+        HashingWriter to compute the content hash at the same time.
+        """
+        sha = None
+        if sk_priv is not None:
+            self._check_signing_key(sk_priv)
+            # XXX truncating loses microseconds
+            self._when = int(time.time())
+            sha = SHA.new()
+
+        count = 0
+        for line in self._signed_lines():
+            if count:
+                file.write(BuildList.NEWLINE)
+                count += 1
+            data = line.encode('utf-8')
+            file.write(data)
+            count += len(data)
+            if sha is not None:
+                sha.update(data)
+                sha.update(BuildList.NEWLINE)
+
+        if sha is not None:
+            with stats.phase('sign'):
+                self._dig_sig = self._signer(sk_priv).sign(sha)
 
         # dig sig
         if self._dig_sig:
-            strings.append(self.dig_sig)
-
-        return strings
+            data = BuildList.NEWLINE + self.dig_sig.encode('utf-8')
+            file.write(data)
+            count += len(data)
+        return count
 
     # OTHER CONSTRUCTORS --------------------------------------------
 
+    def write_binary(self, file):
+        """
+        Write the BuildList to file, opened in binary mode, in the
+        memory-mappable binary form read by BinaryBuildList.  Returns
+        the number of bytes written.
+        """
+        return write_binary(self, file)
+
+    @staticmethod
+    def from_binary(path_to_file):
+        """
+        Recover the BuildList from a file written by write_binary().
+        Its text serialization, and so its signature, are unchanged.
+        """
+        with BinaryBuildList(path_to_file) as bbl:
+            bld = BuildList(bbl.title, RSA.importKey(bbl.public_key_pem),
+                            bbl.build_tree())
+            bld.when = bbl.when
+            if bbl.dig_sig:
+                bld.dig_sig = bbl.dig_sig
+        return bld
+
     @classmethod
     def list_gen(cls, title, data_dir,
                  dvcz_dir='.dvcz',
@@ -591,7 +988,14 @@ class BuildList(object):
                  logging=False,
                  u_path='',
                  hashtype=HashTypes.SHA1,     # NOTE default is SHA1
-                 using_indir=False):
+                 using_indir=False,
+                 workers=1,
+                 use_cache=True,
+                 rehash=False,
+                 use_delta=False,
+                 agent_socket=None,
+                 chunk_threshold=0,
+                 agent_fingerprint=None):
         """
         Create a BuildList for data_dir with the title indicated.
 
@@ -606,6 +1010,26 @@ class BuildList(object):
         By default SHA1 hash will be used for the digital
         signature.
 
+        If workers is greater than one, files are hashed in parallel
+        using that many threads.
+
+        Unless use_cache is False, content hashes are kept in a StatCache
+        in dvcz_dir and files whose size, mtime, and inode are unchanged
+        are not rehashed.  If rehash is set, every file is hashed and the
+        cache is rebuilt.
+
+        If use_delta is set and the previous list in dvcz_dir is in U,
+        the new list may be put into U as a delta against it.
+
+        If agent_socket is given and a signing agent holding the key is
+        listening there, the list is signed by the agent.  Its public key
+        must have agent_fingerprint if that is given, in which case the
+        key file is not read; otherwise it must match the key in key_file.
+        By default no agent is used.
+
+        If chunk_threshold is set, files of at least that many bytes are
+        put into U as content-defined chunks rather than whole.
+
         If there is a title, we try to read the version number from
         the first line of .dvcz/version.  If that exists, we append
         a space and then the version number to the title.
@@ -614,92 +1038,119 @@ class BuildList(object):
         # print("DEBUG: ENTERING list_gen")
         # END
         _ = using_indir     # USUSED: SUPPRESS WARNING
-        version = '0.0.0'
-#       path_to_version = os.path.join(dvcz_dir, 'version')
-#       if os.path.exists(path_to_version):
-#           with open(path_to_version, 'r') as file:
-#               version = file.readline().strip()
-        path_to_cfg = os.path.join(dvcz_dir, 'projConfig.toml')
-        if os.path.exists(path_to_cfg):
-            with open(path_to_cfg, 'r') as file:
-                pmap = load(path_to_cfg)
-                version = pmap['project']['version']
-            title = title + ' v' + version
-            # DEBUG
-            # print("title with version is '%s'" % title)
-            # END
+        version, title = project_version(dvcz_dir, title)
 
         ex_re = make_ex_re(excl)
-        signing = key_file != ''
-        if signing:
-            with open(key_file, 'r') as file:
-                sk_priv = RSA.importKey(file.read())
-            sk_ = sk_priv.publickey()
-        else:
-            sk_ = None
-        blist = cls.create_from_file_system(
-            title, data_dir, sk_, hashtype, ex_re, match_re=None)
-        if signing:
-            blist.sign(sk_priv)
-
-        new_data = blist.__str__().encode('utf-8')
-        if hashtype == HashTypes.SHA1:
-            sha = hashlib.sha1()
-        elif hashtype == HashTypes.SHA2:
-            sha = hashlib.sha256()
-        elif hashtype == HashTypes.SHA3:
-            # pylint: disable=maybe-no-member
-            sha = hashlib.sha3_256()
-        elif hashtype == HashTypes.BLAKE2B:
-            sha = hashlib.blake2b(digest_size=32)
-        else:
-            raise NotImplementedError
-        sha.update(new_data)
-        new_hash = sha.hexdigest()
+        sk_priv = signing_key(key_file, agent_socket, agent_fingerprint)
+        sk_ = sk_priv.publickey() if sk_priv is not None else None
+        try:
+            with stats.phase('stat_cache'):
+                cache = StatCache.load(dvcz_dir, rehash) if use_cache \
+                    else None
+            blist = cls.create_from_file_system(
+                title, data_dir, sk_, hashtype, ex_re, match_re=None,
+                workers=workers, cache=cache)
+            if cache is not None:
+                with stats.phase('stat_cache'):
+                    cache.save()
+            blist.write_list(dvcz_dir, list_file, sk_priv, hashtype,
+                             u_path, data_dir, use_delta, logging, version,
+                             chunk_threshold)
+        finally:
+            if isinstance(sk_priv, AgentClient):
+                sk_priv.close()
+        return blist
+
+    def write_list(self, dvcz_dir, list_file, sk_priv, hashtype,
+                   u_path='', data_dir=None, use_delta=False,
+                   logging=False, version='0.0.0', chunk_threshold=0):
+        """
+        Sign the BuildList with sk_priv, unless that is None, and write
+        it to list_file in dvcz_dir, as list_gen() does.  If u_path is
+        set the list is put into U, together with the files from
+        data_dir if that is set, and if logging is set the list's
+        content key is appended to the builds log in dvcz_dir.  Returns
+        the content key of the serialization.  Files of chunk_threshold
+        bytes or more, if that is set, are put into U as chunks.
+        """
+
+        # serialize the BuildList to a temporary file, signing it and
+        # computing its content hash in the same pass
         path_to_listing = os.path.join(dvcz_dir, list_file)
+        path_to_tmp = path_to_listing + '.tmp'
+        sha = new_hash(hashtype)
+        with stats.phase('serialize'):
+            with open(path_to_tmp, 'wb') as file:
+                length = self.write_to(HashingWriter(file, sha), sk_priv)
+            stats.count('serialize', files=1, bytes_written=length)
+        list_hash = sha.hexdigest()
 
         if u_path:
 
-            blist.tree.save_to_u_dir(data_dir, u_path, hashtype)
-
             # insert this BuildList into U
             # DEBUG
             # print("writing BuildList with hash %s into %s" %
-            #       (new_hash, u_path))
+            #       (list_hash, u_path))
             # END
-            u_dir = UDir.discover(u_path)
+            if data_dir:
+                self.save_to_u_dir(data_dir, u_path, chunk_threshold)
             # DEBUG
             # print("list_gen:")
             # print("  uDir:      %s" % u_path)
-            # print("  dirStruc:  %s" % UDir.dir_struc_to_name(uDir.dirStruc))
-            # print("  hashtype:  %s" % uDir.hashtype)
             # END
-            (_, hash_back) = u_dir.put_data(new_data, new_hash)
-            if hash_back != new_hash:
-                print("WARNING: wrote %s to %s, but actual hash is %s" % (
-                    new_hash, u_path, hash_back))
+            base = base_key = None
+            if use_delta and os.path.exists(path_to_listing):
+                with open(path_to_listing, 'rb') as file:
+                    base = file.read()
+                base_sha = new_hash(hashtype)
+                base_sha.update(base)
+                base_key = base_sha.hexdigest()
+            with stats.phase('u_write'):
+                hash_back = put_list(u_path, path_to_tmp, list_hash,
+                                     base, base_key)
+            if hash_back is not None:
+                if hash_back != list_hash:
+                    print("WARNING: wrote %s to %s, but actual hash is %s" % (
+                        list_hash, u_path, hash_back))
+                note_keys_put(u_path, [hash_back])
 
         # CHANGES TO DATADIR AFTER UPDATING u_path ===================
 
-        # serialize the BuildList, typically to .dvcz/lastBuildList
-        with open(path_to_listing, 'wb+') as file:
-            file.write(new_data)
+        # the serialized BuildList becomes, typically, .dvcz/lastBuildList
+        os.replace(path_to_tmp, path_to_listing)
 
         # DEBUG
-        # print("hash of buildlist at %s is %s" % (path_to_listing, new_hash))
+        # print("hash of buildlist at %s is %s" % (path_to_listing, list_hash))
         # END
         if logging:
             path_to_log = os.path.join(dvcz_dir, 'builds')
             with open(path_to_log, 'a') as file:
                 file.write("%s v%s %s\n" %
-                           (blist.timestamp, version, new_hash))
+                           (self.timestamp, version, list_hash))
+            record_build(dvcz_dir)
 
-        return blist
+        return list_hash
 
-    def populate_data_dir(self, u_path, data_path):
+    def save_to_u_dir(self, data_dir, u_path, chunk_threshold=0):
+        """
+        Copy the files in this BuildList from data_dir into the
+        content-keyed store at u_path, skipping those whose content is
+        already there.  Returns a USaveStats, also kept as u_stats.
+        """
+        with stats.phase('u_write'):
+            self._u_stats = save_tree_to_u_dir(self._tree, data_dir, u_path,
+                                               chunk_threshold)
+        return self._u_stats
+
+    def populate_data_dir(self, u_path, data_path, workers=1):
         """
         Given a BuildList and a content-keyed directory at u_path,
         populate a data directory with the files in the BuildList.
+
+        If workers is greater than one, files are copied out of U by a
+        pool of that many threads.  The directory produced is the same.
+        Files stored as chunks are reassembled and compressed files
+        decompressed.
         """
         # u_path path to U, including directory name
         # data_path, path to data_dir, including directory name (which
@@ -709,13 +1160,14 @@ class BuildList(object):
             raise RuntimeError("u_path %s does not exist" % u_path)
 
         rel_path, _, name = data_path.rpartition('/')
-        if name != self.tree.name:
+        if name != self._tree.name:
             raise RuntimeError(
                 "name mismatch: tree name %s but data_dir name %s" % (
-                    self.tree.name, name))
+                    self._tree.name, name))
 
         os.makedirs(rel_path, exist_ok=True, mode=0o755)
-        self.tree.populate_data_dir(u_path, rel_path)
+        with stats.phase('populate'):
+            populate_from_u(self._tree, u_path, rel_path, workers or 1)
 
     # OTHER METHODS =================================================
 
@@ -725,12 +1177,46 @@ class BuildList(object):
         data directory named.  Returns a list of content hashes for
         files not found.
         """
-        return self.tree.check_in_data_dir(data_path)
+        return self._tree.check_in_data_dir(data_path)
+
+    def check_data_dir(self, data_path, ex_re=None, cache=None, workers=1):
+        """
+        Compare the BuildList with the data directory named, file by
+        file, returning a DataDirCheck listing the relative paths of
+        files missing from the directory, extra files in it, and files
+        whose content has changed.  Files present in both are hashed,
+        using a pool of threads if workers is greater than one, unless
+        cache, a StatCache, shows that they are unchanged.
+        """
+        with stats.phase('check_data_dir'):
+            return check_tree_against_dir(self._tree, data_path, ex_re,
+                                          cache, workers)
 
-    def check_in_u_dir(self, u_path):
+    def diff(self, other):
+        """
+        Yield a DiffEntry for each file added, removed, or changed in
+        going from this BuildList to other, in tree order.  Directories
+        whose Merkle digests match are not descended into; if the lists
+        use different hashtypes the two trees are merged in full.
+        """
+        # pylint: disable=protected-access
+        # other._tree, as other.tree would drop the digests kept for it
+        if self.hashtype != other.hashtype:
+            return diff_trees(self._tree, other._tree)
+        return merkle_diff(self._tree, self.merkle_digests,
+                           other._tree, other.merkle_digests)
+
+    def check_in_u_dir(self, u_path, verify=False):
         """
         Whether the BuildList's component files are present in the
         U directory named.  Returns a list of content hashes for
-        files not found.
+        files not found.  The keys are looked up together in U's index
+        if it has one.  A file stored as chunks is present if it has a
+        manifest; if verify is set, it is reassembled in memory and is
+        missing unless it hashes to its key.
         """
-        return self.tree.check_in_u_dir(u_path)
+        with stats.phase('check_in_u_dir'):
+            keys = [binascii.b2a_hex(bin_hash).decode('utf-8')
+                    for _, bin_hash in walk_leaves(self._tree)]
+            stats.count('check_in_u_dir', files=len(keys))
+            return find_missing_files(u_path, keys, verify=verify)
@@ -0,0 +1,311 @@
+# buildlist/agent.py
+
+"""
+A long-lived signing agent holding an RSA private key in memory.
+
+Signing a BuildList otherwise means reading and importing the private
+key each time.  The agent imports it once, prepares a PKCS1_PSS signer,
+and answers requests from clients on a Unix socket.  Requests and
+replies are lines of text:
+
+    INFO                one line of JSON: key_file, public_key, version
+    SIGN N              followed by N lines, each the hex SHA1 digest
+                        of a BuildList; replied to with OK N and N
+                        lines, each a base64 signature, in order
+
+Any other request, or a malformed one, is answered with ERR and a
+message.  A client may make any number of requests on one connection.
+The socket is created readable and writable by its owner only: anyone
+who can connect to it can have digests signed.  A client checks that
+the agent's public key is the one it expects, either that of the key
+file it would otherwise read or one with a fingerprint pinned in
+advance, before using it.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+from Crypto.Hash import SHA
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_PSS
+
+__all__ = ['AGENT_FINGERPRINT_ENV', 'AGENT_SOCK_ENV', 'AgentClient',
+           'SigningAgent', 'connect_agent', 'default_socket_path',
+           'key_fingerprint', ]
+
+AGENT_FINGERPRINT_ENV = 'BL_AGENT_FINGERPRINT'
+AGENT_SOCK_ENV = 'BL_AGENT_SOCK'
+SOCKET_NAME = 'bl_agent.sock'
+MAX_BATCH = 65536
+
+
+def default_socket_path():
+    """
+    Return the path to the agent's socket:  $BL_AGENT_SOCK if that is
+    set, otherwise bl_agent.sock beside the keys in $DVCZ_PATH_TO_KEYS.
+    """
+    path = os.environ.get(AGENT_SOCK_ENV)
+    if path:
+        return path
+    return os.path.join(os.environ.get('DVCZ_PATH_TO_KEYS', '.'), SOCKET_NAME)
+
+
+def key_fingerprint(key):
+    """
+    Return the fingerprint of an RSA key, public or private:  the hex
+    SHA256 digest of its public part in DER.
+    """
+    return hashlib.sha256(key.publickey().exportKey('DER')).hexdigest()
+
+
+def _agent_answers(socket_path):
+    """ Whether something accepts connections on the socket. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class _Digest(object):
+    """
+    Stand in for a Crypto.Hash.SHA object whose digest is already known,
+    which is all that PKCS1_PSS needs of the hash it signs.
+    """
+
+    digest_size = SHA.digest_size
+
+    def __init__(self, digest):
+        self._digest = digest
+
+    def digest(self):
+        """ Return the digest given. """
+        return self._digest
+
+    @staticmethod
+    def new(data=None):
+        """ Return a fresh SHA object, as the mask generator requires. """
+        return SHA.new(data)
+
+
+class SigningAgent(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """
+    Serve signatures by the RSA private key in key_file on a Unix
+    socket at socket_path.  Call serve_forever() to run it.  Raises
+    RuntimeError if something is already listening at socket_path, or
+    there is something other than a socket there.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, key_file, socket_path):
+        # pylint: disable=cyclic-import
+        from buildlist import __version__, read_rsa_key
+
+        self._key_file = os.path.realpath(key_file)
+        self._sk_priv = read_rsa_key(key_file)
+        self._signer = PKCS1_PSS.new(self._sk_priv)
+        self.fingerprint = key_fingerprint(self._sk_priv)
+        self._lock = threading.Lock()
+        self._info = json.dumps({
+            'key_file': self._key_file,
+            'public_key': self._sk_priv.publickey().exportKey(
+                'PEM').decode('utf-8'),
+            'version': __version__})
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise RuntimeError("%s is not a socket" % socket_path)
+            if _agent_answers(socket_path):
+                raise RuntimeError(
+                    "an agent is already listening on %s" % socket_path)
+            os.unlink(socket_path)      # left over from an earlier agent
+        old_mask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _AgentHandler)
+        finally:
+            os.umask(old_mask)
+        self.socket_path = socket_path
+
+    @property
+    def info(self):
+        """ Return the reply to INFO. """
+        return self._info
+
+    def sign_digests(self, digests):
+        """ Return the signatures for a list of binary SHA1 digests. """
+        with self._lock:
+            return [self._signer.sign(_Digest(digest)) for digest in digests]
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+    """ Answer the requests made on one connection. """
+
+    def reply(self, line):
+        """ Send a line back to the client. """
+        self.wfile.write(line.encode('utf-8') + b'\n')
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            parts = line.decode('utf-8', 'replace').split()
+            if parts == ['INFO']:
+                self.reply(self.server.info)
+            elif len(parts) == 2 and parts[0] == 'SIGN' and \
+                    parts[1].isdigit() and int(parts[1]) <= MAX_BATCH:
+                count = int(parts[1])
+                try:
+                    digests = [binascii.a2b_hex(self.rfile.readline().strip())
+                               for _ in range(count)]
+                except (binascii.Error, ValueError):
+                    self.reply('ERR bad digest')
+                    continue
+                if any(len(digest) != SHA.digest_size for digest in digests):
+                    self.reply('ERR bad digest')
+                    continue
+                sigs = self.server.sign_digests(digests)
+                self.reply('OK %d' % count)
+                for sig in sigs:
+                    self.reply(base64.b64encode(sig).decode('utf-8'))
+            else:
+                self.reply('ERR unknown request')
+            self.wfile.flush()
+
+
+class AgentClient(object):
+    """
+    A connection to a SigningAgent.  Can be passed to BuildList.sign()
+    and write_to() in place of the private key.
+    """
+
+    def __init__(self, socket_path=None, timeout=30):
+        if socket_path is None:
+            socket_path = default_socket_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.connect(socket_path)
+        except OSError:
+            self._sock.close()
+            raise
+        self._file = self._sock.makefile('rwb')
+        info = json.loads(self._request(['INFO'])[0])
+        self._key_file = info['key_file']
+        self._public_key = RSA.importKey(info['public_key'])
+
+    def _request(self, lines, reply_count=1):
+        """ Send the lines, returning reply_count lines of reply. """
+        self._file.write(b''.join(line.encode('utf-8') + b'\n'
+                                  for line in lines))
+        self._file.flush()
+        replies = []
+        for _ in range(reply_count):
+            line = self._file.readline()
+            if not line:
+                raise RuntimeError("signing agent closed the connection")
+            line = line.decode('utf-8').rstrip('\n')
+            if line.startswith('ERR'):
+                raise RuntimeError("signing agent: %s" % line[4:])
+            replies.append(line)
+        return replies
+
+    @property
+    def key_file(self):
+        """ Return the real path of the key file the agent holds. """
+        return self._key_file
+
+    @property
+    def public_key(self):
+        """ Return the public part of the agent's key. """
+        return self._public_key
+
+    def publickey(self):
+        """ Return the public key, as an RSA private key would. """
+        return self._public_key
+
+    def sign_digests(self, digests):
+        """
+        Return the PKCS1_PSS signatures over a batch of binary SHA1
+        digests, in order, in one round trip per MAX_BATCH digests.
+        """
+        sigs = []
+        for start in range(0, len(digests), MAX_BATCH):
+            batch = digests[start:start + MAX_BATCH]
+            lines = ['SIGN %d' % len(batch)]
+            lines.extend(binascii.b2a_hex(digest).decode('utf-8')
+                         for digest in batch)
+            replies = self._request(lines, len(batch) + 1)
+            if replies[0] != 'OK %d' % len(batch):
+                raise RuntimeError(
+                    "unexpected reply from signing agent: %s" % replies[0])
+            sigs.extend(base64.b64decode(reply) for reply in replies[1:])
+        return sigs
+
+    def sign(self, sha):
+        """
+        Return the signature over sha, a Crypto.Hash.SHA object, as
+        PKCS1_PSS.new(key).sign(sha) would.
+        """
+        return self.sign_digests([sha.digest()])[0]
+
+    def close(self):
+        """ Close the connection. """
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def connect_agent(key_file=None, socket_path=None, fingerprint=None):
+    """
+    Return an AgentClient connected to the agent at socket_path, or at
+    the default path, if one is running there and holds the key
+    expected, and otherwise None.  If fingerprint is given, the agent's
+    public key must have that fingerprint; if not and key_file is, it
+    must be the public part of the key read from key_file.
+    """
+    # pylint: disable=cyclic-import
+    from buildlist import read_rsa_key
+
+    if socket_path is None:
+        socket_path = default_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        client = AgentClient(socket_path)
+    except (OSError, RuntimeError, ValueError):
+        return None
+    if fingerprint:
+        expected = fingerprint.lower()
+    elif key_file:
+        try:
+            expected = key_fingerprint(read_rsa_key(key_file))
+        except (OSError, ValueError):
+            expected = None
+    else:
+        return client
+    if key_fingerprint(client.public_key) != expected:
+        client.close()
+        return None
+    return client
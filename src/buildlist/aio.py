@@ -0,0 +1,253 @@
+# buildlist/aio.py
+
+"""
+Coroutines generating a BuildList, populating a data directory from U,
+and checking that a list's files are in U, for use from asyncio.
+
+Each does what the blocking function or method of the same name less
+the leading 'a' does, and returns the same result, but does its file
+I/O and hashing in a pool of at most workers threads, one file to a
+job, so that the event loop is never blocked.  The directory walk,
+signing, and serialization are single jobs.  No more than workers jobs
+are outstanding at a time, however large the tree.
+
+Cancelling one of these cancels the jobs not yet started and raises
+CancelledError in the caller as usual; jobs already running complete.
+alist_gen() writes no list until the last file is hashed and stored,
+so a cancelled run leaves the previous list in place, but files already
+copied into U or into the data directory remain there.
+"""
+
+import asyncio
+import binascii
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from xlattice import HashTypes
+from xlu import UDir
+from xlutil import make_ex_re
+
+from buildlist import (AgentClient, BLError, BuildList, StatCache,
+                       project_version, signing_key, stats)
+from buildlist.chunks import find_missing_files
+from buildlist.encoding import get_encoding
+from buildlist.hashing import build_tree, file_bin_hash, scan_dir
+from buildlist.populate import copy_from_u, plan_populate
+from buildlist.store import USaveStats, plan_save, put_file, stored_whole
+from buildlist.uindex import note_keys_put
+from buildlist.walker import walk_leaves
+
+__all__ = ['DEFAULT_WORKERS', 'acheck_in_u_dir', 'alist_gen',
+           'apopulate_data_dir', ]
+
+DEFAULT_WORKERS = 4
+KEY_CHUNK = 4096        # keys looked up in U per job
+
+
+class _Jobs(object):
+    """ A bounded pool of threads running blocking jobs for a coroutine. """
+
+    def __init__(self, workers):
+        self._workers = max(1, workers or 1)
+        self._pool = ThreadPoolExecutor(max_workers=self._workers)
+        self._loop = asyncio.get_event_loop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # don't wait for running jobs if we were cancelled
+        self._pool.shutdown(wait=False)
+
+    async def run(self, func, *args):
+        """ Return func(*args), called in the pool. """
+        return await self._loop.run_in_executor(self._pool, func, *args)
+
+    async def map(self, func, items):
+        """
+        Return [func(item) for item in items], with at most workers
+        calls running at once.  The first exception raised stops the
+        rest and is raised.
+        """
+        results = [None] * len(items)
+        todo = iter(range(len(items)))
+
+        async def worker():
+            """ Take the next item until there are none left. """
+            for ndx in todo:
+                results[ndx] = await self.run(func, items[ndx])
+
+        tasks = [asyncio.ensure_future(worker())
+                 for _ in range(min(self._workers, len(items)))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return results
+
+
+async def alist_gen(title, data_dir,
+                    dvcz_dir='.dvcz',
+                    list_file='lastBuildList',
+                    key_file=None,
+                    excl=None,
+                    logging=False,
+                    u_path='',
+                    hashtype=HashTypes.SHA1,
+                    workers=DEFAULT_WORKERS,
+                    use_cache=True,
+                    rehash=False,
+                    use_delta=False,
+                    agent_socket=None,
+                    chunk_threshold=0,
+                    agent_fingerprint=None):
+    """
+    Do what BuildList.list_gen() does, returning the same BuildList.
+    key_file defaults to skPriv.pem in $DVCZ_PATH_TO_KEYS and excl to
+    ['build'], as there.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    if key_file is None:
+        key_file = os.path.join(os.environ['DVCZ_PATH_TO_KEYS'], 'skPriv.pem')
+    if excl is None:
+        excl = ['build']
+    if (not data_dir) or (not os.path.isdir(data_dir)):
+        raise BLError("%s does not exist or is not a directory" % data_dir)
+    if data_dir[-1] == '/':
+        data_dir = data_dir[:-1]
+    name = data_dir.rpartition('/')[2]
+
+    with _Jobs(workers) as jobs:
+        version, title = await jobs.run(project_version, dvcz_dir, title)
+        ex_re = make_ex_re(excl)
+        sk_priv = await jobs.run(signing_key, key_file, agent_socket,
+                                 agent_fingerprint)
+        try:
+            sk_ = sk_priv.publickey() if sk_priv is not None else None
+            cache = None
+            if use_cache:
+                with stats.phase('stat_cache'):
+                    cache = await jobs.run(StatCache.load, dvcz_dir, rehash)
+
+            paths = []
+            with stats.phase('walk'):
+                entries = await jobs.run(scan_dir, data_dir, ex_re, None,
+                                         paths)
+
+            # as hash_paths(), but the cache is only touched in this thread
+            with stats.phase('hash'):
+                digests = [None] * len(paths)
+                todo = list(range(len(paths)))
+                if cache is not None:
+                    stat_of = await jobs.map(os.stat, paths)
+                    for ndx, path in enumerate(paths):
+                        digests[ndx] = cache.lookup(path, stat_of[ndx],
+                                                    hashtype)
+                    todo = [ndx for ndx in todo if digests[ndx] is None]
+                hashed = await jobs.map(
+                    lambda ndx: file_bin_hash(paths[ndx], hashtype), todo)
+                for ndx, digest in zip(todo, hashed):
+                    digests[ndx] = digest
+            blist = BuildList(title, sk_,
+                              build_tree(name, entries, digests, hashtype))
+            if cache is not None:
+                for ndx in todo:
+                    cache.record(paths[ndx], stat_of[ndx], hashtype,
+                                 digests[ndx])
+                with stats.phase('stat_cache'):
+                    await jobs.run(cache.save)
+
+            if u_path:
+                with stats.phase('u_write'):
+                    blist.u_stats = await _save_to_u(
+                        jobs, blist.tree, data_dir, u_path, chunk_threshold)
+            await jobs.run(blist.write_list, dvcz_dir, list_file, sk_priv,
+                           hashtype, u_path, None, use_delta, logging,
+                           version, chunk_threshold)
+        finally:
+            if isinstance(sk_priv, AgentClient):
+                sk_priv.close()
+    return blist
+
+
+async def _save_to_u(jobs, tree, data_dir, u_path, chunk_threshold):
+    """ Do what save_tree_to_u_dir() does, one file to a job. """
+    u_dir = UDir.discover(u_path)
+    encoding = get_encoding(u_path)
+    leaf_count, pairs = await jobs.run(plan_save, tree, data_dir, u_path,
+                                       u_dir)
+    results = await jobs.map(
+        lambda pair: put_file(u_dir, u_path, pair[0], pair[1], tree.hashtype,
+                              chunk_threshold, encoding), pairs)
+    written = [hash_back for _, _, hash_back in results]
+    bytes_read = sum(length for length, _, _ in results)
+    bytes_written = sum(count for _, count, _ in results)
+    await jobs.run(note_keys_put, u_path,
+                   [hash_back for length, _, hash_back in results
+                    if stored_whole(length, chunk_threshold)])
+    stats.count('u_write', files=len(written), bytes_read=bytes_read,
+                bytes_written=bytes_written)
+    return USaveStats(len(written), leaf_count - len(written), bytes_written)
+
+
+async def apopulate_data_dir(blist, u_path, data_path,
+                             workers=DEFAULT_WORKERS):
+    """
+    Do what blist.populate_data_dir() does.  If files can't be copied,
+    the error for the first of them in the tree is raised once every
+    copy has been tried.
+    """
+    if not os.path.exists(u_path):
+        raise RuntimeError("u_path %s does not exist" % u_path)
+    rel_path, _, name = data_path.rpartition('/')
+    if name != blist.tree.name:
+        raise RuntimeError(
+            "name mismatch: tree name %s but data_dir name %s" % (
+                blist.tree.name, name))
+
+    with _Jobs(workers) as jobs, stats.phase('populate'):
+        u_dir = UDir.discover(u_path)
+        dirs, files = plan_populate(blist.tree, rel_path)
+
+        def make_dirs():
+            """ Create every directory before any file is copied. """
+            for dir_ in dirs:
+                os.makedirs(dir_, mode=0o755, exist_ok=True)
+        await jobs.run(make_dirs)
+
+        def copy(pair):
+            """ Copy one file, returning its length or the exception. """
+            try:
+                return copy_from_u(u_dir, u_path, *pair)
+            except (OSError, RuntimeError) as exc:
+                return exc
+        results = await jobs.map(copy, files)
+
+    lengths = [result for result in results if isinstance(result, int)]
+    stats.count('populate', files=len(lengths), bytes_read=sum(lengths),
+                bytes_written=sum(lengths))
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+async def acheck_in_u_dir(blist, u_path, workers=DEFAULT_WORKERS):
+    """
+    Do what blist.check_in_u_dir() does, returning the same list of the
+    content keys missing from U, in the same order.  Keys are looked up
+    KEY_CHUNK at a time.
+    """
+    with stats.phase('check_in_u_dir'):
+        keys = [binascii.b2a_hex(bin_hash).decode('utf-8')
+                for _, bin_hash in walk_leaves(blist.tree)]
+        stats.count('check_in_u_dir', files=len(keys))
+        keys = list(dict.fromkeys(keys))
+        with _Jobs(workers) as jobs:
+            u_dir = await jobs.run(UDir.discover, u_path)
+            chunks = [keys[start:start + KEY_CHUNK]
+                      for start in range(0, len(keys), KEY_CHUNK)]
+            missing = await jobs.map(
+                lambda chunk: find_missing_files(u_path, chunk, u_dir.exists),
+                chunks)
+    return [key for chunk in missing for key in chunk]
@@ -0,0 +1,177 @@
+# buildlist/bench.py
+
+"""
+Time the main BuildList operations over a synthetic data directory.
+
+run_benchmarks() builds a tree with synth.make_data_dir() and times,
+in turn, list_gen (into a fresh U), parse, to_string, sign, verify,
+check_in_u_dir, populate_data_dir, and the single-pass check done by
+bl_check.  Each result records the elapsed time, files per second, MB
+per second where the operation reads data, and the peak RSS of the
+process so far.
+
+U may be set to compress what is put into it, so that runs with each
+encoding, over files with content 'text' if the random bytes of the
+default are not to be stored as they are, show what compression costs
+in list_gen and populate_data_dir throughput against the space it
+saves, which is reported as u_store.
+"""
+
+import io
+import os
+import platform
+import shutil
+import time
+
+from Crypto.Hash import SHA
+from Crypto.PublicKey import RSA
+
+from xlattice import HashTypes
+from xlu import UDir
+
+from buildlist.encoding import set_encoding
+from buildlist.stats import peak_rss_kb
+from buildlist.synth import make_data_dir
+from buildlist.walker import walk_leaves
+
+__all__ = ['clean_up', 'run_benchmarks', ]
+
+
+def _record(seconds, files, data_bytes=None):
+    """ Return the result of one timed operation. """
+    seconds = max(seconds, 1e-9)
+    result = {'seconds': round(seconds, 6),
+              'files_per_s': round(files / seconds, 1),
+              'mb_per_s': None,
+              'peak_rss_kb': peak_rss_kb()}
+    if data_bytes is not None:
+        result['mb_per_s'] = round(data_bytes / seconds / 1e6, 3)
+    return result
+
+
+def _u_store(u_path, tree, encoding, data_bytes):
+    """
+    Report the space taken in U by the objects the files in tree are
+    stored as.  ratio is the bytes of data per byte stored, so that
+    identical files, stored once, raise it too.
+    """
+    u_dir = UDir.discover(u_path)
+    keys = set(bin_hash.hex() for _, bin_hash in walk_leaves(tree))
+    stored = sum(os.path.getsize(u_dir.get_path_for_key(key))
+                 for key in keys)
+    return {'encoding': encoding, 'objects': len(keys),
+            'data_bytes': data_bytes, 'stored_bytes': stored,
+            'ratio': round(data_bytes / stored, 3) if stored else None}
+
+
+def run_benchmarks(work_dir, file_count, seed=42, depth=4, sizes='source',
+                   hashtype=HashTypes.SHA2, workers=1, key_bits=2048,
+                   encoding='none', content='random'):
+    """
+    Benchmark each operation over a synthetic tree of file_count files
+    with the content given built under work_dir, which is created and
+    must not exist, putting them into a U which uses encoding.  Returns
+    a dict suitable for serializing as JSON.
+    """
+    # pylint: disable=too-many-locals, cyclic-import
+    from buildlist import (__version__, BuildList, check_dirs_in_path,
+                           generate_rsa_key)
+    from buildlist.check import find_extra_files
+
+    data_dir = os.path.join(work_dir, 'dataDir')
+    dvcz_dir = os.path.join(work_dir, 'dvcz')
+    u_path = os.path.join(work_dir, 'uDir')
+    key_file = os.path.join(work_dir, 'node', 'skPriv.pem')
+
+    start = time.time()
+    data_bytes = make_data_dir(data_dir, file_count, seed, depth, sizes,
+                               content)
+    setup_seconds = time.time() - start
+    os.makedirs(dvcz_dir)
+    UDir.discover(u_path, hashtype=hashtype)
+    if encoding != 'none':
+        set_encoding(u_path, encoding)
+    check_dirs_in_path(key_file)
+    generate_rsa_key(key_file, key_bits)
+    with open(key_file, 'r') as file:
+        sk_priv = RSA.importKey(file.read())
+    results = {}
+
+    start = time.time()
+    blist = BuildList.list_gen('bench', data_dir, dvcz_dir,
+                               key_file=key_file, u_path=u_path,
+                               hashtype=hashtype, workers=workers,
+                               use_cache=False)
+    results['list_gen'] = _record(time.time() - start, file_count,
+                                  data_bytes)
+    u_store = _u_store(u_path, blist.tree, encoding, data_bytes)
+
+    text = blist.to_string()
+    list_bytes = len(text.encode('utf-8'))
+    start = time.time()
+    parsed = BuildList.parse(text, hashtype)
+    results['parse'] = _record(time.time() - start, file_count, list_bytes)
+
+    start = time.time()
+    parsed.to_string()
+    results['to_string'] = _record(time.time() - start, file_count,
+                                   list_bytes)
+
+    unsigned = BuildList('bench', sk_priv.publickey(), parsed.tree)
+    start = time.time()
+    unsigned.sign(sk_priv)
+    results['sign'] = _record(time.time() - start, file_count, list_bytes)
+
+    start = time.time()
+    if not unsigned.verify():
+        raise RuntimeError("benchmark BuildList does not verify")
+    results['verify'] = _record(time.time() - start, file_count, list_bytes)
+
+    start = time.time()
+    missing = parsed.check_in_u_dir(u_path)
+    results['check_in_u_dir'] = _record(time.time() - start, file_count)
+    if missing:
+        raise RuntimeError("%d files missing from U" % len(missing))
+
+    out_dir = os.path.join(work_dir, 'out')
+    os.makedirs(out_dir)
+    start = time.time()
+    parsed.populate_data_dir(u_path, os.path.join(out_dir, parsed.tree.name),
+                             workers=workers)
+    results['populate_data_dir'] = _record(time.time() - start, file_count,
+                                           data_bytes)
+
+    # what bl_check does by default: one pass over the list checking
+    # the signature and each file, then extras and U
+    start = time.time()
+    sha = SHA.new()
+    failures = []
+    checked = BuildList.parse_stream(
+        io.BytesIO(text.encode('utf-8')), hashtype, root_path=data_dir,
+        failures=failures, digest=sha, compact=True)
+    checked.verify(sha)
+    find_extra_files(checked.tree, data_dir)
+    checked.check_in_u_dir(u_path)
+    results['bl_check'] = _record(time.time() - start, file_count,
+                                  data_bytes)
+    if failures:
+        raise RuntimeError("bl_check found %d failures" % len(failures))
+
+    return {
+        'buildlist_version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'files': file_count, 'seed': seed, 'depth': depth,
+                   'sizes': sizes, 'content': content,
+                   'hashtype': hashtype.name,
+                   'workers': workers, 'data_bytes': data_bytes,
+                   'list_bytes': list_bytes,
+                   'setup_seconds': round(setup_seconds, 3)},
+        'results': results,
+        'u_store': u_store,
+    }
+
+
+def clean_up(work_dir):
+    """ Remove a benchmark's work directory. """
+    shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,270 @@
+# buildlist/binfmt.py
+
+"""
+A binary companion to the text serialization of a BuildList.
+
+The text form must be parsed in full before anything can be looked up
+in it.  The binary form is laid out so that it can be memory-mapped and
+queried at once:
+
+    magic               8 bytes, b'BLBIN01\\n'
+    header              hashtype, key width, entry and file counts, and
+                        the offset of each of the sections below
+    meta                public key (PEM), title, timestamp, tree name,
+                        and raw signature, each but the timestamp
+                        preceded by its length
+    digests             the raw content hash of each file, key width
+                        bytes apiece, in path order
+    path table          for each file and directory, the offset and
+                        length of its path in the string table and the
+                        index of its digest (NO_DIGEST for directories),
+                        sorted by path
+    strings             the paths, relative to the data directory,
+                        UTF-8 encoded and separated by '/'
+    order               the index into the path table of each entry in
+                        the order in which it appears in the tree
+
+All integers are big-endian.  Looking up the hash of a path is a binary
+search of the path table.  The order section lets the exact text form,
+and so the BuildList, be recovered; the signature is carried over
+unchanged and verifies against it.
+"""
+
+import base64
+import mmap
+import struct
+
+from xlattice import HashTypes
+
+from buildlist.builder import TreeBuilder
+from buildlist.compact import LEAF_TYPES
+
+__all__ = ['BinaryBuildList', 'write_binary', ]
+
+MAGIC = b'BLBIN01\n'
+# hashtype, key width, reserved, entry count, file count, then the
+# offsets of meta, digests, path table, strings, and order
+HEADER = struct.Struct('>BBHII5Q')
+ENTRY = struct.Struct('>QII')          # string offset, length, digest index
+INDEX = struct.Struct('>I')
+LENGTH = struct.Struct('>I')
+WHEN = struct.Struct('>q')
+NO_DIGEST = 0xffffffff
+
+
+def _walk(tree, prefix=''):
+    """
+    Yield (path, node) for every file and directory below tree, in the
+    order in which they appear in its serialization.
+    """
+    for node in tree.nodes:
+        path = prefix + node.name
+        yield path, node
+        if not isinstance(node, LEAF_TYPES):
+            yield from _walk(node, path + '/')
+
+
+def write_binary(blist, file):
+    """
+    Write the BuildList to file, opened in binary mode, in binary
+    form.  Returns the number of bytes written.
+    """
+    tree = blist.tree
+    key_len = 20 if blist.hashtype == HashTypes.SHA1 else 32
+
+    walked = [(path.encode('utf-8'), node) for path, node in _walk(tree)]
+    by_path = sorted(range(len(walked)), key=lambda ndx: walked[ndx][0])
+    position = [0] * len(walked)          # tree order -> path table
+    for pos, ndx in enumerate(by_path):
+        position[ndx] = pos
+
+    def length_prefixed(data):
+        """ Return data preceded by its length. """
+        return LENGTH.pack(len(data)) + data
+
+    sig = base64.b64decode(blist.dig_sig) if blist.signed else b''
+    meta = b''.join([
+        length_prefixed(blist.public_key.exportKey('PEM')),
+        length_prefixed(blist.title.encode('utf-8')),
+        WHEN.pack(blist.when),
+        length_prefixed(tree.name.encode('utf-8')),
+        length_prefixed(sig)])
+
+    digests = []
+    entries = []
+    strings = []
+    str_offset = 0
+    for ndx in by_path:
+        path, node = walked[ndx]
+        if isinstance(node, LEAF_TYPES):
+            entries.append(ENTRY.pack(str_offset, len(path), len(digests)))
+            digests.append(node.bin_hash)
+        else:
+            entries.append(ENTRY.pack(str_offset, len(path), NO_DIGEST))
+        strings.append(path)
+        str_offset += len(path)
+    order = b''.join(INDEX.pack(pos) for pos in position)
+
+    off_meta = len(MAGIC) + HEADER.size
+    off_digests = off_meta + len(meta)
+    off_entries = off_digests + key_len * len(digests)
+    off_strings = off_entries + ENTRY.size * len(entries)
+    off_order = off_strings + str_offset
+    header = HEADER.pack(int(blist.hashtype), key_len, 0,
+                         len(entries), len(digests), off_meta,
+                         off_digests, off_entries, off_strings, off_order)
+
+    count = 0
+    for chunk in [MAGIC, header, meta, b''.join(digests),
+                  b''.join(entries), b''.join(strings), order]:
+        file.write(chunk)
+        count += len(chunk)
+    return count
+
+
+class BinaryBuildList(object):
+    """
+    A BuildList in binary form, memory-mapped.  Opening one reads only
+    the header and the short meta section.
+    """
+
+    def __init__(self, path_to_file):
+        self._file = open(path_to_file, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            self._read_header()
+        except (OSError, ValueError, struct.error) as exc:
+            self._file.close()
+            raise ValueError("%s is not a binary BuildList: %s" % (
+                path_to_file, exc))
+
+    def _read_header(self):
+        """ Check the magic number and unpack header and meta. """
+        mm_ = self._mm
+        if mm_[:len(MAGIC)] != MAGIC:
+            raise ValueError("bad magic number")
+        (hashtype, self._key_len, _, self._count, self._file_count,
+         off_meta, self._off_digests, self._off_entries,
+         self._off_strings, self._off_order) = HEADER.unpack_from(
+             mm_, len(MAGIC))
+        self._hashtype = HashTypes(hashtype)
+        if self._off_order + INDEX.size * self._count != len(mm_):
+            raise ValueError("bad length")
+
+        offset = off_meta
+
+        def take():
+            """ Return the next length-prefixed field of meta. """
+            nonlocal offset
+            (length,) = LENGTH.unpack_from(mm_, offset)
+            offset += LENGTH.size + length
+            return mm_[offset - length:offset]
+        self._pem = take()
+        self._title = take().decode('utf-8')
+        (self._when,) = WHEN.unpack_from(mm_, offset)
+        offset += WHEN.size
+        self._name = take().decode('utf-8')
+        self._dig_sig = take() or None
+
+    def close(self):
+        """ Release the memory map. """
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """ Return the number of files and directories listed. """
+        return self._count
+
+    @property
+    def hashtype(self):
+        """ Return the hashtype of the content keys. """
+        return self._hashtype
+
+    @property
+    def title(self):
+        """ Return the title of the BuildList. """
+        return self._title
+
+    @property
+    def when(self):
+        """ Return the timestamp of the BuildList as an int. """
+        return self._when
+
+    @property
+    def public_key_pem(self):
+        """ Return the PEM-encoded public key, as bytes. """
+        return self._pem
+
+    @property
+    def dig_sig(self):
+        """ Return the raw digital signature, or None if unsigned. """
+        return self._dig_sig
+
+    @property
+    def name(self):
+        """ Return the name of the directory the BuildList describes. """
+        return self._name
+
+    def _entry(self, pos):
+        """ Return the path and digest index at pos in the path table. """
+        offset, length, digest = ENTRY.unpack_from(
+            self._mm, self._off_entries + pos * ENTRY.size)
+        start = self._off_strings + offset
+        return self._mm[start:start + length], digest
+
+    def get_hash(self, path):
+        """
+        Return the binary content hash of the file at path, relative to
+        the data directory, or None if there is no such file.
+        """
+        key = path.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._entry(mid)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self._count:
+            found, digest = self._entry(low)
+            if found == key and digest != NO_DIGEST:
+                start = self._off_digests + digest * self._key_len
+                return self._mm[start:start + self._key_len]
+        return None
+
+    def iter_tree_lines(self):
+        """
+        Yield the lines of the serialized tree, as walker.iter_tree_lines
+        would for the original.
+        """
+        yield self._name
+        for ndx in range(self._count):
+            (pos,) = INDEX.unpack_from(
+                self._mm, self._off_order + ndx * INDEX.size)
+            path, digest = self._entry(pos)
+            path = path.decode('utf-8')
+            indent = ' ' * (path.count('/') + 1)
+            name = path.rpartition('/')[2]
+            if digest == NO_DIGEST:
+                yield indent + name
+            else:
+                start = self._off_digests + digest * self._key_len
+                yield '%s%s %s' % (
+                    indent, name,
+                    self._mm[start:start + self._key_len].hex())
+
+    def build_tree(self):
+        """ Return the NLHTree this was made from. """
+        builder = TreeBuilder(self._hashtype)
+        for line in self.iter_tree_lines():
+            builder.add_line(line)
+        return builder.tree
@@ -0,0 +1,81 @@
+# buildlist/builder.py
+
+"""
+Build an NLHTree one serialized line at a time.
+
+NLHTree.create_from_string_array() needs every line of the tree in
+memory at once.  A TreeBuilder is fed the lines as they are read, so
+that only the tree itself is kept.
+"""
+
+import binascii
+
+from nlhtree import NLHTree, NLHLeaf
+from xlattice import HashTypes, check_hashtype
+
+__all__ = ['TreeBuilder', ]
+
+
+class TreeBuilder(object):
+    """
+    Accumulate the lines of a serialized NLHTree, using the default
+    one-space indent, into the tree they describe.
+    """
+
+    def __init__(self, hashtype=HashTypes.SHA2):
+        check_hashtype(hashtype)
+        self._hashtype = hashtype
+        self._hex_len = 40 if hashtype == HashTypes.SHA1 else 64
+        self._stack = []        # the current directory and its ancestors
+        self._tree = None
+
+    @property
+    def hashtype(self):
+        """ Return the hashtype of the tree being built. """
+        return self._hashtype
+
+    @property
+    def tree(self):
+        """ Return the tree built so far; None if no lines have been seen. """
+        return self._tree
+
+    def add_line(self, line):
+        """
+        Add the next line of the serialization, without its line ending,
+        to the tree.  Raises ValueError if the line is malformed or out
+        of place.
+
+        If the line describes a file, return its path relative to the
+        directory the tree describes, separated by '/', and its binary
+        content hash.  Otherwise return None.
+        """
+        name = line.lstrip(' ')
+        depth = len(line) - len(name)
+        parts = name.split(' ')
+
+        if self._tree is None:
+            if depth != 0 or len(parts) != 1 or not name:
+                raise ValueError("bad first line in NLHTree: '%s'" % line)
+            self._tree = NLHTree(name, self._hashtype)
+            self._stack.append(self._tree)
+            return None
+
+        if depth == 0 or depth > len(self._stack):
+            raise ValueError("bad indent in NLHTree line: '%s'" % line)
+        del self._stack[depth:]
+        parent = self._stack[-1]
+        if len(parts) == 1:
+            node = NLHTree(name, self._hashtype)
+            parent.insert(node)
+            self._stack.append(node)
+            return None
+        if len(parts) == 2 and len(parts[1]) == self._hex_len:
+            try:
+                bin_hash = binascii.a2b_hex(parts[1])
+            except (binascii.Error, TypeError):
+                raise ValueError("bad hash in NLHTree line: '%s'" % line)
+            parent.insert(NLHLeaf(parts[0], bin_hash, self._hashtype))
+            path = '/'.join([dir_.name for dir_ in self._stack[1:]] +
+                            [parts[0]])
+            return path, bin_hash
+        raise ValueError("bad NLHTree line: '%s'" % line)
@@ -0,0 +1,12 @@
+# buildlist/buildlog.py
+
+""" The form of a line in a builds log, .dvcz/builds. """
+
+import re
+
+__all__ = ['BUILDS_LINE_RE', ]
+
+# timestamp, version, content key of the list, as written by list_gen
+BUILDS_LINE_RE = re.compile(
+    r'^(\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d) v(\d+\.\d+\.\d+(?:\.\d+)?) '
+    r'([0-9a-f]+)\s*$')
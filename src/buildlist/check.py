@@ -0,0 +1,142 @@
+# buildlist/check.py
+
+"""
+Incremental verification of a data directory against a BuildList.
+
+Rather than building a second NLHTree from the data directory and
+comparing the two, walk the files listed and the files present side by
+side.  Only files present in both are hashed, and those which a
+StatCache shows to be unchanged are not read at all.
+
+Empty directories are compared too, as a comparison of the two trees
+would compare them.  They are reported with a trailing '/'.
+"""
+
+import os
+from collections import namedtuple
+
+from buildlist.compact import LEAF_TYPES
+from buildlist.hashing import hash_paths, scan_dir
+from buildlist.walker import walk_leaves
+
+__all__ = ['DataDirCheck', 'check_tree_against_dir', 'find_extra_files',
+           'find_missing_dirs', ]
+
+DataDirCheck = namedtuple('DataDirCheck', ['missing', 'extra', 'changed'])
+DataDirCheck.__doc__ = """
+Result of checking a data directory against a BuildList.  Each field
+is a list of paths relative to the data directory:  files listed but
+not present, present but not listed, and present with a different
+content hash.  Empty directories appear in missing and extra with a
+trailing '/'.
+"""
+
+
+def _tree_dirs(tree, prefix='', dirs=None, empty=None):
+    """
+    Return the set of relative paths of the directories below the top
+    of tree and the list of those which are empty, in tree order.
+    """
+    if dirs is None:
+        dirs, empty = set(), []
+    for node in tree.nodes:
+        if not isinstance(node, LEAF_TYPES):
+            path = prefix + node.name
+            dirs.add(path)
+            if next(iter(node.nodes), None) is None:
+                empty.append(path)
+            _tree_dirs(node, path + '/', dirs, empty)
+    return dirs, empty
+
+
+def _scanned_dirs(entries, prefix='', dirs=None, empty=None):
+    """ Do what _tree_dirs() does for the output of scan_dir(). """
+    if dirs is None:
+        dirs, empty = set(), []
+    for name, value in entries:
+        if isinstance(value, list):
+            path = prefix + name
+            dirs.add(path)
+            if not value:
+                empty.append(path)
+            _scanned_dirs(value, path + '/', dirs, empty)
+    return dirs, empty
+
+
+def _extra_dirs(tree, entries):
+    """
+    Return, each with a trailing '/', the empty directories found by
+    scan_dir() which tree does not list as directories.
+    """
+    tree_dirs, _ = _tree_dirs(tree)
+    _, empty = _scanned_dirs(entries)
+    return [path + '/' for path in empty if path not in tree_dirs]
+
+
+def find_missing_dirs(tree, data_dir):
+    """
+    Return, each with a trailing '/', the empty directories listed in
+    tree which are not directories under data_dir.
+    """
+    if data_dir and data_dir[-1] == '/':
+        data_dir = data_dir[:-1]
+    _, empty = _tree_dirs(tree)
+    return [path + '/' for path in empty
+            if not os.path.isdir(os.path.join(data_dir, path))]
+
+
+def check_tree_against_dir(tree, data_dir, ex_re=None, cache=None,
+                           workers=1):
+    """
+    Compare the files listed in tree, an NLHTree, with those under
+    data_dir, returning a DataDirCheck.  Names matching ex_re are
+    skipped in the data directory.  The name of data_dir itself is not
+    compared with that of tree.
+    """
+    if data_dir and data_dir[-1] == '/':
+        data_dir = data_dir[:-1]
+    listed = dict(walk_leaves(tree))
+
+    paths = []
+    entries = scan_dir(data_dir, ex_re, None, paths)
+    prefix_len = len(data_dir) + 1
+
+    extra = []
+    found = []                  # relative paths of files listed and present
+    for path in paths:
+        rel_path = path[prefix_len:]
+        if rel_path in listed:
+            found.append(rel_path)
+        else:
+            extra.append(rel_path)
+    if len(found) == len(listed):
+        missing = []
+    else:
+        present = set(found)
+        missing = [rel_path for rel_path, _ in walk_leaves(tree)
+                   if rel_path not in present]
+
+    digests = hash_paths([data_dir + '/' + rel_path for rel_path in found],
+                         tree.hashtype, workers, cache)
+    changed = [rel_path for rel_path, digest in zip(found, digests)
+               if digest != listed[rel_path]]
+    missing.extend(find_missing_dirs(tree, data_dir))
+    extra.extend(_extra_dirs(tree, entries))
+    return DataDirCheck(missing, extra, changed)
+
+
+def find_extra_files(tree, data_dir, ex_re=None):
+    """
+    Return the relative paths of files under data_dir, skipping names
+    matching ex_re, which are not listed in tree, followed by those of
+    empty directories not listed, with a trailing '/'.  Nothing is
+    hashed.
+    """
+    if data_dir and data_dir[-1] == '/':
+        data_dir = data_dir[:-1]
+    listed = set(path for path, _ in walk_leaves(tree))
+    paths = []
+    entries = scan_dir(data_dir, ex_re, None, paths)
+    prefix_len = len(data_dir) + 1
+    return [path[prefix_len:] for path in paths
+            if path[prefix_len:] not in listed] + _extra_dirs(tree, entries)
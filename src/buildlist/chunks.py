@@ -0,0 +1,319 @@
+# buildlist/chunks.py
+
+"""
+Store large files in U as content-defined chunks.
+
+A file stored whole is re-stored whole whenever a byte of it changes.
+A file at least as large as the threshold given to list_gen() may
+instead be cut into chunks of MIN_CHUNK to MAX_CHUNK bytes, averaging
+about 2**AVG_BITS, at points chosen by a gear hash over its content, so
+that an edit moves only the boundaries near it.  Each chunk is stored
+in U as an ordinary object under its own content key, and a manifest
+listing the chunks in order is kept in U/manifests/KEY, where KEY is
+the content key of the whole file, which is what the BuildList records.
+Its first line is
+
+    BLCHUNK1 HASHTYPE LENGTH COUNT
+
+followed by COUNT lines, each the content key and length of a chunk.
+
+Chunks are compressed, as files stored whole are, if U has been set to
+do that; see buildlist.encoding.
+
+A key with a manifest counts as present in U.  Populating a data
+directory reassembles the file from its chunks, and bl_check and
+bl_verify_all reassemble it in memory; either way the bytes must hash
+to KEY.
+
+The boundary search is done with numpy if it is installed, at about
+100 MB/s; otherwise a loop in Python does it, at about 5 to 7 MB/s.
+Both find the same boundaries.
+"""
+
+import hashlib
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from xlu import UDir
+
+from buildlist.encoding import put_bytes, read_object
+from buildlist.hashing import new_hash
+from buildlist.uindex import find_missing_keys
+
+__all__ = ['AVG_BITS', 'MANIFEST_DIR', 'MAX_CHUNK', 'MIN_CHUNK',
+           'assemble', 'find_missing_files', 'iter_chunks',
+           'manifest_keys', 'path_to_manifest', 'put_chunked',
+           'read_manifest', 'verify_chunked', ]
+
+MANIFEST_DIR = 'manifests'
+MAGIC = 'BLCHUNK1'
+
+MIN_CHUNK = 2**18           # 256 KB
+AVG_BITS = 20               # about 1 MB
+MAX_CHUNK = 2**22           # 4 MB
+
+MASK64 = 2**64 - 1
+
+# the gear table, fixed for all time: changing it moves every boundary
+GEAR = [int.from_bytes(hashlib.sha256(bytes([ndx])).digest()[:8], 'big')
+        for ndx in range(256)]
+
+
+def path_to_manifest(u_path, key):
+    """ Return where the manifest for the key would be kept in u_path. """
+    return os.path.join(u_path, MANIFEST_DIR, key)
+
+
+def manifest_keys(u_path):
+    """ Return the set of keys stored in u_path as chunks. """
+    try:
+        return set(name for name in os.listdir(
+            os.path.join(u_path, MANIFEST_DIR)) if not name.endswith('.tmp'))
+    except OSError:
+        return set()
+
+
+# the gear hash at a position depends only on the bytes this far back
+GEAR_WINDOW = 64
+
+# how many bytes the numpy search hashes at a time
+SCAN_BLOCK = 2**16
+
+
+def _find_cut(data, start, end, mask):
+    """
+    Return the offset just past the first position from start at which
+    the gear hash has none of the bits of mask set, or end if there is
+    no such position before it.  data may be anything supporting the
+    buffer protocol; it is not copied.
+    """
+    if numpy is not None:
+        return _find_cut_numpy(data, start, end, mask)
+    gear = GEAR
+    mask64 = MASK64
+    # the hash has none of the top bits in mask set iff it is this or less
+    limit = MASK64 ^ mask
+    hash_ = 0
+    for pos, byte in enumerate(memoryview(data)[start:end], start + 1):
+        hash_ = (hash_ + hash_ + gear[byte]) & mask64
+        if hash_ <= limit:
+            return pos
+    return end
+
+
+def _find_cut_numpy(data, start, end, mask):
+    """
+    As _find_cut(), but hashing SCAN_BLOCK bytes at a time with numpy.
+
+    Shifting left once per byte ages a byte out of the 64-bit hash after
+    GEAR_WINDOW bytes, so the hash at p is the sum of gear[data[p - k]] << k
+    for k below GEAR_WINDOW and p - k at least start.  That sum is built
+    for a whole block in six passes by doubling the width of the window,
+    each block starting early enough to see its first window in full.
+    """
+    gear = numpy.array(GEAR, dtype=numpy.uint64)
+    limit = numpy.uint64(MASK64 ^ mask)
+    with memoryview(data) as view:
+        for block_start in range(start, end, SCAN_BLOCK):
+            from_ = max(start, block_start - GEAR_WINDOW + 1)
+            block_end = min(end, block_start + SCAN_BLOCK)
+            hashes = gear[numpy.frombuffer(view[from_:block_end],
+                                           dtype=numpy.uint8)]
+            width = 1
+            while width < GEAR_WINDOW:
+                hashes[width:] += hashes[:-width] << numpy.uint64(width)
+                width += width
+            hits = numpy.flatnonzero(
+                hashes[block_start - from_:] <= limit)
+            if hits.size:
+                return block_start + int(hits[0]) + 1
+    return end
+
+
+def iter_chunks(file, min_size=MIN_CHUNK, avg_bits=AVG_BITS,
+                max_size=MAX_CHUNK):
+    """
+    Yield the content-defined chunks of the binary file, in order.
+    Every chunk but the last is at least min_size and at most max_size
+    bytes long.  The first min_size bytes of each chunk are skipped
+    without being hashed.
+    """
+    # the top bits of the hash depend on the most bytes
+    mask = ((1 << avg_bits) - 1) << (64 - avg_bits)
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < max_size:
+            block = file.read(max_size)
+            if block:
+                buf += block
+            else:
+                eof = True
+        if len(buf) <= min_size:
+            if buf:
+                yield bytes(buf)
+            return
+        cut = _find_cut(buf, min_size, min(len(buf), max_size), mask)
+        with memoryview(buf) as view:
+            chunk = bytes(view[:cut])
+        # dropping the front of a bytearray moves no data
+        del buf[:cut]
+        yield chunk
+
+
+def read_manifest(u_path, key):
+    """
+    Return the hashtype, length, and (chunk key, length) pairs recorded
+    in the manifest for key in u_path.  Raises RuntimeError if there is
+    no manifest or it is malformed.
+    """
+    try:
+        with open(path_to_manifest(u_path, key), 'r') as file:
+            lines = file.read().split('\n')
+    except OSError:
+        raise RuntimeError("%s is not stored as chunks in %s" % (key, u_path))
+    try:
+        magic, hashtype, length, count = lines[0].split()
+        if magic != MAGIC:
+            raise ValueError
+        chunks = []
+        for line in lines[1:int(count) + 1]:
+            chunk_key, chunk_len = line.split()
+            chunks.append((chunk_key, int(chunk_len)))
+        if len(chunks) != int(count) or \
+                sum(size for _, size in chunks) != int(length):
+            raise ValueError
+    except ValueError:
+        raise RuntimeError("bad manifest for %s in %s" % (key, u_path))
+    return int(hashtype), int(length), chunks
+
+
+def _write_atomically(path, data):
+    """ Write data to path by way of a temporary file. """
+    with open(path + '.tmp', 'wb') as file:
+        file.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def put_chunked(u_dir, u_path, path_to_file, hex_hash, hashtype,
+                encoding='none'):
+    """
+    Store the file in u_dir, the UDir at u_path, as chunks and a
+    manifest under hex_hash, writing only chunks not already there,
+    each compressed with encoding if that makes it smaller.
+    Returns the length of the file, the number of bytes written, and
+    the content key of what was read, which should be hex_hash.
+    """
+    whole = new_hash(hashtype)
+    chunks = []
+    length = written = 0
+    with open(path_to_file, 'rb') as file:
+        for chunk in iter_chunks(file):
+            whole.update(chunk)
+            sha = new_hash(hashtype)
+            sha.update(chunk)
+            chunk_key = sha.hexdigest()
+            if not u_dir.exists(chunk_key):
+                written += put_bytes(u_dir, u_path, chunk_key, chunk,
+                                     encoding)
+            chunks.append((chunk_key, len(chunk)))
+            length += len(chunk)
+    hash_back = whole.hexdigest()
+    lines = ['%s %d %d %d' % (MAGIC, int(hashtype), length, len(chunks))]
+    lines.extend('%s %d' % pair for pair in chunks)
+    manifest = ('\n'.join(lines) + '\n').encode('utf-8')
+    os.makedirs(os.path.join(u_path, MANIFEST_DIR), exist_ok=True)
+    _write_atomically(path_to_manifest(u_path, hash_back), manifest)
+    return length, written + len(manifest), hash_back
+
+
+def _iter_assembled(u_dir, u_path, key):
+    """
+    Yield the chunks of the file stored under key in order, checking
+    as they go that they are all there and hash to key.
+    """
+    hashtype, _, chunks = read_manifest(u_path, key)
+    whole = new_hash(hashtype)
+    for chunk_key, _ in chunks:
+        try:
+            chunk = read_object(u_dir, chunk_key)
+        except OSError:
+            raise RuntimeError("chunk %s of %s is not in %s" % (
+                chunk_key, key, u_path))
+        whole.update(chunk)
+        yield chunk
+    if whole.hexdigest() != key:
+        raise RuntimeError("chunks of %s in %s hash to %s" % (
+            key, u_path, whole.hexdigest()))
+
+
+def assemble(u_dir, u_path, key, path_to_file):
+    """
+    Write the file stored under key in u_dir, the UDir at u_path, as
+    chunks to path_to_file.  Raises RuntimeError, leaving nothing at
+    path_to_file, if a chunk is missing or the result does not hash to
+    key.  Returns the length of the file.
+    """
+    length = 0
+    try:
+        with open(path_to_file + '.tmp', 'wb') as file:
+            for chunk in _iter_assembled(u_dir, u_path, key):
+                file.write(chunk)
+                length += len(chunk)
+    except RuntimeError:
+        os.unlink(path_to_file + '.tmp')
+        raise
+    os.replace(path_to_file + '.tmp', path_to_file)
+    return length
+
+
+def verify_chunked(u_dir, u_path, key):
+    """
+    Whether the file stored under key in u_dir, the UDir at u_path, as
+    chunks can be reassembled and hashes to key.
+    """
+    try:
+        for _ in _iter_assembled(u_dir, u_path, key):
+            pass
+    except RuntimeError:
+        return False
+    return True
+
+
+def find_missing_files(u_path, hex_keys, exists=None, verify=False):
+    """
+    Return those of the hex content keys of files which are not present
+    in U at u_path, either whole or as chunks, each once, in the order
+    first given.  exists is passed to find_missing_keys().  A key counts
+    as present if it has a manifest; if verify is set, every key with a
+    manifest and not stored whole is instead reassembled in memory, and
+    counts as missing unless all its chunks are there and hash to the
+    key, whatever U's index says.
+    """
+    hex_keys = list(dict.fromkeys(hex_keys))
+    missing = find_missing_keys(u_path, hex_keys, exists)
+    # a U which has never held chunks has no manifests directory
+    if not os.path.isdir(os.path.join(u_path, MANIFEST_DIR)):
+        return missing
+    if not verify:
+        if not missing:
+            return missing
+        chunked = set(key for key in missing
+                      if os.path.exists(path_to_manifest(u_path, key)))
+        return [key for key in missing if key not in chunked]
+    u_dir = UDir.discover(u_path)
+    if exists is None:
+        exists = u_dir.exists
+    missing = set(missing)
+    for key in hex_keys:
+        if os.path.exists(path_to_manifest(u_path, key)) and \
+                not exists(key):
+            if verify_chunked(u_dir, u_path, key):
+                missing.discard(key)
+            else:
+                missing.add(key)
+    return [key for key in hex_keys if key in missing]
@@ -0,0 +1,300 @@
+# buildlist/compact.py
+
+"""
+A memory-compact stand-in for the NLHTree held by a BuildList.
+
+An NLHTree costs a Python object, a name string, and a hash string or
+two for every file, several hundred bytes in all.  A CompactTree keeps
+the same content in a handful of flat buffers, in tree order:
+
+    _name_of    array of indexes into a table of distinct names
+    _depth      array of depths below the root
+    _digest_of  array of indexes into _digests, -1 for a directory
+    _digests    bytearray of raw content hashes, key width bytes apiece
+
+Names which recur, as they do across the directories of a source
+tree, are stored once.  The nodes seen by code walking the tree are
+small views created as they are visited, so that the usual
+tree.name / tree.nodes / node.bin_hash idiom works unchanged.
+"""
+
+import os
+from array import array
+
+from nlhtree import NLHLeaf
+from xlattice import HashTypes, check_hashtype
+
+__all__ = ['CompactTree', 'CompactTreeBuilder', 'CompactDir', 'CompactLeaf',
+           'LEAF_TYPES', 'trees_equal', ]
+
+
+class CompactLeaf(object):
+    """ A view of one file in a CompactTree. """
+
+    __slots__ = ['_tree', '_ndx']
+
+    def __init__(self, tree, ndx):
+        self._tree = tree
+        self._ndx = ndx
+
+    @property
+    def name(self):
+        """ Return the name of the file. """
+        return self._tree.name_at(self._ndx)
+
+    @property
+    def bin_hash(self):
+        """ Return the binary content hash of the file. """
+        return self._tree.bin_hash_at(self._ndx)
+
+    @property
+    def hex_hash(self):
+        """ Return the content hash of the file in hex. """
+        return self._tree.bin_hash_at(self._ndx).hex()
+
+
+class CompactDir(object):
+    """ A view of one directory in a CompactTree. """
+
+    __slots__ = ['_tree', '_ndx']
+
+    def __init__(self, tree, ndx):
+        self._tree = tree
+        self._ndx = ndx
+
+    @property
+    def name(self):
+        """ Return the name of the directory. """
+        return self._tree.name_at(self._ndx)
+
+    @property
+    def nodes(self):
+        """ Yield views of the directory's children, in order. """
+        return self._tree.children(self._ndx)
+
+
+LEAF_TYPES = (NLHLeaf, CompactLeaf)
+
+
+class CompactTree(object):
+    """
+    The files and directories of an NLHTree in flat buffers.  Use a
+    CompactTreeBuilder, or from_tree(), to make one.
+    """
+
+    __slots__ = ['_name', '_hashtype', '_key_len', '_names', '_name_ids',
+                 '_name_of', '_depth', '_digest_of', '_digests']
+
+    def __init__(self, name, hashtype=HashTypes.SHA2):
+        check_hashtype(hashtype)
+        self._name = name
+        self._hashtype = hashtype
+        self._key_len = 20 if hashtype == HashTypes.SHA1 else 32
+        self._names = []
+        self._name_ids = {}
+        self._name_of = array('I')
+        self._depth = array('H')
+        self._digest_of = array('i')
+        self._digests = bytearray()
+
+    @classmethod
+    def from_tree(cls, tree):
+        """ Return a CompactTree holding the same content as tree. """
+        compact = cls(tree.name, tree.hashtype)
+
+        def add(dir_, depth):
+            """ Append the contents of dir_ in order. """
+            for node in dir_.nodes:
+                if isinstance(node, LEAF_TYPES):
+                    compact._append(node.name, depth, node.bin_hash)
+                else:
+                    compact._append(node.name, depth)
+                    add(node, depth + 1)
+        add(tree, 1)
+        return compact
+
+    def _append(self, name, depth, bin_hash=None):
+        """ Add an entry at the end of the tree. """
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = len(self._names)
+            self._names.append(name)
+            self._name_ids[name] = name_id
+        self._name_of.append(name_id)
+        self._depth.append(depth)
+        if bin_hash is None:
+            self._digest_of.append(-1)
+        else:
+            self._digest_of.append(len(self._digests) // self._key_len)
+            self._digests.extend(bin_hash)
+
+    # NLHTree API ---------------------------------------------------
+
+    @property
+    def name(self):
+        """ Return the name of the directory the tree describes. """
+        return self._name
+
+    @property
+    def hashtype(self):
+        """ Return the hashtype of the content hashes. """
+        return self._hashtype
+
+    @property
+    def nodes(self):
+        """ Yield views of the top-level files and directories, in order. """
+        return self.children(-1)
+
+    def __len__(self):
+        """ Return the number of files and directories below the root. """
+        return len(self._depth)
+
+    def __eq__(self, other):
+        return trees_equal(self, other)
+
+    def __ne__(self, other):
+        return not trees_equal(self, other)
+
+    def __str__(self):
+        return ''.join(line + '\n' for line in self.iter_lines())
+
+    def iter_lines(self):
+        """
+        Yield the lines of the tree's serialization, without line
+        endings, as walker.iter_tree_lines() does for an NLHTree.
+        """
+        yield self._name
+        for ndx, depth in enumerate(self._depth):
+            bin_hash = self.bin_hash_at(ndx)
+            if bin_hash is None:
+                yield ' ' * depth + self.name_at(ndx)
+            else:
+                yield '%s%s %s' % (' ' * depth, self.name_at(ndx),
+                                   bin_hash.hex())
+
+    def walk_leaves(self):
+        """
+        Yield a (path, bin_hash) pair for each file in tree order, as
+        walker.walk_leaves() does for an NLHTree.
+        """
+        stack = []
+        for ndx, depth in enumerate(self._depth):
+            del stack[depth - 1:]
+            bin_hash = self.bin_hash_at(ndx)
+            if bin_hash is None:
+                stack.append(self.name_at(ndx))
+            else:
+                yield '/'.join(stack + [self.name_at(ndx)]), bin_hash
+
+    def check_in_data_dir(self, data_path):
+        """
+        Return a list of the content hashes of files in the tree which
+        are not present under data_path, the data directory itself.
+        """
+        return [bin_hash.hex() for path, bin_hash in self.walk_leaves()
+                if not os.path.exists(os.path.join(data_path, path))]
+
+    # access by entry number ----------------------------------------
+
+    def name_at(self, ndx):
+        """ Return the name of the entry at ndx. """
+        return self._names[self._name_of[ndx]]
+
+    def bin_hash_at(self, ndx):
+        """ Return the content hash of the file at ndx; None for a dir. """
+        digest = self._digest_of[ndx]
+        if digest < 0:
+            return None
+        start = digest * self._key_len
+        return bytes(self._digests[start:start + self._key_len])
+
+    def children(self, ndx):
+        """
+        Yield views of the children of the directory at ndx, or of the
+        root if ndx is -1.
+        """
+        depth = self._depth[ndx] + 1 if ndx >= 0 else 1
+        ndx += 1
+        while ndx < len(self._depth):
+            here = self._depth[ndx]
+            if here < depth:
+                break
+            if here == depth:
+                if self._digest_of[ndx] < 0:
+                    yield CompactDir(self, ndx)
+                else:
+                    yield CompactLeaf(self, ndx)
+            ndx += 1
+
+
+class CompactTreeBuilder(object):
+    """
+    Accumulate the lines of a serialized NLHTree into a CompactTree.
+    A drop-in replacement for TreeBuilder.
+    """
+
+    def __init__(self, hashtype=HashTypes.SHA2):
+        check_hashtype(hashtype)
+        self._hashtype = hashtype
+        self._hex_len = 40 if hashtype == HashTypes.SHA1 else 64
+        self._stack = []            # names of the current directory's ancestors
+        self._tree = None
+
+    @property
+    def hashtype(self):
+        """ Return the hashtype of the tree being built. """
+        return self._hashtype
+
+    @property
+    def tree(self):
+        """ Return the tree built so far; None if no lines have been seen. """
+        return self._tree
+
+    def add_line(self, line):
+        """
+        Add the next line of the serialization, without its line ending,
+        to the tree.  Behaves exactly as TreeBuilder.add_line().
+        """
+        name = line.lstrip(' ')
+        depth = len(line) - len(name)
+        parts = name.split(' ')
+
+        if self._tree is None:
+            if depth != 0 or len(parts) != 1 or not name:
+                raise ValueError("bad first line in NLHTree: '%s'" % line)
+            self._tree = CompactTree(name, self._hashtype)
+            return None
+
+        if depth == 0 or depth > len(self._stack) + 1:
+            raise ValueError("bad indent in NLHTree line: '%s'" % line)
+        del self._stack[depth - 1:]
+        if len(parts) == 1:
+            self._tree._append(name, depth)   # pylint: disable=W0212
+            self._stack.append(name)
+            return None
+        if len(parts) == 2 and len(parts[1]) == self._hex_len:
+            try:
+                bin_hash = bytes.fromhex(parts[1])
+            except ValueError:
+                raise ValueError("bad hash in NLHTree line: '%s'" % line)
+            self._tree._append(parts[0], depth, bin_hash)  # pylint: disable=W0212
+            return '/'.join(self._stack + [parts[0]]), bin_hash
+        raise ValueError("bad NLHTree line: '%s'" % line)
+
+
+def trees_equal(tree_a, tree_b):
+    """
+    Return whether two trees, each an NLHTree or a CompactTree, hold
+    the same content.
+    """
+    if not isinstance(tree_a, CompactTree) and \
+            not isinstance(tree_b, CompactTree):
+        return tree_a == tree_b
+    if tree_a is None or tree_b is None or \
+            tree_a.hashtype != tree_b.hashtype:
+        return False
+    if not isinstance(tree_a, CompactTree):
+        tree_a = CompactTree.from_tree(tree_a)
+    if not isinstance(tree_b, CompactTree):
+        tree_b = CompactTree.from_tree(tree_b)
+    return list(tree_a.iter_lines()) == list(tree_b.iter_lines())
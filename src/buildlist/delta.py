@@ -0,0 +1,194 @@
+# buildlist/delta.py
+
+"""
+Store serialized BuildLists in U as deltas against earlier BuildLists.
+
+Consecutive builds of a project usually differ in a few lines, so
+rather than store each serialization in full, one may be stored as a
+list of edits to its predecessor.  A delta is kept in U/deltas/KEY,
+where KEY is the content key of the full serialization, which remains
+the key recorded in .dvcz/builds.  Its first line is
+
+    BLDELTA1 BASE_KEY DEPTH LENGTH
+
+where DEPTH is the number of deltas which must be applied to recover
+the list, at most MAX_DEPTH, and LENGTH is the length of the result.
+The rest is a sequence of operations on lines:
+
+    C START COUNT       copy COUNT lines of the base, from line START
+    I COUNT             insert the COUNT lines which follow
+
+Reconstruction applies the chain of deltas from the nearest list stored
+in full, and checks that the bytes recovered hash to the key asked for.
+"""
+
+import os
+
+from xlu import UDir
+
+from buildlist.encoding import read_object
+from buildlist.hashing import new_hash
+
+__all__ = ['DELTA_DIR', 'MAX_DEPTH', 'apply_delta', 'make_delta',
+           'path_to_delta', 'put_list', 'read_list', 'stored_depth', ]
+
+DELTA_DIR = 'deltas'
+MAX_DEPTH = 8
+MAGIC = b'BLDELTA1'
+
+
+def path_to_delta(u_path, key):
+    """ Return where the delta for the key would be kept in u_path. """
+    return os.path.join(u_path, DELTA_DIR, key)
+
+
+def make_delta(base, target, base_key, depth):
+    """
+    Return a delta which turns base into target, both bytes, to be
+    recorded as DEPTH deltas from a complete list.  Lines of target are
+    matched greedily against the first line of base with the same
+    content, so this is linear in the size of the two.
+    """
+    base_lines = base.split(b'\n')
+    target_lines = target.split(b'\n')
+    first = {}
+    for ndx, line in enumerate(base_lines):
+        first.setdefault(line, ndx)
+
+    out = [b'%s %s %d %d' % (MAGIC, base_key.encode('utf-8'), depth,
+                             len(target))]
+    inserts = []
+    ndx = 0
+    while ndx < len(target_lines):
+        start = first.get(target_lines[ndx])
+        if start is None:
+            inserts.append(target_lines[ndx])
+            ndx += 1
+            continue
+        if inserts:
+            out.append(b'I %d' % len(inserts))
+            out.extend(inserts)
+            inserts = []
+        count = 1
+        while ndx + count < len(target_lines) and \
+                start + count < len(base_lines) and \
+                target_lines[ndx + count] == base_lines[start + count]:
+            count += 1
+        out.append(b'C %d %d' % (start, count))
+        ndx += count
+    if inserts:
+        out.append(b'I %d' % len(inserts))
+        out.extend(inserts)
+    return b'\n'.join(out) + b'\n'
+
+
+def _read_header(delta):
+    """ Return the base key, depth, and target length of a delta. """
+    header, _, _ = delta.partition(b'\n')
+    parts = header.split(b' ')
+    if len(parts) != 4 or parts[0] != MAGIC:
+        raise RuntimeError("not a BuildList delta")
+    return parts[1].decode('utf-8'), int(parts[2]), int(parts[3])
+
+
+def apply_delta(base, delta):
+    """ Return the bytes which the delta turns base into. """
+    _, _, length = _read_header(delta)
+    base_lines = base.split(b'\n')
+    lines = delta.split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    out = []
+    ndx = 1
+    while ndx < len(lines):
+        parts = lines[ndx].split(b' ')
+        ndx += 1
+        if parts[0] == b'C' and len(parts) == 3:
+            start, count = int(parts[1]), int(parts[2])
+            if start + count > len(base_lines):
+                raise RuntimeError("delta copies past the end of its base")
+            out.extend(base_lines[start:start + count])
+        elif parts[0] == b'I' and len(parts) == 2:
+            count = int(parts[1])
+            out.extend(lines[ndx:ndx + count])
+            ndx += count
+        else:
+            raise RuntimeError("bad delta operation: %r" % lines[ndx - 1])
+    target = b'\n'.join(out)
+    if len(target) != length:
+        raise RuntimeError("delta produced %d bytes, expected %d" % (
+            len(target), length))
+    return target
+
+
+def stored_depth(u_path, key):
+    """
+    Return 0 if the list with the key is stored in U in full, the
+    length of its delta chain if it is stored as a delta, or None if it
+    is not in U at all.
+    """
+    if UDir.discover(u_path).exists(key):
+        return 0
+    try:
+        with open(path_to_delta(u_path, key), 'rb') as file:
+            header = file.readline()
+    except OSError:
+        return None
+    return _read_header(header)[1]
+
+
+def read_list(u_path, key, hashtype):
+    """
+    Return the serialized BuildList with the content key given from U,
+    reconstructing it from deltas if need be.  Raises RuntimeError if
+    it can't be found or does not hash to the key.
+    """
+    chain = []
+    here = key
+    u_dir = UDir.discover(u_path)
+    while not u_dir.exists(here):
+        if len(chain) > MAX_DEPTH:
+            raise RuntimeError("delta chain for %s is too long" % key)
+        try:
+            with open(path_to_delta(u_path, here), 'rb') as file:
+                delta = file.read()
+        except OSError:
+            raise RuntimeError("%s is not in %s" % (here, u_path))
+        chain.append(delta)
+        here = _read_header(delta)[0]
+    data = read_object(u_dir, here)
+    for delta in reversed(chain):
+        data = apply_delta(data, delta)
+    sha = new_hash(hashtype)
+    sha.update(data)
+    if sha.hexdigest() != key:
+        raise RuntimeError("reconstructed list does not hash to %s" % key)
+    return data
+
+
+def put_list(u_path, path_to_file, key, base=None, base_key=None):
+    """
+    Put the serialized BuildList at path_to_file, whose content key is
+    key, into U.  If base, the bytes of an earlier list with content
+    key base_key, is given and that list is already in U within the
+    chain depth limit, and if a delta is less than half the size of the
+    list, only the delta is stored.  Returns the key under which the
+    full list was put, or None if a delta was stored.
+    """
+    if stored_depth(u_path, key) is not None:
+        return key
+    if base is not None and base_key != key:
+        depth = stored_depth(u_path, base_key)
+        if depth is not None and depth < MAX_DEPTH:
+            with open(path_to_file, 'rb') as file:
+                target = file.read()
+            delta = make_delta(base, target, base_key, depth + 1)
+            if len(delta) < len(target) // 2:
+                os.makedirs(os.path.join(u_path, DELTA_DIR), exist_ok=True)
+                path = path_to_delta(u_path, key)
+                with open(path + '.tmp', 'wb') as file:
+                    file.write(delta)
+                os.replace(path + '.tmp', path)
+                return None
+    (_, hash_back) = UDir.discover(u_path).copy_and_put(path_to_file, key)
+    return hash_back
@@ -0,0 +1,56 @@
+# buildlist/diff.py
+
+"""
+Compare the content of two BuildLists in a single pass.
+
+The files in a BuildList's tree appear in order: within each directory
+entries are sorted by name.  Comparing paths split into components
+gives the same order, so the two lists of files can be merged like two
+sorted sequences, in time proportional to their combined length and
+without holding either list in memory.
+"""
+
+from collections import namedtuple
+
+from buildlist.walker import walk_leaves
+
+__all__ = ['DiffEntry', 'diff_trees', ]
+
+DiffEntry = namedtuple('DiffEntry', ['kind', 'path', 'old_hash', 'new_hash'])
+DiffEntry.__doc__ = """
+One difference between two BuildLists.  kind is 'added', 'removed', or
+'changed'; path is relative to the data directory; old_hash and
+new_hash are the binary content hashes in the first and second lists,
+None where the file is absent.
+"""
+
+
+def _keyed(tree):
+    """ Yield (path components, path, bin_hash) for each file in tree. """
+    for path, bin_hash in walk_leaves(tree):
+        yield path.split('/'), path, bin_hash
+
+
+def diff_trees(tree_a, tree_b):
+    """
+    Yield a DiffEntry for each file which is in only one of the two
+    trees or whose content differs, in tree order.  Empty directories
+    are ignored.
+    """
+    iter_a = _keyed(tree_a)
+    iter_b = _keyed(tree_b)
+    entry_a = next(iter_a, None)
+    entry_b = next(iter_b, None)
+    while entry_a is not None or entry_b is not None:
+        if entry_b is None or (entry_a is not None and
+                               entry_a[0] < entry_b[0]):
+            yield DiffEntry('removed', entry_a[1], entry_a[2], None)
+            entry_a = next(iter_a, None)
+        elif entry_a is None or entry_b[0] < entry_a[0]:
+            yield DiffEntry('added', entry_b[1], None, entry_b[2])
+            entry_b = next(iter_b, None)
+        else:
+            if entry_a[2] != entry_b[2]:
+                yield DiffEntry('changed', entry_a[1], entry_a[2], entry_b[2])
+            entry_a = next(iter_a, None)
+            entry_b = next(iter_b, None)
@@ -0,0 +1,306 @@
+# buildlist/encoding.py
+
+"""
+Compressed objects in U.
+
+A U directory may be set, by a file U/encoding holding one of the names
+in ENCODINGS, to compress the files put into it from then on with zlib
+or lzma.  An object is still stored under the content key of the
+uncompressed file, in the place UDir.get_path_for_key() gives, so that
+whether a key is present is decided as before.  A compressed object
+begins with a header
+
+    MAGIC CODEC LENGTH
+
+where MAGIC is eight bytes which no text file begins with, CODEC is a
+byte naming the compression used, and LENGTH is the length of the
+content as an unsigned 64-bit big-endian integer.  Anything else is the
+content itself, so stores written before this, or by other tools, can
+be read as ever.  A file which does not get smaller is stored as it is.
+
+Headers are looked for only in a store which has U/encoding, which is
+written before the first compressed object is and kept even if the
+store is set back to 'none'.  In any other store every object is the
+content itself, a file beginning with MAGIC included.  In a store which
+may hold compressed objects, a file which happens to begin with MAGIC
+is given a header saying that it is not compressed, so that the two
+can't be confused.
+
+Reading an object, with read_object() or copy_object(), undoes whatever
+encoding it has, whatever the store is now set to.
+"""
+
+import lzma
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+from buildlist.hashing import new_hash
+
+__all__ = ['ENCODINGS', 'ENCODING_FILE', 'copy_object', 'get_encoding',
+           'has_encoding', 'put_bytes', 'put_encoded', 'read_object',
+           'set_encoding', ]
+
+ENCODING_FILE = 'encoding'
+ENCODINGS = ('none', 'zlib', 'lzma')
+
+MAGIC = b'\x89BLU\r\n\x1a\n'
+HEADER = struct.Struct('>cQ')
+HEADER_LEN = len(MAGIC) + HEADER.size
+
+# the CODEC byte for each encoding
+CODECS = {'none': b'n', 'zlib': b'z', 'lzma': b'x'}
+
+BLOCK_SIZE = 2**20
+
+
+def path_to_encoding(u_path):
+    """ Return the path to the file naming the encoding of u_path. """
+    return os.path.join(u_path, ENCODING_FILE)
+
+
+def has_encoding(u_path):
+    """
+    Whether an encoding has ever been set for u_path, and so whether it
+    may hold objects which must be decoded when read.  If not, objects
+    in it are read exactly as they are.
+    """
+    return os.path.exists(path_to_encoding(u_path))
+
+
+def get_encoding(u_path):
+    """
+    Return the name of the encoding used for objects put into u_path,
+    'none' if it has not been set.  Raises ValueError if the name
+    recorded is not one of ENCODINGS.
+    """
+    try:
+        with open(path_to_encoding(u_path), 'r') as file:
+            encoding = file.read().strip()
+    except FileNotFoundError:
+        return 'none'
+    if encoding not in ENCODINGS:
+        raise ValueError("unknown encoding '%s' in %s" % (encoding, u_path))
+    return encoding
+
+
+def set_encoding(u_path, encoding):
+    """
+    Compress objects put into u_path from now on with the encoding
+    named, one of ENCODINGS.  Objects already there are left as they
+    are.  Setting 'none' on a store which has never had an encoding
+    leaves it without one.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("unknown encoding '%s'" % encoding)
+    if encoding == 'none' and not has_encoding(u_path):
+        return
+    _write_encoding(u_path, encoding)
+
+
+def _write_encoding(u_path, encoding):
+    """ Record the encoding named for u_path. """
+    path = path_to_encoding(u_path)
+    with open(path + '.tmp', 'w') as file:
+        file.write(encoding + '\n')
+    os.replace(path + '.tmp', path)
+
+
+def _compressor(codec):
+    """ Return a compressor for the codec, or None if it is b'n'. """
+    if codec == b'z':
+        return zlib.compressobj(6)
+    if codec == b'x':
+        return lzma.LZMACompressor(preset=6)
+    return None
+
+
+def _decompressor(codec, key):
+    """ Return a decompressor for the codec, or None if it is b'n'. """
+    if codec == b'z':
+        return zlib.decompressobj()
+    if codec == b'x':
+        return lzma.LZMADecompressor()
+    if codec == b'n':
+        return None
+    raise RuntimeError("object %s in U has unknown encoding %r" % (
+        key, codec))
+
+
+def _header(codec, length):
+    """ Return the header of an encoded object. """
+    return MAGIC + HEADER.pack(codec, length)
+
+
+def _mark_encoded(u_path):
+    """
+    Note that u_path may now hold objects with headers, without
+    changing the encoding it is set to.
+    """
+    if not has_encoding(u_path):
+        _write_encoding(u_path, 'none')
+
+
+def _read_header(file, marked=True):
+    """
+    Return the codec and content length recorded in the header of the
+    open object file, leaving it positioned after the header, or None,
+    leaving it at the start, if the object is stored as it is.  Unless
+    marked, meaning the store has an encoding, it is stored as it is.
+    """
+    if not marked:
+        return None
+    head = file.read(HEADER_LEN)
+    if len(head) == HEADER_LEN and head.startswith(MAGIC):
+        return HEADER.unpack(head[len(MAGIC):])
+    file.seek(0)
+    return None
+
+
+def _iter_decoded(file, key, marked=True):
+    """
+    Yield the content of the open object file, stored under key, in
+    blocks.  Raises RuntimeError if it is encoded and is corrupt.
+    """
+    header = _read_header(file, marked)
+    if header is None:
+        block = file.read(BLOCK_SIZE)
+        while block:
+            yield block
+            block = file.read(BLOCK_SIZE)
+        return
+    codec, length = header
+    decomp = _decompressor(codec, key)
+    count = 0
+    try:
+        block = file.read(BLOCK_SIZE)
+        while block:
+            if decomp is not None:
+                block = decomp.decompress(block)
+            count += len(block)
+            yield block
+            block = file.read(BLOCK_SIZE)
+        if codec == b'z':
+            block = decomp.flush()
+            count += len(block)
+            yield block
+    except (zlib.error, lzma.LZMAError):
+        raise RuntimeError("object %s in U is corrupt" % key)
+    if count != length or (decomp is not None and not decomp.eof):
+        raise RuntimeError("object %s in U is truncated" % key)
+
+
+def read_object(u_dir, key):
+    """
+    Return the content of the object stored under key in u_dir,
+    decoding it if need be.  Raises OSError if it is not there and
+    RuntimeError if it can't be decoded.
+    """
+    marked = has_encoding(u_dir.u_path)
+    with open(u_dir.get_path_for_key(key), 'rb') as file:
+        return b''.join(_iter_decoded(file, key, marked))
+
+
+def copy_object(u_dir, key, path_to_file):
+    """
+    Copy the content of the object stored under key in u_dir to
+    path_to_file, decoding it if need be, and return its length.
+    Raises OSError if it is not there and RuntimeError, leaving nothing
+    at path_to_file, if it can't be decoded.
+    """
+    marked = has_encoding(u_dir.u_path)
+    path = u_dir.get_path_for_key(key)
+    with open(path, 'rb') as src:
+        if _read_header(src, marked) is None:
+            shutil.copyfile(path, path_to_file)
+            return os.fstat(src.fileno()).st_size
+        src.seek(0)
+        length = 0
+        try:
+            with open(path_to_file, 'wb') as dst:
+                for block in _iter_decoded(src, key, marked):
+                    dst.write(block)
+                    length += len(block)
+        except RuntimeError:
+            os.unlink(path_to_file)
+            raise
+    return length
+
+
+def put_bytes(u_dir, u_path, key, data, encoding):
+    """
+    Store data, whose content key is key, in u_dir, the UDir at u_path,
+    compressed with the encoding named if that makes it smaller.
+    Returns the number of bytes written.
+    """
+    codec = CODECS[encoding]
+    payload = None
+    comp = _compressor(codec)
+    if comp is not None:
+        body = comp.compress(data) + comp.flush()
+        if HEADER_LEN + len(body) < len(data):
+            payload = _header(codec, len(data)) + body
+            _mark_encoded(u_path)
+    if payload is None:
+        if data.startswith(MAGIC) and has_encoding(u_path):
+            payload = _header(b'n', len(data)) + data
+        else:
+            payload = data
+    path = u_dir.get_path_for_key(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as file:
+        file.write(payload)
+    os.replace(path + '.tmp', path)
+    return len(payload)
+
+
+def put_encoded(u_dir, u_path, path_to_file, hashtype, encoding):
+    """
+    Store the file in u_dir, the UDir at u_path, compressed with the
+    encoding named if that makes it smaller, and otherwise as it is
+    unless it begins with MAGIC and the store has an encoding.  Returns
+    the length of the file, the number of bytes written, and its
+    content key, under which it is stored.
+    """
+    # pylint: disable=too-many-locals
+    codec = CODECS[encoding]
+    tmp_dir = os.path.join(u_path, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd_, path_to_tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        sha = new_hash(hashtype)
+        comp = _compressor(codec)
+        length = 0
+        magic = False
+        with open(path_to_file, 'rb') as src, os.fdopen(fd_, 'wb') as dst:
+            dst.write(_header(codec, 0))
+            block = src.read(BLOCK_SIZE)
+            magic = block.startswith(MAGIC)
+            while block:
+                sha.update(block)
+                length += len(block)
+                dst.write(comp.compress(block) if comp else block)
+                block = src.read(BLOCK_SIZE)
+            if comp is not None:
+                dst.write(comp.flush())
+            written = dst.tell()
+            dst.seek(len(MAGIC))
+            dst.write(HEADER.pack(codec, length))
+        if written >= length and not (magic and has_encoding(u_path)):
+            # compressing did not pay; store the file as it is
+            shutil.copyfile(path_to_file, path_to_tmp)
+            written = length
+        else:
+            _mark_encoded(u_path)
+        os.chmod(path_to_tmp, 0o644)
+        hash_back = sha.hexdigest()
+        path = u_dir.get_path_for_key(hash_back)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(path_to_tmp, path)
+    except BaseException:
+        if os.path.exists(path_to_tmp):
+            os.unlink(path_to_tmp)
+        raise
+    return length, written, hash_back
@@ -0,0 +1,199 @@
+# buildlist/hashing.py
+
+"""
+Content hashing for BuildLists, optionally spread over a pool of workers.
+
+The directory walk is always serial and yields exactly the entries that
+NLHTree.create_from_file_system() would, in the same order; only the
+hashing of file contents is farmed out.  The tree returned is therefore
+identical to the serial one whatever the number of workers.  Hashes
+may also be taken from a StatCache for files which have not changed.
+"""
+
+import hashlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+from nlhtree import NLHTree, NLHLeaf
+from xlattice import HashTypes, check_hashtype
+
+from buildlist import stats
+
+if sys.version_info < (3, 6):
+    # pylint:disable=unused-import
+    import sha3         # monkey-patches hashlib
+    assert sha3         # suppress warning
+
+__all__ = ['BLOCK_SIZE', 'HashingWriter', 'new_hash', 'build_tree',
+           'file_bin_hash', 'hash_paths', 'scan_dir', 'tree_from_file_system', ]
+
+BLOCK_SIZE = 2**18          # 256KB, same as BuildList.BLOCK_SIZE
+
+
+def new_hash(hashtype):
+    """ Return a fresh hashlib object of the type indicated. """
+    if hashtype == HashTypes.SHA1:
+        sha = hashlib.sha1()
+    elif hashtype == HashTypes.SHA2:
+        sha = hashlib.sha256()
+    elif hashtype == HashTypes.SHA3:
+        # pylint: disable=maybe-no-member
+        sha = hashlib.sha3_256()
+    elif hashtype == HashTypes.BLAKE2B:
+        sha = hashlib.blake2b(digest_size=32)
+    else:
+        raise NotImplementedError
+    return sha
+
+
+class HashingWriter(object):
+    """
+    Wrap a binary file so that everything written to it is also fed to
+    one or more hash objects.
+    """
+
+    def __init__(self, file, *digests):
+        self._file = file
+        self._digests = digests
+        self.count = 0
+
+    def write(self, data):
+        """ Write data to the file, updating the digests. """
+        for digest in self._digests:
+            digest.update(data)
+        self.count += len(data)
+        return self._file.write(data)
+
+
+def file_bin_hash(path_to_file, hashtype):
+    """
+    Return the binary content hash of the file at path_to_file.
+
+    hashlib releases the GIL while digesting large buffers and the reads
+    release it while waiting on the disk, so this scales across threads.
+    """
+    sha = new_hash(hashtype)
+    length = 0
+    with open(path_to_file, 'rb') as file:
+        while True:
+            block = file.read(BLOCK_SIZE)
+            if not block:
+                break
+            sha.update(block)
+            length += len(block)
+    stats.count('hash', files=1, bytes_read=length)
+    return sha.digest()
+
+
+def scan_dir(path_to_dir, ex_re=None, match_re=None, paths=None):
+    """
+    Walk the directory at path_to_dir without hashing anything.
+
+    Returns a list of (name, value) pairs sorted by name, where value is
+    either a nested list of the same form (a subdirectory) or the index
+    of the file's path in paths, which is extended as files are found.
+    Names matching ex_re are skipped, as are files not matching match_re
+    if that is set.
+    """
+    if paths is None:
+        paths = []
+    entries = []
+    for entry in sorted(scandir(path_to_dir), key=lambda e: e.name):
+        name = entry.name
+        if ex_re and ex_re.search(name):
+            continue
+        if entry.is_dir():
+            entries.append(
+                (name, scan_dir(entry.path, ex_re, match_re, paths)))
+        elif entry.is_file():
+            if match_re and not match_re.search(name):
+                continue
+            entries.append((name, len(paths)))
+            paths.append(entry.path)
+    return entries
+
+
+def build_tree(name, entries, digests, hashtype):
+    """ Turn the output of scan_dir() plus the file digests into a tree. """
+    tree = NLHTree(name, hashtype)
+    for entry_name, value in entries:
+        if isinstance(value, list):
+            node = build_tree(entry_name, value, digests, hashtype)
+        else:
+            node = NLHLeaf(entry_name, digests[value], hashtype)
+        tree.insert(node)
+    return tree
+
+
+def hash_paths(paths, hashtype, workers=1, cache=None):
+    """
+    Return the binary content hashes of the files named, in order,
+    using a pool of threads if workers is greater than one.  Files
+    which the cache, a StatCache, shows to be unchanged are not read.
+    """
+    digests = [None] * len(paths)
+    todo = []
+    stat_of = {}
+    if cache is None:
+        todo = list(range(len(paths)))
+    else:
+        for ndx, path in enumerate(paths):
+            stat_ = os.stat(path)
+            digest = cache.lookup(path, stat_, hashtype)
+            if digest is None:
+                stat_of[ndx] = stat_
+                todo.append(ndx)
+            else:
+                digests[ndx] = digest
+
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map() returns results in submission order
+            hashed = pool.map(
+                lambda ndx: file_bin_hash(paths[ndx], hashtype), todo)
+            for ndx, digest in zip(todo, hashed):
+                digests[ndx] = digest
+    else:
+        for ndx in todo:
+            digests[ndx] = file_bin_hash(paths[ndx], hashtype)
+
+    if cache is not None:
+        for ndx in todo:
+            cache.record(paths[ndx], stat_of[ndx], hashtype, digests[ndx])
+    return digests
+
+
+def tree_from_file_system(path_to_dir, hashtype=HashTypes.SHA2,
+                          ex_re=None, match_re=None, workers=1, cache=None):
+    """
+    Create an NLHTree describing the directory at path_to_dir.
+
+    The directory is always walked by scan_dir(), its files hashed by
+    hash_paths(), and the tree put together by build_tree(); NLHTree's
+    own walk is never used.  If workers is greater than one, file
+    contents are hashed by a pool of that many threads, otherwise one
+    at a time.  If cache, a StatCache, is set, files whose metadata is
+    unchanged are not rehashed; new hashes are recorded in the cache,
+    but it is up to the caller to save() it.  The tree is the same as
+    NLHTree.create_from_file_system() would build.
+    """
+    check_hashtype(hashtype)
+    if path_to_dir and path_to_dir[-1] == '/':
+        path_to_dir = path_to_dir[:-1]
+    if (not path_to_dir) or (not os.path.isdir(path_to_dir)):
+        raise RuntimeError(
+            "%s does not exist or is not a directory" % path_to_dir)
+    _, _, name = path_to_dir.rpartition('/')
+
+    paths = []
+    with stats.phase('walk'):
+        entries = scan_dir(path_to_dir, ex_re, match_re, paths)
+    with stats.phase('hash'):
+        digests = hash_paths(paths, hashtype, workers, cache)
+    return build_tree(name, entries, digests, hashtype)
@@ -0,0 +1,323 @@
+# buildlist/history.py
+
+"""
+An indexed copy of the builds log, .dvcz/builds, in an SQLite database.
+
+The text log, to which list_gen() appends one line per build,
+
+    TIMESTAMP vVERSION LIST_HASH
+
+remains the record.  The database, .dvcz/builds.db, holds the same
+entries in a table indexed by version, timestamp, and list hash, so
+that finding, say, the latest build of a version, or every build
+between two dates, does not mean reading the whole log.  Lines which
+are not well-formed are kept in a separate table, so that together the
+two hold every line of the log in order.
+
+BuildHistory.sync() brings the database up to date with the log.  It
+reads only what has been appended since it last ran; if the log has
+been replaced or rewritten, as fix_builds does, the database is rebuilt
+from it.  The database is synced whenever it is opened.
+
+BuildHistory.load() instead reads the log into a database held in
+memory, writing nothing, for a look at a log which is to be repaired or
+in a project which does not keep builds.db.
+"""
+
+import os
+import sqlite3
+from collections import namedtuple
+
+from buildlist.buildlog import BUILDS_LINE_RE
+
+__all__ = ['BuildHistory', 'BuildRecord', 'record_build', ]
+
+BuildRecord = namedtuple('BuildRecord',
+                         ['seq', 'timestamp', 'version', 'list_hash'])
+BuildRecord.__doc__ = """
+One build logged in .dvcz/builds:  its line number in the log, counting
+from zero, when it was made, the project version, and the content key
+of the BuildList.
+"""
+
+SCHEMA_VERSION = '1'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name        TEXT PRIMARY KEY,
+    value       TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS builds (
+    seq         INTEGER PRIMARY KEY,
+    timestamp   TEXT NOT NULL,
+    version     TEXT NOT NULL,
+    list_hash   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_version ON builds (version, timestamp);
+CREATE INDEX IF NOT EXISTS builds_timestamp ON builds (timestamp);
+CREATE INDEX IF NOT EXISTS builds_list_hash ON builds (list_hash);
+CREATE TABLE IF NOT EXISTS bad_lines (
+    seq         INTEGER PRIMARY KEY,
+    line        TEXT NOT NULL
+);
+"""
+
+COLUMNS = 'seq, timestamp, version, list_hash'
+
+
+class BuildHistory(object):
+    """ The builds logged in a dvcz directory, indexed. """
+
+    FILE_NAME = 'builds.db'
+    LOG_NAME = 'builds'
+
+    def __init__(self, dvcz_dir, in_memory=False):
+        self._path_to_log = os.path.join(dvcz_dir, BuildHistory.LOG_NAME)
+        self._path = ':memory:' if in_memory else \
+            os.path.join(dvcz_dir, BuildHistory.FILE_NAME)
+        # transactions are begun explicitly
+        self._db = sqlite3.connect(self._path, isolation_level=None)
+        self._db.executescript(SCHEMA)
+        if self._get_meta('schema') != SCHEMA_VERSION:
+            self._db.execute('BEGIN IMMEDIATE')
+            self._clear()
+            self._set_meta('schema', SCHEMA_VERSION)
+            self._db.execute('COMMIT')
+
+    @classmethod
+    def open(cls, dvcz_dir):
+        """
+        Return the history of the dvcz directory named, creating the
+        database if need be, and bring it up to date with the log.
+        """
+        history = cls(dvcz_dir)
+        try:
+            history.sync()
+        except BaseException:
+            history.close()
+            raise
+        return history
+
+    @classmethod
+    def load(cls, dvcz_dir):
+        """
+        Return the history of the dvcz directory named, read into a
+        database in memory.  Nothing is written, and a last line of the
+        log without a newline is read as if it had one.
+        """
+        history = cls(dvcz_dir, in_memory=True)
+        try:
+            history._db.execute('BEGIN IMMEDIATE')
+            history._sync(complete=True)
+            history._db.execute('COMMIT')
+        except BaseException:
+            history.close()
+            raise
+        return history
+
+    @property
+    def path(self):
+        """ Return the path to the database, or ':memory:'. """
+        return self._path
+
+    @property
+    def connection(self):
+        """
+        Return the sqlite3 connection, for queries not provided here.
+        It is in autocommit mode.
+        """
+        return self._db
+
+    def close(self):
+        """ Close the database. """
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT count(*) FROM builds').fetchone()[0]
+
+    # SYNCING WITH THE LOG ------------------------------------------
+
+    def _get_meta(self, name):
+        """ Return the value recorded under name, or None. """
+        row = self._db.execute('SELECT value FROM meta WHERE name = ?',
+                               (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        """ Record value under name. """
+        self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                         (name, str(value)))
+
+    def _clear(self):
+        """ Forget everything read from the log. """
+        self._db.execute('DELETE FROM builds')
+        self._db.execute('DELETE FROM bad_lines')
+        self._db.execute("DELETE FROM meta WHERE name != 'schema'")
+
+    def _synced_to(self, stat_):
+        """
+        Return how far into the log, whose os.stat() is stat_, the
+        database has read, or zero if the log is not the one read or
+        has been changed other than by appending to it.
+        """
+        if self._get_meta('inode') != str(stat_.st_ino):
+            return 0
+        offset = int(self._get_meta('offset') or 0)
+        tail = (self._get_meta('tail') or '').encode('utf-8')
+        if offset > stat_.st_size or len(tail) > offset:
+            return 0
+        with open(self._path_to_log, 'rb') as file:
+            file.seek(offset - len(tail))
+            if file.read(len(tail)) != tail:
+                return 0
+        return offset
+
+    def sync(self):
+        """
+        Add any lines appended to the log since the last sync, or
+        rebuild the database if the log has been rewritten.  A final
+        line without a newline, which may still be being written, is
+        left for next time.  Returns the number of lines added.
+        """
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            added = self._sync()
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        return added
+
+    def _sync(self, complete=False):
+        """
+        Do the work of sync() inside a transaction.  If complete is set,
+        a last line without a newline is read too.
+        """
+        try:
+            stat_ = os.stat(self._path_to_log)
+        except FileNotFoundError:
+            self._clear()
+            return 0
+        offset = self._synced_to(stat_)
+        if offset == 0:
+            self._clear()
+        with open(self._path_to_log, 'rb') as file:
+            file.seek(offset)
+            data = file.read()
+        if complete and data and not data.endswith(b'\n'):
+            data += b'\n'
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return 0
+        lines = data[:end].decode('utf-8', 'replace').split('\n')[:-1]
+
+        seq = int(self._get_meta('lines') or 0)
+        builds = []
+        bad_lines = []
+        for ndx, line in enumerate(lines, seq):
+            match = BUILDS_LINE_RE.match(line)
+            if match:
+                builds.append((ndx,) + match.groups())
+            else:
+                bad_lines.append((ndx, line))
+        self._db.executemany('INSERT INTO builds VALUES (?, ?, ?, ?)',
+                             builds)
+        self._db.executemany('INSERT INTO bad_lines VALUES (?, ?)',
+                             bad_lines)
+        self._set_meta('inode', stat_.st_ino)
+        self._set_meta('offset', offset + end)
+        self._set_meta('tail', lines[-1] + '\n')
+        self._set_meta('lines', seq + len(lines))
+        return len(lines)
+
+    def rebuild(self):
+        """ Discard the database's contents and read the whole log. """
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._clear()
+            added = self._sync()
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        return added
+
+    # QUERIES -------------------------------------------------------
+
+    def _records(self, where='', params=(), order='seq'):
+        """ Return the BuildRecords selected, as a list. """
+        sql = 'SELECT %s FROM builds %s ORDER BY %s' % (
+            COLUMNS, 'WHERE ' + where if where else '', order)
+        return [BuildRecord(*row) for row in self._db.execute(sql, params)]
+
+    def records(self):
+        """ Return every build in the order logged. """
+        return self._records()
+
+    def latest(self, version=None):
+        """
+        Return the BuildRecord of the most recent build, or of the most
+        recent build of version if that is given, or None if there is
+        no such build.
+        """
+        if version is None:
+            found = self._records(order='timestamp DESC, seq DESC LIMIT 1')
+        else:
+            found = self._records('version = ?', (version,),
+                                  'timestamp DESC, seq DESC LIMIT 1')
+        return found[0] if found else None
+
+    def for_version(self, version):
+        """ Return the builds of version, oldest first. """
+        return self._records('version = ?', (version,), 'timestamp, seq')
+
+    def between(self, since=None, until=None):
+        """
+        Return the builds made at or after since and before until,
+        oldest first.  Each is a timestamp such as '2018-03-17 10:02:00'
+        or a prefix of one such as '2018-03-17', and may be None.
+        """
+        clauses = []
+        params = []
+        if since:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            clauses.append('timestamp < ?')
+            params.append(until)
+        return self._records(' AND '.join(clauses), params, 'timestamp, seq')
+
+    def for_hash(self, list_hash):
+        """ Return the builds whose BuildList has the content key given. """
+        return self._records('list_hash = ?', (list_hash,))
+
+    def versions(self):
+        """
+        Return (version, count, first, last) for each version built, in
+        the order first built, where first and last are the timestamps
+        of its earliest and latest builds.
+        """
+        return self._db.execute(
+            'SELECT version, count(*), min(timestamp), max(timestamp) '
+            'FROM builds GROUP BY version '
+            'ORDER BY min(timestamp), min(seq)').fetchall()
+
+    def bad_lines(self):
+        """ Return (seq, line) for each malformed line in the log. """
+        return self._db.execute(
+            'SELECT seq, line FROM bad_lines ORDER BY seq').fetchall()
+
+
+def record_build(dvcz_dir):
+    """
+    Bring the history in dvcz_dir up to date after a line has been
+    appended to the builds log.
+    """
+    with BuildHistory.open(dvcz_dir):
+        pass
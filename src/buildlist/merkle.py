@@ -0,0 +1,109 @@
+# buildlist/merkle.py
+
+"""
+Merkle digests for the directories in a BuildList's tree.
+
+The digest of a directory is taken over its children in order: for a
+file, b'F', its name, a NUL, and its content hash; for a subdirectory,
+b'D', its name, a NUL, and the subdirectory's own digest.  Two trees
+hold the same content exactly when their root digests are equal, and
+two directories whose digests match need not be looked into further.
+The hash used is that of the tree's content hashes.
+"""
+
+from buildlist.compact import LEAF_TYPES
+from buildlist.diff import DiffEntry
+from buildlist.hashing import new_hash
+from buildlist.walker import walk_leaves
+
+__all__ = ['merkle_digests', 'merkle_diff', ]
+
+
+def merkle_digests(tree):
+    """
+    Return a dict mapping the path of each directory in tree, relative
+    to the root and separated by '/', to its binary Merkle digest.  The
+    root's path is ''.
+    """
+    digests = {}
+
+    def digest_of(dir_, path):
+        """ Compute the digests for dir_ and everything below it. """
+        sha = new_hash(tree.hashtype)
+        for node in dir_.nodes:
+            name = node.name.encode('utf-8')
+            if isinstance(node, LEAF_TYPES):
+                sha.update(b'F' + name + b'\0' + node.bin_hash)
+            else:
+                child = path + '/' + node.name if path else node.name
+                sha.update(b'D' + name + b'\0' + digest_of(node, child))
+        digests[path] = sha.digest()
+        return digests[path]
+
+    digest_of(tree, '')
+    return digests
+
+
+def _leaves(node, path):
+    """ Yield (path, bin_hash) for node, a file or a directory. """
+    if isinstance(node, LEAF_TYPES):
+        yield path, node.bin_hash
+    else:
+        for sub_path, bin_hash in walk_leaves(node, path + '/'):
+            yield sub_path, bin_hash
+
+
+def merkle_diff(tree_a, digests_a, tree_b, digests_b):
+    """
+    Yield a DiffEntry for each file added, removed, or changed between
+    tree_a and tree_b, as diff_trees() does, given the Merkle digests
+    of each.  Directories whose digests match are skipped unvisited.
+    """
+
+    def diff_dirs(dir_a, dir_b, path):
+        """ Compare the children of two directories at path. """
+        if digests_a.get(path) == digests_b.get(path):
+            return
+        prefix = path + '/' if path else ''
+        nodes_a = iter(dir_a.nodes)
+        nodes_b = iter(dir_b.nodes)
+        node_a = next(nodes_a, None)
+        node_b = next(nodes_b, None)
+        while node_a is not None or node_b is not None:
+            if node_b is None or (node_a is not None and
+                                  node_a.name < node_b.name):
+                for leaf_path, bin_hash in _leaves(node_a,
+                                                   prefix + node_a.name):
+                    yield DiffEntry('removed', leaf_path, bin_hash, None)
+                node_a = next(nodes_a, None)
+                continue
+            if node_a is None or node_b.name < node_a.name:
+                for leaf_path, bin_hash in _leaves(node_b,
+                                                   prefix + node_b.name):
+                    yield DiffEntry('added', leaf_path, None, bin_hash)
+                node_b = next(nodes_b, None)
+                continue
+
+            child = prefix + node_a.name
+            leaf_a = isinstance(node_a, LEAF_TYPES)
+            leaf_b = isinstance(node_b, LEAF_TYPES)
+            if leaf_a and leaf_b:
+                if node_a.bin_hash != node_b.bin_hash:
+                    yield DiffEntry('changed', child, node_a.bin_hash,
+                                    node_b.bin_hash)
+            elif not leaf_a and not leaf_b:
+                yield from diff_dirs(node_a, node_b, child)
+            else:
+                # the file sorts before the files under the directory
+                removed = [DiffEntry('removed', leaf_path, bin_hash, None)
+                           for leaf_path, bin_hash in _leaves(node_a, child)]
+                added = [DiffEntry('added', leaf_path, None, bin_hash)
+                         for leaf_path, bin_hash in _leaves(node_b, child)]
+                if leaf_a:
+                    yield from removed + added
+                else:
+                    yield from added + removed
+            node_a = next(nodes_a, None)
+            node_b = next(nodes_b, None)
+
+    yield from diff_dirs(tree_a, tree_b, '')
@@ -0,0 +1,93 @@
+# buildlist/populate.py
+
+"""
+Populate a data directory from a content-keyed store using a bounded
+pool of worker threads.
+
+All directories are created first, serially, so that copies never race
+with directory creation.  Files are then copied concurrently.  Errors
+do not stop the other copies; once every copy has finished, the error
+for the file appearing first in the tree, if any, is raised, so the
+outcome does not depend on scheduling.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from xlu import UDir
+
+from buildlist import stats
+from buildlist.chunks import assemble, path_to_manifest
+from buildlist.compact import LEAF_TYPES
+from buildlist.encoding import copy_object
+
+__all__ = ['copy_from_u', 'plan_populate', 'populate_from_u', ]
+
+
+def plan_populate(tree, path, dirs=None, files=None):
+    """
+    Return a list of the directories under path which tree describes
+    and a list of (path_to_file, hex_hash) pairs, one for each file,
+    both in tree order.
+    """
+    if dirs is None:
+        dirs = []
+    if files is None:
+        files = []
+    path = os.path.join(path, tree.name)
+    dirs.append(path)
+    for node in tree.nodes:
+        if isinstance(node, LEAF_TYPES):
+            files.append((os.path.join(path, node.name), node.hex_hash))
+        else:
+            plan_populate(node, path, dirs, files)
+    return dirs, files
+
+
+def copy_from_u(u_dir, u_path, path_to_file, hex_hash):
+    """
+    Copy the object with key hex_hash out of u_dir, the UDir at u_path,
+    to path_to_file, reassembling it if it is stored as chunks and
+    decompressing it if it is compressed.  Returns the length of the
+    file.  Raises RuntimeError if it is not there or can't be decoded.
+    """
+    if not u_dir.exists(hex_hash):
+        if os.path.exists(path_to_manifest(u_path, hex_hash)):
+            return assemble(u_dir, u_path, hex_hash, path_to_file)
+        raise RuntimeError(
+            "%s: %s is not in %s" % (path_to_file, hex_hash, u_path))
+    return copy_object(u_dir, hex_hash, path_to_file)
+
+
+def populate_from_u(tree, u_path, path, workers=4):
+    """
+    Recreate under path, the directory containing the data directory,
+    the directories and files described by tree, copying each file
+    from the UDir at u_path using at most workers threads.  Returns the
+    number of files copied.
+    """
+    u_dir = UDir.discover(u_path)
+    dirs, files = plan_populate(tree, path)
+    for dir_ in dirs:
+        os.makedirs(dir_, mode=0o755, exist_ok=True)
+
+    def copy(pair):
+        """
+        Copy one file out of U, returning its length or any exception
+        raised.
+        """
+        path_to_file, hex_hash = pair
+        try:
+            return copy_from_u(u_dir, u_path, path_to_file, hex_hash)
+        except (OSError, RuntimeError) as exc:
+            return exc
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(copy, files))
+    lengths = [result for result in results if isinstance(result, int)]
+    stats.count('populate', files=len(lengths), bytes_read=sum(lengths),
+                bytes_written=sum(lengths))
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return len(files)
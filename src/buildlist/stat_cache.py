@@ -0,0 +1,143 @@
+# buildlist/stat_cache.py
+
+"""
+A persistent cache mapping file metadata to content hashes.
+
+If a file's path, size, mtime_ns, and inode number are unchanged since
+the cache entry was made, its content hash is taken from the cache
+rather than recomputed.  Entries are kept per hashtype.
+
+The cache is a text file, by default .dvcz/statCache, with one entry
+per line:
+
+    HASHTYPE SIZE MTIME_NS INODE HEX_HASH PATH
+
+where PATH is absolute and runs to the end of the line.  The first line
+records the time the cache was written.  As in git's index, an entry
+whose mtime is not earlier than that time is not trusted: the file may
+have been modified again within the granularity of the clock.
+"""
+
+import binascii
+import os
+import time
+
+__all__ = ['StatCache', ]
+
+
+class StatCache(object):
+    """ Map (path, size, mtime_ns, inode) to a content hash. """
+
+    FILE_NAME = 'statCache'
+    HEADER = '# buildlist statCache v1 '
+
+    def __init__(self, path_to_cache, rehash=False):
+        """
+        Load the cache at path_to_cache if it exists.  If rehash is set,
+        existing entries are discarded, so that every file is hashed
+        again and the cache is rewritten from scratch.
+        """
+        self._path = path_to_cache
+        self._entries = {}      # (path, hashtype) -> (size, mtime, ino, hash)
+        self._seen = set()
+        self._written_ns = 0
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        if not rehash and os.path.exists(path_to_cache):
+            self._read()
+
+    @classmethod
+    def load(cls, dvcz_dir, rehash=False):
+        """ Return the cache belonging to the dvcz directory named. """
+        return cls(os.path.join(dvcz_dir, cls.FILE_NAME), rehash)
+
+    @property
+    def path(self):
+        """ Return the path to the file backing the cache. """
+        return self._path
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _read(self):
+        """ Load entries from disk, silently dropping malformed lines. """
+        with open(self._path, 'r', encoding='utf-8') as file:
+            header = file.readline()
+            if not header.startswith(StatCache.HEADER):
+                return
+            try:
+                self._written_ns = int(header[len(StatCache.HEADER):])
+            except ValueError:
+                return
+            for line in file:
+                parts = line[:-1].split(' ', 5)
+                if len(parts) != 6:
+                    continue
+                try:
+                    key = (parts[5], int(parts[0]))
+                    self._entries[key] = (int(parts[1]), int(parts[2]),
+                                          int(parts[3]),
+                                          binascii.a2b_hex(parts[4]))
+                except (ValueError, binascii.Error):
+                    continue
+
+    def lookup(self, path, stat_, hashtype):
+        """
+        Return the binary content hash recorded for the file at path if
+        stat_, the result of os.stat(path), shows that it is unchanged.
+        Otherwise return None.
+        """
+        path = os.path.abspath(path)
+        self._seen.add(path)
+        entry = self._entries.get((path, int(hashtype)))
+        if entry is not None:
+            size, mtime_ns, ino, bin_hash = entry
+            if size == stat_.st_size and mtime_ns == stat_.st_mtime_ns and \
+                    ino == stat_.st_ino and mtime_ns < self._written_ns:
+                self.hits += 1
+                return bin_hash
+        self.misses += 1
+        return None
+
+    def record(self, path, stat_, hashtype, bin_hash):
+        """ Record the content hash of the file at path. """
+        path = os.path.abspath(path)
+        if '\n' in path:
+            return                  # can't be represented; never cached
+        self._seen.add(path)
+        self._entries[(path, int(hashtype))] = (
+            stat_.st_size, stat_.st_mtime_ns, stat_.st_ino, bin_hash)
+        self._dirty = True
+
+    def save(self):
+        """
+        Write the cache back to disk if anything has changed, replacing
+        the old file atomically.  Entries for files not looked at during
+        this session are kept only if the file still exists.
+        """
+        gone = set()
+        for path, _ in self._entries:
+            if path not in self._seen and path not in gone and \
+                    not os.path.exists(path):
+                gone.add(path)
+        if gone:
+            self._entries = {key: value
+                             for key, value in self._entries.items()
+                             if key[0] not in gone}
+            self._dirty = True
+        if not self._dirty:
+            return
+
+        written_ns = int(time.time() * 1e9)
+        path_to_tmp = self._path + '.tmp'
+        with open(path_to_tmp, 'w', encoding='utf-8') as file:
+            file.write('%s%d\n' % (StatCache.HEADER, written_ns))
+            for (path, hashtype), value in sorted(self._entries.items()):
+                size, mtime_ns, ino, bin_hash = value
+                file.write('%d %d %d %d %s %s\n' % (
+                    hashtype, size, mtime_ns, ino,
+                    binascii.b2a_hex(bin_hash).decode('utf-8'), path))
+        os.replace(path_to_tmp, self._path)
+        self._written_ns = written_ns
+        self._dirty = False
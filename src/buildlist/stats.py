@@ -0,0 +1,192 @@
+# buildlist/stats.py
+
+"""
+Per-phase timing and I/O counters for BuildList operations.
+
+Instrumented code brackets each phase of its work with phase(name) and
+reports what it read and wrote with count().  Both do nothing unless a
+StatsCollector has been made active with collecting(), so the cost when
+statistics are not wanted is a global lookup per call.  Phases may
+nest:  list_gen, for example, contains walk, hash, sign, serialize and
+u_write.  Counts may be reported from worker threads.
+
+For each phase a collector records the number of times it was entered,
+the wall time spent in it, the files it touched, and the bytes it read
+and wrote.  Peak memory is only kept for the process as a whole, and
+only ever rises, so for each phase what is recorded is how far the
+phase raised it, peak_rss_growth_kb, and what it stood at, over the
+process so far, when the phase last ended, process_peak_rss_kb.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+__all__ = ['STATS_FILE', 'PhaseStats', 'StatsCollector', 'active',
+           'collecting', 'count', 'peak_rss_kb', 'phase', ]
+
+STATS_FILE = 'stats'        # in the dvcz directory, beside 'builds'
+
+
+def peak_rss_kb():
+    """ Return the peak resident set size of this process in KB. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024               # reported in bytes on macOS
+    return peak
+
+
+class PhaseStats(object):
+    """ What was measured for one phase. """
+
+    __slots__ = ['calls', 'seconds', 'files', 'bytes_read', 'bytes_written',
+                 'peak_rss_growth_kb', 'process_peak_rss_kb']
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.files = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss_growth_kb = 0
+        self.process_peak_rss_kb = 0
+
+    def as_dict(self):
+        """ Return the measurements as a dict. """
+        values = OrderedDict((name, getattr(self, name))
+                             for name in self.__slots__)
+        values['seconds'] = round(self.seconds, 6)
+        return values
+
+
+class StatsCollector(object):
+    """ Accumulate PhaseStats by phase name, in order of first use. """
+
+    def __init__(self):
+        self._phases = OrderedDict()
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    @property
+    def phases(self):
+        """ Return the OrderedDict mapping phase names to PhaseStats. """
+        return self._phases
+
+    def _get(self, name):
+        """ Return the PhaseStats for name, creating it if need be. """
+        stats = self._phases.get(name)
+        if stats is None:
+            stats = self._phases.setdefault(name, PhaseStats())
+        return stats
+
+    @contextmanager
+    def phase(self, name):
+        """ Time the block as one call of the phase named. """
+        start = time.time()
+        peak_before = peak_rss_kb()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            peak = peak_rss_kb()
+            with self._lock:
+                stats = self._get(name)
+                stats.calls += 1
+                stats.seconds += elapsed
+                stats.peak_rss_growth_kb += peak - peak_before
+                stats.process_peak_rss_kb = peak
+
+    def count(self, name, files=0, bytes_read=0, bytes_written=0):
+        """ Add to the files touched and bytes moved by the phase named. """
+        with self._lock:
+            stats = self._get(name)
+            stats.files += files
+            stats.bytes_read += bytes_read
+            stats.bytes_written += bytes_written
+
+    def as_dict(self):
+        """ Return everything collected, suitable for serializing as JSON. """
+        return OrderedDict([
+            ('seconds', round(time.time() - self._started, 6)),
+            ('peak_rss_kb', peak_rss_kb()),
+            ('phases', OrderedDict((name, stats.as_dict())
+                                   for name, stats in self._phases.items())),
+        ])
+
+    def summary(self):
+        """ Return a table of the phases for printing. """
+        lines = ['%-16s %6s %10s %9s %13s %13s %10s %12s' % (
+            'phase', 'calls', 'seconds', 'files', 'bytes read',
+            'bytes written', 'peak +KB', 'proc peak KB')]
+        for name, stats in self._phases.items():
+            lines.append('%-16s %6d %10.3f %9d %13d %13d %10d %12d' % (
+                name, stats.calls, stats.seconds, stats.files,
+                stats.bytes_read, stats.bytes_written,
+                stats.peak_rss_growth_kb, stats.process_peak_rss_kb))
+        return '\n'.join(lines)
+
+    def append_to(self, dvcz_dir, **fields):
+        """
+        Append a JSON record of everything collected, preceded by any
+        fields given, as one line of STATS_FILE in dvcz_dir.
+        """
+        record = OrderedDict(sorted(fields.items()))
+        record.update(self.as_dict())
+        with open(os.path.join(dvcz_dir, STATS_FILE), 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+
+_ACTIVE = None
+
+
+class _NoPhase(object):
+    """ A do-nothing context, returned by phase() when not collecting. """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def active():
+    """ Return the active StatsCollector, or None. """
+    return _ACTIVE
+
+
+@contextmanager
+def collecting(collector=None):
+    """
+    Make collector, or a new StatsCollector, active for the duration of
+    the block, yielding it.
+    """
+    global _ACTIVE          # pylint: disable=global-statement
+    if collector is None:
+        collector = StatsCollector()
+    previous = _ACTIVE
+    _ACTIVE = collector
+    try:
+        yield collector
+    finally:
+        _ACTIVE = previous
+
+
+def phase(name):
+    """ Return a context timing the phase named if collecting. """
+    if _ACTIVE is None:
+        return _NO_PHASE
+    return _ACTIVE.phase(name)
+
+
+def count(name, files=0, bytes_read=0, bytes_written=0):
+    """ Report files touched and bytes moved by a phase if collecting. """
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, files, bytes_read, bytes_written)
@@ -0,0 +1,127 @@
+# buildlist/store.py
+
+"""
+Save the files described by a BuildList into a content-keyed store.
+
+Between consecutive builds most files are unchanged, so most of their
+content keys are already in U.  The keys are looked up first, together,
+and files whose content is already stored are neither read nor written.
+Files of at least chunk_threshold bytes, if that is set, are stored as
+content-defined chunks; see buildlist.chunks.  Files are compressed
+if U has been set to do that; see buildlist.encoding.
+"""
+
+import os
+from collections import namedtuple
+
+from xlu import UDir
+
+from buildlist import stats
+from buildlist.chunks import find_missing_files, put_chunked
+from buildlist.encoding import MAGIC, get_encoding, has_encoding, put_encoded
+from buildlist.uindex import note_keys_put
+from buildlist.walker import walk_leaves
+
+__all__ = ['USaveStats', 'plan_save', 'put_file', 'save_tree_to_u_dir',
+           'stored_whole', ]
+
+USaveStats = namedtuple('USaveStats', ['written', 'skipped', 'bytes_written'])
+USaveStats.__doc__ = """
+Result of saving the files in a BuildList to U:  the number of files
+copied into U, the number already present there, and the number of
+bytes written.
+"""
+
+
+def plan_save(tree, data_dir, u_path, u_dir):
+    """
+    Return the number of files in tree, an NLHTree describing data_dir,
+    and a (path_to_file, hex_hash) pair, in tree order, for the first
+    file with each content key not already in u_dir, the UDir at u_path.
+    """
+    if data_dir and data_dir[-1] == '/':
+        data_dir = data_dir[:-1]
+    leaves = [(rel_path, bin_hash.hex())
+              for rel_path, bin_hash in walk_leaves(tree)]
+    todo = set(find_missing_files(
+        u_path, [hex_hash for _, hex_hash in leaves], u_dir.exists,
+        verify=False))
+    pairs = []
+    for rel_path, hex_hash in leaves:
+        if hex_hash in todo:
+            todo.discard(hex_hash)
+            pairs.append((os.path.join(data_dir, rel_path), hex_hash))
+    return len(leaves), pairs
+
+
+def _begins_with_magic(path_to_file):
+    """ Whether the file begins as an encoded object in U does. """
+    with open(path_to_file, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def stored_whole(length, chunk_threshold):
+    """
+    Whether put_file() stores a file of length bytes whole rather than
+    as chunks.  Only such keys belong in U's index, which records
+    objects, not manifests.
+    """
+    return not chunk_threshold or length < chunk_threshold
+
+
+def put_file(u_dir, u_path, path_to_file, hex_hash, hashtype,
+             chunk_threshold=0, encoding=None):
+    """
+    Copy the file into u_dir, the UDir at u_path, under hex_hash, as
+    chunks if chunk_threshold is set and the file is at least that
+    long, warning if its content does not in fact hash to hex_hash.
+    It is compressed with encoding, by default that set for U, if that
+    makes it smaller.  Returns the length, the number of bytes written,
+    and the hash.
+    """
+    if encoding is None:
+        encoding = get_encoding(u_path)
+    if chunk_threshold and os.path.getsize(path_to_file) >= chunk_threshold:
+        (length, written, hash_back) = put_chunked(
+            u_dir, u_path, path_to_file, hex_hash, hashtype, encoding)
+    elif encoding != 'none' or (has_encoding(u_path) and
+                                _begins_with_magic(path_to_file)):
+        (length, written, hash_back) = put_encoded(
+            u_dir, u_path, path_to_file, hashtype, encoding)
+    else:
+        (length, hash_back) = u_dir.copy_and_put(path_to_file, hex_hash)
+        written = length
+    if hash_back != hex_hash:
+        print("WARNING: wrote %s to U as %s, but actual hash is %s" % (
+            path_to_file, hex_hash, hash_back))
+    return length, written, hash_back
+
+
+def save_tree_to_u_dir(tree, data_dir, u_path, chunk_threshold=0):
+    """
+    Copy each file in tree, an NLHTree describing data_dir, into the
+    UDir at u_path unless its content key is already there, adding the
+    keys written to U's index if it has one.  Files of chunk_threshold
+    bytes or more, if that is set, are stored as chunks, and files are
+    compressed as U's encoding says.  Returns a USaveStats.
+    """
+    u_dir = UDir.discover(u_path)
+    encoding = get_encoding(u_path)
+    leaf_count, pairs = plan_save(tree, data_dir, u_path, u_dir)
+
+    written = []
+    whole = []
+    bytes_read = bytes_written = 0
+    for path_to_file, hex_hash in pairs:
+        (length, count, hash_back) = put_file(
+            u_dir, u_path, path_to_file, hex_hash, tree.hashtype,
+            chunk_threshold, encoding)
+        written.append(hash_back)
+        if stored_whole(length, chunk_threshold):
+            whole.append(hash_back)
+        bytes_read += length
+        bytes_written += count
+    note_keys_put(u_path, whole)
+    stats.count('u_write', files=len(written), bytes_read=bytes_read,
+                bytes_written=bytes_written)
+    return USaveStats(len(written), leaf_count - len(written), bytes_written)
@@ -0,0 +1,121 @@
+# buildlist/synth.py
+
+"""
+Deterministic synthetic data directories for benchmarking.
+
+Given the same parameters and seed, make_data_dir() writes the same
+tree byte for byte: the same directories, file names, sizes, and
+contents.  Files are spread over directories nested up to the depth
+given, each holding about FILES_PER_DIR files and SUBDIRS subdirectories.
+Files hold random bytes, which do not compress, or, with content 'text',
+lines drawn from a fixed pool, which compress about as well as source
+code does.
+"""
+
+import os
+import random
+
+__all__ = ['CONTENTS', 'FILES_PER_DIR', 'SIZE_DISTRIBUTIONS', 'SUBDIRS',
+           'file_size', 'make_data_dir', ]
+
+FILES_PER_DIR = 32
+SUBDIRS = 4
+
+# name -> (description, function of rng returning a size in bytes)
+SIZE_DISTRIBUTIONS = {
+    'tiny': ('all files 0 to 256 bytes',
+             lambda rng: rng.randint(0, 256)),
+    'source': ('log-normal around 4KB, like a source tree',
+               lambda rng: min(int(rng.lognormvariate(8.3, 1.2)), 1 << 20)),
+    'uniform': ('uniform from 0 to 64KB',
+                lambda rng: rng.randint(0, 1 << 16)),
+    'mixed': ('mostly small, one in a hundred of 1 to 8MB',
+              lambda rng: rng.randint(1 << 20, 1 << 23)
+              if rng.random() < 0.01 else rng.randint(0, 1 << 14)),
+}
+
+CONTENTS = ('random', 'text')
+
+# words from which the lines of text files are made
+WORDS = ['def', 'return', 'self', 'if', 'else', 'for', 'in', 'import',
+         'from', 'class', 'None', 'True', 'False', 'path', 'file', 'data',
+         'name', 'tree', 'hash', 'key', 'list', 'count', 'value', 'os',
+         '=', '==', '(', ')', ':', ',', '+', '[]', '{}', '0', '1', '#']
+POOL_LINES = 4096
+
+
+def _text_pool(seed):
+    """ Return the pool of lines, as bytes, that text files are made of. """
+    rng = random.Random(seed)
+    return [(' ' * 4 * rng.randint(0, 3) +
+             ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))) +
+             '\n').encode('ascii')
+            for _ in range(POOL_LINES)]
+
+
+def _text(rng, pool, size):
+    """ Return size bytes of text made of lines from the pool. """
+    lines = []
+    length = 0
+    while length < size:
+        line = pool[rng.randrange(len(pool))]
+        lines.append(line)
+        length += len(line)
+    return b''.join(lines)[:size]
+
+
+def file_size(rng, sizes):
+    """ Return the size of the next file for the named distribution. """
+    return SIZE_DISTRIBUTIONS[sizes][1](rng)
+
+
+def make_data_dir(path_to_dir, file_count, seed=42, depth=4,
+                  sizes='source', content='random'):
+    """
+    Create a data directory at path_to_dir, which must not exist,
+    holding file_count files, whose content is one of CONTENTS.
+    Returns the total number of bytes in the files.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    if sizes not in SIZE_DISTRIBUTIONS:
+        raise ValueError("unknown size distribution '%s'" % sizes)
+    if content not in CONTENTS:
+        raise ValueError("unknown content '%s'" % content)
+    if depth < 1:
+        raise ValueError("depth must be at least 1")
+    rng = random.Random(seed)
+    pool = _text_pool(seed) if content == 'text' else None
+    os.makedirs(path_to_dir)
+    total = 0
+    remaining = file_count
+
+    # breadth first, so that shallow directories fill before deep ones;
+    # once the depth limit is reached, the deepest level grows wider
+    queue = [(path_to_dir, 1)]
+    dir_path = path_to_dir
+    extra = 0
+    while remaining > 0:
+        if queue:
+            dir_path, level = queue.pop(0)
+        else:
+            dir_path = os.path.join(os.path.dirname(dir_path), 'x%d' % extra)
+            extra += 1
+            os.mkdir(dir_path)
+        count = remaining if depth == 1 else min(remaining, FILES_PER_DIR)
+        for ndx in range(count):
+            size = file_size(rng, sizes)
+            name = 'f%04d_%04x.dat' % (ndx, rng.getrandbits(16))
+            with open(os.path.join(dir_path, name), 'wb') as file:
+                if size and pool:
+                    file.write(_text(rng, pool, size))
+                elif size:
+                    file.write(rng.getrandbits(8 * size).to_bytes(
+                        size, 'little'))
+            total += size
+        remaining -= count
+        if level < depth and remaining > 0:
+            for ndx in range(SUBDIRS):
+                sub_path = os.path.join(dir_path, 'd%d' % ndx)
+                os.mkdir(sub_path)
+                queue.append((sub_path, level + 1))
+    return total
@@ -0,0 +1,255 @@
+# buildlist/uindex.py
+
+"""
+A persistent index of the content keys present in a U directory.
+
+Checking whether a key is in U normally costs a stat() per key, which
+dominates on large stores, particularly over NFS.  The index is a file,
+U/uIndex, holding a short header followed by every key in binary, all
+of the same width and sorted, so that it can be memory-mapped and
+searched without being read into memory.  Keys put into U after the
+index was built are appended to U/uIndex.new, which is small and is
+read in full.  UIndex.build() scans U and rewrites both.
+
+The index is only ever trusted to say that a key IS present: objects
+are not removed from U.  A key not found in it may have been added by
+something which did not update the index, so it is looked for on disk
+in the usual way.  If there is no usable index everything is.
+"""
+
+import binascii
+import mmap
+import os
+import struct
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+from xlattice import HashTypes, check_hashtype
+from xlu import UDir
+
+__all__ = ['UIndex', 'find_missing_keys', 'note_keys_put', 'scan_keys', ]
+
+# header: magic, then key width in bytes and number of keys, big-endian
+MAGIC = b'BLUIDX1\n'
+HEADER = struct.Struct('>II')
+HEADER_LEN = len(MAGIC) + HEADER.size
+
+
+def _key_len(hashtype):
+    """ Return the width in bytes of keys of the given type. """
+    check_hashtype(hashtype)
+    return 20 if hashtype == HashTypes.SHA1 else 32
+
+
+class UIndex(object):
+    """ The sorted, memory-mapped index of the keys in a U directory. """
+
+    FILE_NAME = 'uIndex'
+    NEW_FILE_NAME = 'uIndex.new'
+
+    def __init__(self, u_path, key_len, file, mm_, count):
+        self._u_path = u_path
+        self._key_len = key_len
+        self._file = file
+        self._mm = mm_
+        self._count = count
+        self._new = set()
+        path_to_new = os.path.join(u_path, UIndex.NEW_FILE_NAME)
+        if os.path.exists(path_to_new):
+            with open(path_to_new, 'rb') as new_file:
+                data = new_file.read()
+            # a torn final write is ignored
+            for offset in range(0, len(data) - key_len + 1, key_len):
+                self._new.add(data[offset:offset + key_len])
+
+    @classmethod
+    def open(cls, u_path):
+        """
+        Return the index for the U directory at u_path, or None if there
+        is none or it is damaged.
+        """
+        path_to_index = os.path.join(u_path, UIndex.FILE_NAME)
+        try:
+            file = open(path_to_index, 'rb')
+        except OSError:
+            return None
+        try:
+            header = file.read(HEADER_LEN)
+            if len(header) != HEADER_LEN or not header.startswith(MAGIC):
+                file.close()
+                return None
+            key_len, count = HEADER.unpack(header[len(MAGIC):])
+            if key_len not in (20, 32) or \
+                    os.fstat(file.fileno()).st_size != \
+                    HEADER_LEN + key_len * count:
+                file.close()
+                return None
+            mm_ = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            file.close()
+            return None
+        return cls(u_path, key_len, file, mm_, count)
+
+    @classmethod
+    def build(cls, u_path, hashtype=HashTypes.SHA2):
+        """
+        Scan the U directory at u_path for keys of the type given and
+        write a fresh index, replacing any old one.  Returns the number
+        of keys found.
+        """
+        key_len = _key_len(hashtype)
+        keys = sorted(binascii.a2b_hex(key)
+                      for key in scan_keys(u_path, key_len))
+
+        path_to_index = os.path.join(u_path, UIndex.FILE_NAME)
+        path_to_tmp = path_to_index + '.tmp'
+        with open(path_to_tmp, 'wb') as file:
+            file.write(MAGIC + HEADER.pack(key_len, len(keys)))
+            for key in keys:
+                file.write(key)
+        os.replace(path_to_tmp, path_to_index)
+        path_to_new = os.path.join(u_path, UIndex.NEW_FILE_NAME)
+        if os.path.exists(path_to_new):
+            os.unlink(path_to_new)
+        return len(keys)
+
+    @property
+    def key_len(self):
+        """ Return the width in bytes of the keys indexed. """
+        return self._key_len
+
+    def __len__(self):
+        return self._count + len(self._new)
+
+    def close(self):
+        """ Release the memory map. """
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _search(self, key, low):
+        """
+        Return the position of the first indexed key not less than key,
+        searching from position low onward.
+        """
+        high = self._count
+        width = self._key_len
+        while low < high:
+            mid = (low + high) // 2
+            offset = HEADER_LEN + mid * width
+            if self._mm[offset:offset + width] < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def missing(self, bin_keys):
+        """
+        Return the set of binary keys in bin_keys which are not in the
+        index.  Keys are looked up in sorted order, so that each search
+        starts where the last one ended.
+        """
+        absent = set()
+        low = 0
+        width = self._key_len
+        for key in sorted(set(bin_keys)):
+            if key in self._new:
+                continue
+            low = self._search(key, low)
+            offset = HEADER_LEN + low * width
+            if low >= self._count or self._mm[offset:offset + width] != key:
+                absent.add(key)
+        return absent
+
+    def add(self, hex_keys):
+        """ Record that the keys named, in hex, have been put into U. """
+        bin_keys = [binascii.a2b_hex(key) for key in hex_keys]
+        bin_keys = [key for key in bin_keys
+                    if len(key) == self._key_len and key not in self._new]
+        if not bin_keys:
+            return
+        path_to_new = os.path.join(self._u_path, UIndex.NEW_FILE_NAME)
+        with open(path_to_new, 'ab') as file:
+            file.write(b''.join(bin_keys))
+        self._new.update(bin_keys)
+
+
+# directories in U holding no objects: working space, the manifests of
+# chunked files, and list deltas (see buildlist.chunks, buildlist.delta)
+SKIPPED_DIRS = ('in', 'tmp', 'manifests', 'deltas')
+
+
+def scan_keys(u_path, key_len=None):
+    """
+    Walk the U directory at u_path, returning the set of hex content
+    keys of the objects in it which are key_len bytes wide, or of any
+    width U uses if that is None.  U's working directories are skipped,
+    as are the manifests of chunked files and the deltas of lists,
+    which are named by content key but are not the objects themselves.
+    """
+    widths = (2 * key_len,) if key_len else (40, 64)
+    keys = set()
+
+    def scan(path):
+        """ Collect keys under path. """
+        for entry in scandir(path):
+            if entry.is_dir():
+                if entry.name not in SKIPPED_DIRS:
+                    scan(entry.path)
+            elif len(entry.name) in widths and entry.is_file():
+                try:
+                    binascii.a2b_hex(entry.name)
+                except (binascii.Error, ValueError):
+                    continue
+                keys.add(entry.name)
+    scan(u_path)
+    return keys
+
+
+def find_missing_keys(u_path, hex_keys, exists=None):
+    """
+    Return those of the hex content keys which are not present in the
+    U directory at u_path, each once, in the order first given.
+
+    Keys are first looked up together in U's index.  Any not found
+    there, or all of them if there is no usable index, are checked with
+    exists, a function taking a hex key; by default that of the UDir at
+    u_path.
+    """
+    hex_keys = list(dict.fromkeys(hex_keys))
+    todo = hex_keys
+    index = UIndex.open(u_path)
+    if index is not None:
+        with index:
+            width = index.key_len
+            absent = index.missing(
+                binascii.a2b_hex(key) for key in hex_keys
+                if len(key) == 2 * width)
+        todo = [key for key in hex_keys
+                if len(key) != 2 * width or binascii.a2b_hex(key) in absent]
+    if not todo:
+        return []
+    if exists is None:
+        exists = UDir.discover(u_path).exists
+    return [key for key in todo if not exists(key)]
+
+
+def note_keys_put(u_path, hex_keys):
+    """
+    Add keys just put into the U directory at u_path to its index, if
+    it has one.
+    """
+    index = UIndex.open(u_path)
+    if index is not None:
+        with index:
+            index.add(hex_keys)
@@ -0,0 +1,227 @@
+# buildlist/verify.py
+
+"""
+Verify many BuildLists kept in a content-keyed store at once.
+
+Each list is read from U, reconstructed from deltas if need be, parsed,
+and its signature checked, in a pool of worker processes.  The workers
+return the content keys of the files each list describes as a set of
+binary hashes, which are merged into one set as each list is done, so
+that however many lists share a file its key is looked up in U only
+once, and the lookups are themselves shared out among the pool.  The
+result is a report which serializes as JSON.
+"""
+
+import os
+from collections import OrderedDict, namedtuple
+from multiprocessing import Pool
+
+from Crypto.Hash import SHA
+
+from xlattice import HashTypes, check_hashtype
+
+from buildlist.buildlog import BUILDS_LINE_RE
+from buildlist.chunks import find_missing_files
+from buildlist.walker import walk_leaves
+
+__all__ = ['ListCheck', 'keys_from_builds', 'make_report', 'read_builds',
+           'verify_lists', ]
+
+# content keys are looked up in U this many at a time in each worker
+KEY_CHUNK = 4096
+
+ListCheck = namedtuple('ListCheck',
+                       ['key', 'status', 'detail', 'file_count', 'missing'])
+ListCheck.__doc__ = """
+Result of verifying one BuildList in U.  status is 'ok' if the list was
+read, is signed, its signature verifies, and every file it lists is in
+U; otherwise it is the first of 'unreadable', 'unparseable', 'unsigned',
+'bad_signature', or 'missing_content' to apply, and detail says more.
+file_count is the number of files listed and missing the sorted content
+keys of those not found in U.
+"""
+
+
+def read_builds(path_to_builds):
+    """
+    Return a list of (timestamp, version, key) triples, one for each
+    well-formed line in a builds log such as .dvcz/builds.
+    """
+    entries = []
+    with open(path_to_builds, 'r') as file:
+        for line in file:
+            match = BUILDS_LINE_RE.match(line)
+            if match:
+                entries.append(match.groups())
+    return entries
+
+
+def keys_from_builds(paths):
+    """
+    Return an OrderedDict mapping the content key of each BuildList
+    logged in the builds files named to the files it was logged in,
+    in the order first seen.
+    """
+    keys = OrderedDict()
+    for path in paths:
+        for _, _, key in read_builds(path):
+            sources = keys.setdefault(key, [])
+            if path not in sources:
+                sources.append(path)
+    return keys
+
+
+def _check_list(args):
+    """
+    Read, parse, and verify the signature of one list in U.  Returns
+    (key, status, detail, file_count, content keys), the keys being a
+    set of binary hashes; status is None if all is well so far.  Runs
+    in a worker process.
+    """
+    # pylint: disable=cyclic-import
+    from buildlist import BLIntegrityCheckFailure, BuildList
+
+    u_path, key, hashtype = args
+    sha = SHA.new()
+    try:
+        blist = BuildList.parse_from_u(u_path, key, hashtype, digest=sha,
+                                       compact=True)
+    except BLIntegrityCheckFailure as exc:
+        return key, 'unreadable', str(exc), 0, set()
+    except (RuntimeError, ValueError, UnicodeDecodeError) as exc:
+        return key, 'unparseable', str(exc), 0, set()
+    file_count = 0
+    content_keys = set()
+    for _, bin_hash in walk_leaves(blist.tree):
+        file_count += 1
+        content_keys.add(bytes(bin_hash))
+    if not blist.signed:
+        return key, 'unsigned', 'the list has no signature', \
+            file_count, content_keys
+    if not blist.verify(sha):
+        return key, 'bad_signature', 'the signature does not verify', \
+            file_count, content_keys
+    return key, None, '', file_count, content_keys
+
+
+def _missing_keys(args):
+    """
+    Return the binary keys in a chunk not found in U.  Runs in a worker.
+    """
+    u_path, keys = args
+    missing = find_missing_files(u_path, [key.hex() for key in keys],
+                                 verify=True)
+    return set(bytes.fromhex(key) for key in missing)
+
+
+def _missing_in_list(args):
+    """
+    Return the sorted hex keys of the files in one list which are
+    among those known to be absent from U.  Runs in a worker.
+    """
+    # pylint: disable=cyclic-import
+    from buildlist import BuildList
+
+    u_path, key, hashtype, absent = args
+    blist = BuildList.parse_from_u(u_path, key, hashtype, compact=True)
+    return key, sorted(set(bin_hash.hex()
+                           for _, bin_hash in walk_leaves(blist.tree)
+                           if bytes(bin_hash) in absent))
+
+
+def verify_lists(u_path, keys, hashtype=HashTypes.SHA2, workers=None):
+    """
+    Verify each BuildList in U whose content key is in keys, using a
+    pool of worker processes, at most workers of them (by default one
+    per CPU); with workers equal to 1 everything is done in this
+    process.  Returns a list of ListCheck, one per distinct key, in
+    the order given.
+
+    Only the set of distinct content keys is held for all lists at
+    once.  If any of those turn out to be missing from U, the lists
+    which might refer to them are read a second time to find which.
+    """
+    check_hashtype(hashtype)
+    if u_path and u_path[-1] == '/':
+        u_path = u_path[:-1]
+    keys = list(OrderedDict.fromkeys(keys))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def run(pool, func, jobs):
+        """ Yield func over jobs as each completes, in the pool or here. """
+        if pool is None:
+            return (func(job) for job in jobs)
+        return pool.imap_unordered(func, jobs)
+
+    checked = {}
+    pool = Pool(processes=workers) if workers > 1 else None
+    try:
+        # merge each list's keys as it arrives; keep only its status
+        distinct = set()
+        for key, status, detail, file_count, content_keys in run(
+                pool, _check_list, [(u_path, key, hashtype) for key in keys]):
+            checked[key] = [status, detail, file_count, []]
+            distinct |= content_keys
+
+        # each distinct content key is looked up once, in chunks
+        distinct = sorted(distinct)
+        chunks = [distinct[ndx:ndx + KEY_CHUNK]
+                  for ndx in range(0, len(distinct), KEY_CHUNK)]
+        del distinct
+        absent = set()
+        for missing in run(pool, _missing_keys,
+                           [(u_path, chunk) for chunk in chunks]):
+            absent |= missing
+
+        # only if something is missing: which lists refer to it?
+        if absent:
+            suspects = [key for key in keys if checked[key][0] is None]
+            for key, missing in run(
+                    pool, _missing_in_list,
+                    [(u_path, key, hashtype, absent) for key in suspects]):
+                checked[key][3] = missing
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    results = []
+    for key in keys:
+        status, detail, file_count, missing = checked[key]
+        if status is None:
+            if missing:
+                status = 'missing_content'
+                detail = '%d of %d files not in U' % (
+                    len(missing), file_count)
+            else:
+                status = 'ok'
+        results.append(ListCheck(key, status, detail, file_count, missing))
+    return results
+
+
+def make_report(results, u_path, hashtype, sources=None):
+    """
+    Return a dict, suitable for serializing as JSON, describing the
+    ListChecks in results.  sources may map each list's key to the
+    builds files it was logged in, as keys_from_builds() returns.
+    """
+    lists = []
+    for result in results:
+        entry = OrderedDict(result._asdict())
+        if sources is not None:
+            entry['sources'] = sources.get(result.key, [])
+        lists.append(entry)
+    counts = OrderedDict()
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    return OrderedDict([
+        ('u_path', u_path),
+        ('hashtype', hashtype.name),
+        ('list_count', len(results)),
+        ('ok_count', counts.get('ok', 0)),
+        ('status_counts', OrderedDict(sorted(counts.items()))),
+        ('missing_content_keys',
+         len(set(key for result in results for key in result.missing))),
+        ('lists', lists),
+    ])
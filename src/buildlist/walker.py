@@ -0,0 +1,42 @@
+# buildlist/walker.py
+
+""" Walk the content of a BuildList, an NLHTree, without serializing it. """
+
+from buildlist.compact import LEAF_TYPES, CompactTree
+
+__all__ = ['iter_tree_lines', 'walk_leaves', ]
+
+
+def iter_tree_lines(tree, indent=''):
+    """
+    Yield the lines of the tree's serialization one at a time, without
+    line endings, using the default one-space indent.  Joined with LFs
+    and terminated by one, these are exactly tree.__str__().
+    """
+    if isinstance(tree, CompactTree) and not indent:
+        yield from tree.iter_lines()
+        return
+    yield indent + tree.name
+    indent += ' '
+    for node in tree.nodes:
+        if isinstance(node, LEAF_TYPES):
+            yield '%s%s %s' % (indent, node.name, node.hex_hash)
+        else:
+            yield from iter_tree_lines(node, indent)
+
+
+def walk_leaves(tree, prefix=''):
+    """
+    Yield a (path, bin_hash) pair for each file in the tree, in the
+    order in which the files appear in its serialization.  Paths are
+    relative to the directory the tree describes and separated by '/'.
+    """
+    if isinstance(tree, CompactTree) and not prefix:
+        yield from tree.walk_leaves()
+        return
+    for node in tree.nodes:
+        path = prefix + node.name
+        if isinstance(node, LEAF_TYPES):
+            yield path, node.bin_hash
+        else:
+            yield from walk_leaves(node, path + '/')
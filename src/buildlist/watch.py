@@ -0,0 +1,625 @@
+# buildlist/watch.py
+
+"""
+Keep a BuildList current as the files in its data directory change.
+
+A watcher reports the paths under the data directory which may have
+changed:  on Linux an InotifyWatcher, which is told of each change by
+the kernel, and elsewhere a PollingWatcher, which compares the size,
+mtime and inode of each file with those seen on its last pass.  A
+TreeState holds the content hash of every file in nested dicts and
+rehashes only the paths reported, so that hashing costs are in
+proportion to the files touched.  It also keeps the Merkle digest of
+each directory, as buildlist.merkle computes them, recomputing only
+those above the paths changed.  watch_data_dir() ties these together,
+waiting until no change has been reported for a debounce interval, and
+then signing and writing the list again if the root digest differs
+from that of the list last written.
+
+Symbolic links are followed, as they are by list_gen():  a link to a
+directory is watched as the directory, and a link to a file as the
+file it points to.
+
+Names matching the exclusions in ex_re are skipped wherever they
+appear, as they are by list_gen().  So is the dvcz directory if it lies
+under the data directory, since the list written there would otherwise
+trigger another write.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+from xlu import UDir
+
+from buildlist import stats
+from buildlist.chunks import find_missing_files
+from buildlist.compact import LEAF_TYPES, CompactTree
+from buildlist.encoding import get_encoding
+from buildlist.hashing import file_bin_hash, new_hash
+from buildlist.store import put_file, stored_whole
+from buildlist.uindex import note_keys_put
+
+__all__ = ['InotifyWatcher', 'PollingWatcher', 'TreeState', 'make_watcher',
+           'watch_data_dir', ]
+
+# inotify event bits, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+# for the target of a symbolic link to a file
+LINK_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF |
+             IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')    # wd, mask, cookie, len
+
+# returned among the paths changed when everything must be rescanned
+RESCAN = ''
+
+
+def _excluded(rel_path, ex_re, skip):
+    """ Whether any part of rel_path is excluded or it is under skip. """
+    if skip is not None and (rel_path == skip or
+                             rel_path.startswith(skip + '/')):
+        return True
+    if ex_re is None:
+        return False
+    return any(ex_re.search(name) for name in rel_path.split('/'))
+
+
+def _skip_path(data_dir, dvcz_dir):
+    """
+    Return the path of dvcz_dir relative to data_dir if it lies under
+    it, otherwise None.
+    """
+    if not dvcz_dir:
+        return None
+    root = os.path.realpath(data_dir)
+    path = os.path.realpath(dvcz_dir)
+    if path.startswith(root + os.sep):
+        return path[len(root) + 1:].replace(os.sep, '/')
+    return None
+
+
+class InotifyWatcher(object):
+    """
+    Report changes under a directory using Linux's inotify.  Raises
+    OSError if inotify is not available.
+    """
+
+    def __init__(self, data_dir, ex_re=None, skip=None):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._root = data_dir.rstrip('/')
+        self._ex_re = ex_re
+        self._skip = skip
+        # watch descriptor -> the relative paths it watches, several if
+        # links lead to the same directory or file
+        self._paths = {}
+        self._links = set()         # descriptors watching linked files
+        self._add_tree('')
+
+    def _add_tree(self, rel_dir):
+        """
+        Watch rel_dir and every directory below it not excluded,
+        following links, and the targets of links to files.  Returns
+        the relative paths of the files found.
+        """
+        files = []
+        path = os.path.join(self._root, rel_dir) if rel_dir else self._root
+        wdesc = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), WATCH_MASK)
+        if wdesc < 0:
+            return files            # gone already, or not a directory
+        rel_dirs = self._paths.setdefault(wdesc, set())
+        if any(not other or rel_dir.startswith(other + '/')
+               for other in rel_dirs):
+            return files            # a link back up the tree
+        rel_dirs.add(rel_dir)
+        try:
+            entries = list(scandir(path))
+        except OSError:
+            return files
+        for entry in entries:
+            rel_path = rel_dir + '/' + entry.name if rel_dir else entry.name
+            if _excluded(rel_path, self._ex_re, self._skip):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir:
+                files.extend(self._add_tree(rel_path))
+            else:
+                if entry.is_symlink():
+                    self._add_link(rel_path)
+                files.append(rel_path)
+        return files
+
+    def _add_link(self, rel_path):
+        """ Watch the file which the link at rel_path points to. """
+        wdesc = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(os.path.join(self._root, rel_path)),
+            LINK_MASK)
+        if wdesc >= 0:
+            self._paths.setdefault(wdesc, set()).add(rel_path)
+            self._links.add(wdesc)
+
+    def fileno(self):
+        """ Return the inotify file descriptor. """
+        return self._fd
+
+    def changes(self, timeout):
+        """
+        Wait up to timeout seconds for changes, returning the set of
+        relative paths reported, which may include RESCAN.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wdesc, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self._note(wdesc, mask, name, changed)
+        return changed
+
+    def _note(self, wdesc, mask, name, changed):
+        """ Add what one event says may have changed to changed. """
+        if mask & IN_Q_OVERFLOW:
+            changed.add(RESCAN)
+            return
+        if mask & IN_IGNORED:
+            self._paths.pop(wdesc, None)
+            self._links.discard(wdesc)
+            return
+        if wdesc in self._links:    # the target of links to a file
+            changed.update(self._paths.get(wdesc, ()))
+            return
+        for rel_dir in list(self._paths.get(wdesc, ())):
+            if not name:            # the directory itself
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changed.add(rel_dir if rel_dir else RESCAN)
+                continue
+            rel_path = rel_dir + '/' + name if rel_dir else name
+            if _excluded(rel_path, self._ex_re, self._skip):
+                continue
+            changed.add(rel_path)
+            if not mask & (IN_CREATE | IN_MOVED_TO):
+                continue
+            path = os.path.join(self._root, rel_path)
+            if mask & IN_ISDIR or os.path.isdir(path):
+                # files may have been written before the watch was added
+                changed.update(self._add_tree(rel_path))
+            elif os.path.islink(path):
+                self._add_link(rel_path)
+
+    def close(self):
+        """ Stop watching. """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(object):
+    """
+    Report changes under a directory by comparing the size, mtime and
+    inode of every file with those seen on the last pass.  Each pass
+    costs a stat() per file, but nothing is read unless it changed.
+    """
+
+    def __init__(self, data_dir, ex_re=None, skip=None, interval=1.0):
+        self._root = data_dir.rstrip('/')
+        self._ex_re = ex_re
+        self._skip = skip
+        self._interval = interval
+        self._seen = self._scan()
+
+    def _scan(self):
+        """ Return a dict mapping relative paths to (size, mtime, inode). """
+        seen = {}
+        todo = ['']
+        while todo:
+            rel_dir = todo.pop()
+            path = os.path.join(self._root, rel_dir) if rel_dir \
+                else self._root
+            try:
+                entries = list(scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                rel_path = rel_dir + '/' + entry.name if rel_dir \
+                    else entry.name
+                if _excluded(rel_path, self._ex_re, self._skip):
+                    continue
+                try:
+                    if entry.is_dir():
+                        seen[rel_path] = None
+                        todo.append(rel_path)
+                    else:
+                        stat_ = entry.stat()
+                        seen[rel_path] = (stat_.st_size, stat_.st_mtime_ns,
+                                          stat_.st_ino)
+                except OSError:
+                    continue
+        return seen
+
+    def fileno(self):
+        """ There is nothing to select() on. """
+        return None
+
+    def changes(self, timeout):
+        """
+        Wait up to timeout seconds, at most the polling interval, then
+        return the set of relative paths which differ from the last pass.
+        """
+        time.sleep(min(timeout, self._interval))
+        seen = self._scan()
+        old = self._seen
+        self._seen = seen
+        changed = set(path for path, value in seen.items()
+                      if old.get(path, 0) != value)
+        changed.update(path for path in old if path not in seen)
+        return changed
+
+    def close(self):
+        """ Nothing to release. """
+        pass
+
+
+def make_watcher(data_dir, ex_re=None, dvcz_dir=None, poll=False,
+                 interval=1.0):
+    """
+    Return an InotifyWatcher for data_dir if inotify is available and
+    poll is not set, and otherwise a PollingWatcher polling every
+    interval seconds.  Neither reports changes in dvcz_dir.
+    """
+    skip = _skip_path(data_dir, dvcz_dir)
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(data_dir, ex_re, skip)
+        except OSError:
+            pass
+    return PollingWatcher(data_dir, ex_re, skip, interval)
+
+
+class TreeState(object):
+    """
+    The content hashes of the files under a data directory, held in
+    nested dicts mapping each name either to a dict, for a directory,
+    or to the file's binary content hash, and the Merkle digests of the
+    directories, computed when asked for and kept until something below
+    them changes.
+    """
+
+    def __init__(self, data_dir, hashtype, ex_re=None, skip=None):
+        self._root = data_dir.rstrip('/')
+        self._name = os.path.basename(os.path.realpath(self._root))
+        self._hashtype = hashtype
+        self._ex_re = ex_re
+        self._skip = skip
+        self._top = {}
+        self._digests = {}          # relative dir path -> Merkle digest
+
+    @classmethod
+    def from_tree(cls, tree, data_dir, ex_re=None, skip=None):
+        """
+        Start from the content of tree, an NLHTree or CompactTree,
+        leaving out anything under skip.
+        """
+        state = cls(data_dir, tree.hashtype, ex_re, skip)
+        state._name = tree.name
+
+        def add(dir_, into, rel_dir):
+            """ Copy the children of dir_ into the dict into. """
+            for node in dir_.nodes:
+                rel_path = rel_dir + '/' + node.name if rel_dir else node.name
+                if _excluded(rel_path, None, skip):
+                    continue
+                if isinstance(node, LEAF_TYPES):
+                    into[node.name] = node.bin_hash
+                else:
+                    into[node.name] = {}
+                    add(node, into[node.name], rel_path)
+        add(tree, state._top, '')
+        return state
+
+    def _scan(self, rel_dir):
+        """
+        Return the nested dict for the directory rel_dir, hashing every
+        file in it, and the relative paths of the files.
+        """
+        entries = {}
+        files = []
+        path = os.path.join(self._root, rel_dir) if rel_dir else self._root
+        for entry in scandir(path):
+            rel_path = rel_dir + '/' + entry.name if rel_dir else entry.name
+            if _excluded(rel_path, self._ex_re, self._skip):
+                continue
+            if entry.is_dir():
+                entries[entry.name], sub_files = self._scan(rel_path)
+                files.extend(sub_files)
+            elif entry.is_file():
+                entries[entry.name] = file_bin_hash(entry.path,
+                                                    self._hashtype)
+                files.append(rel_path)
+        return entries, files
+
+    def update(self, rel_paths):
+        """
+        Bring the state up to date for the relative paths given, any of
+        which may have been created, changed, or removed.  Returns the
+        relative paths of the files whose content is new or changed.
+        """
+        changed = []
+        scanned = set()
+        for rel_path in rel_paths:
+            self._forget(rel_path)
+        # parents before children, so that a directory is scanned once
+        for rel_path in sorted(rel_paths, key=lambda p: (p.count('/'), p)):
+            parts = rel_path.split('/')
+            if any('/'.join(parts[:ndx]) in scanned
+                   for ndx in range(1, len(parts))):
+                continue
+            parent = self._top
+            for name in parts[:-1]:
+                parent = parent.get(name)
+                if not isinstance(parent, dict):
+                    break
+            else:
+                if _excluded(rel_path, self._ex_re, self._skip):
+                    continue
+                path = os.path.join(self._root, rel_path)
+                name = parts[-1]
+                old = parent.get(name)
+                if os.path.isdir(path):
+                    # created, moved in, or replaced: read it afresh
+                    parent[name], files = self._scan(rel_path)
+                    scanned.add(rel_path)
+                    changed.extend(
+                        file_path for file_path in files
+                        if not isinstance(old, dict) or
+                        self._hash_in(old, file_path[len(rel_path) + 1:]) !=
+                        self.hash_of(file_path))
+                elif os.path.isfile(path):
+                    try:
+                        bin_hash = file_bin_hash(path, self._hashtype)
+                    except OSError:
+                        parent.pop(name, None)      # gone while reading
+                        continue
+                    if bin_hash != old:
+                        parent[name] = bin_hash
+                        changed.append(rel_path)
+                else:
+                    parent.pop(name, None)
+                continue
+            # the parent directory is not known, so is new; add it
+            new_dir = '/'.join(parts[:-1])
+            if os.path.isdir(os.path.join(self._root, new_dir)):
+                changed.extend(self.update([new_dir]))
+                scanned.add(new_dir)
+        return changed
+
+    def rescan(self):
+        """ Rehash everything, returning the relative paths of all files. """
+        self._top, files = self._scan('')
+        self._digests = {}
+        return files
+
+    def _forget(self, rel_path):
+        """
+        Drop the digests which a change at rel_path may make stale:
+        those of the directories above it, and of rel_path itself and
+        everything below it if it is or was a directory.
+        """
+        digests = self._digests
+        parts = rel_path.split('/')
+        for ndx in range(len(parts)):
+            digests.pop('/'.join(parts[:ndx]), None)
+        if rel_path in digests:
+            prefix = rel_path + '/'
+            for path in [path for path in digests
+                         if path == rel_path or path.startswith(prefix)]:
+                del digests[path]
+
+    def root_digest(self):
+        """
+        Return the Merkle digest of the whole state, which equals the
+        root_digest of a BuildList holding the same files.  Only the
+        directories changed since the last call are hashed again.
+        """
+        digests = self._digests
+        hashtype = self._hashtype
+
+        def digest_of(entries, rel_dir):
+            """ Return the digest of one directory, computing if need be. """
+            digest = digests.get(rel_dir)
+            if digest is None:
+                sha = new_hash(hashtype)
+                for name in sorted(entries):
+                    value = entries[name]
+                    if isinstance(value, dict):
+                        child = rel_dir + '/' + name if rel_dir else name
+                        sha.update(b'D' + name.encode('utf-8') + b'\0' +
+                                   digest_of(value, child))
+                    else:
+                        sha.update(b'F' + name.encode('utf-8') + b'\0' +
+                                   value)
+                digest = digests[rel_dir] = sha.digest()
+            return digest
+
+        return digest_of(self._top, '')
+
+    @staticmethod
+    def _hash_in(entries, rel_path):
+        """
+        Return the content hash of the file at rel_path in the nested
+        dict entries, or None if it is not there.
+        """
+        node = entries
+        for name in rel_path.split('/'):
+            if not isinstance(node, dict):
+                return None
+            node = node.get(name)
+        return node if isinstance(node, bytes) else None
+
+    def hash_of(self, rel_path):
+        """
+        Return the binary content hash of the file at rel_path, or None
+        if there is no such file.
+        """
+        return self._hash_in(self._top, rel_path)
+
+    def to_tree(self):
+        """ Return a CompactTree of the current state. """
+        tree = CompactTree(self._name, self._hashtype)
+
+        def add(entries, depth):
+            """ Append the entries of one directory in order. """
+            for name in sorted(entries):
+                value = entries[name]
+                if isinstance(value, dict):
+                    tree._append(name, depth)   # pylint: disable=W0212
+                    add(value, depth + 1)
+                else:
+                    tree._append(name, depth, value)  # pylint: disable=W0212
+        add(self._top, 1)
+        return tree
+
+
+def _save_changed(state, data_dir, u_path, rel_paths, hashtype,
+                  chunk_threshold):
+    """ Put the files at rel_paths into U unless already there. """
+    u_dir = UDir.discover(u_path)
+    encoding = get_encoding(u_path)
+    keys = {}
+    for rel_path in rel_paths:
+        bin_hash = state.hash_of(rel_path)
+        if bin_hash is not None:
+            keys.setdefault(bin_hash.hex(), rel_path)
+    written = []
+    for hex_hash in find_missing_files(u_path, list(keys), u_dir.exists,
+                                       verify=False):
+        path_to_file = os.path.join(data_dir, keys[hex_hash])
+        try:
+            (length, count, hash_back) = put_file(
+                u_dir, u_path, path_to_file, hex_hash, hashtype,
+                chunk_threshold, encoding)
+        except OSError:
+            continue
+        if stored_whole(length, chunk_threshold):
+            written.append(hash_back)
+        stats.count('u_write', files=1, bytes_read=length,
+                    bytes_written=count)
+    note_keys_put(u_path, written)
+
+
+def watch_data_dir(blist, data_dir, dvcz_dir, sk_priv, hashtype,
+                   ex_re=None, list_file='lastBuildList', u_path='',
+                   use_delta=False, logging=False, version='0.0.0',
+                   debounce=1.0, watcher=None, stop=None, on_write=None,
+                   chunk_threshold=0):
+    """
+    Watch data_dir, which blist describes, and whenever files change
+    and then no further change is seen for debounce seconds, sign and
+    write a new BuildList with the same title as write_list() does,
+    putting the changed files into U if u_path is set.  on_write, if
+    given, is called with each new BuildList and its content key.
+    Returns the last BuildList when stop(), if given, returns True, or
+    on a KeyboardInterrupt.
+
+    watcher defaults to make_watcher(data_dir, ex_re, dvcz_dir).  Make
+    it before blist so that no change made while listing is missed.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals, cyclic-import
+    from buildlist import BuildList
+
+    skip = _skip_path(data_dir, dvcz_dir)
+    if watcher is None:
+        watcher = make_watcher(data_dir, ex_re, dvcz_dir,
+                               interval=min(debounce, 1.0))
+    state = TreeState.from_tree(blist.tree, data_dir, ex_re, skip)
+    last_digest = state.root_digest()
+    pending = set()
+    last_change = 0.0
+    try:
+        while stop is None or not stop():
+            wait = debounce
+            if pending:
+                wait = max(0.0, last_change + debounce - time.time())
+            changed = watcher.changes(min(wait, 1.0) if stop else wait)
+            if changed:
+                pending.update(changed)
+                last_change = time.time()
+                continue
+            if not pending or time.time() < last_change + debounce:
+                continue
+
+            with stats.phase('update'):
+                if RESCAN in pending:
+                    touched = state.rescan()
+                else:
+                    touched = state.update(pending)
+            pending = set()
+            digest = state.root_digest()
+            if digest == last_digest:
+                continue
+            new_list = BuildList(blist.title, blist.public_key,
+                                 state.to_tree())
+            if u_path and touched:
+                with stats.phase('u_write'):
+                    _save_changed(state, data_dir, u_path, touched, hashtype,
+                                  chunk_threshold)
+            list_hash = new_list.write_list(
+                dvcz_dir, list_file, sk_priv, hashtype, u_path,
+                use_delta=use_delta, logging=logging, version=version)
+            blist = new_list
+            last_digest = digest
+            if on_write is not None:
+                on_write(blist, list_hash)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return blist
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# test_agent.py
+
+""" Test signing BuildLists through a signing agent. """
+
+import os
+import shutil
+import threading
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import (AgentClient, BuildList, BLError, generate_rsa_key,
+                       read_rsa_key)
+from buildlist.agent import SigningAgent, connect_agent, key_fingerprint
+
+
+class TestAgent(unittest.TestCase):
+    """ Test signing BuildLists through a signing agent. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.test_path):
+            self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.test_path)
+        self.key_file = os.path.join(self.test_path, 'skPriv.pem')
+        generate_rsa_key(self.key_file, 1024)
+        self.sock = os.path.join(self.test_path, 'agent.sock')
+        self.agent = SigningAgent(self.key_file, self.sock)
+        self.thread = threading.Thread(target=self.agent.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.agent.shutdown()
+        self.agent.server_close()
+        self.thread.join()
+        shutil.rmtree(self.test_path, ignore_errors=True)
+
+    def test_connect(self):
+        """ A client connects only to an agent holding the key asked for. """
+        self.assertEqual(os.stat(self.sock).st_mode & 0o777, 0o600)
+        with connect_agent(self.key_file, self.sock) as client:
+            self.assertIsInstance(client, AgentClient)
+            self.assertEqual(client.public_key,
+                             read_rsa_key(self.key_file).publickey())
+            self.assertEqual(client.sign_digests([]), [])
+        other = os.path.join(self.test_path, 'other.pem')
+        generate_rsa_key(other, 1024)
+        self.assertIsNone(connect_agent(other, self.sock))
+        self.assertIsNone(connect_agent(
+            self.key_file, os.path.join(self.test_path, 'missing.sock')))
+
+        # a pinned fingerprint is checked in place of the key file
+        fingerprint = key_fingerprint(read_rsa_key(self.key_file))
+        self.assertEqual(self.agent.fingerprint, fingerprint)
+        with connect_agent(other, self.sock, fingerprint) as client:
+            self.assertIsInstance(client, AgentClient)
+        self.assertIsNone(connect_agent(
+            self.key_file, self.sock,
+            key_fingerprint(read_rsa_key(other))))
+
+        # a second agent won't take over the socket of a live one
+        with self.assertRaises(RuntimeError):
+            SigningAgent(other, self.sock)
+        with connect_agent(self.key_file, self.sock) as client:
+            self.assertEqual(key_fingerprint(client.public_key), fingerprint)
+
+    def test_sign(self):
+        """ Lists signed by the agent verify. """
+        sk_priv = read_rsa_key(self.key_file)
+        data_path = os.path.join(self.test_path, 'dataDir')
+        self.rng.next_data_dir(data_path, 2, 3, 256, 1)
+        with AgentClient(self.sock) as client:
+            lists = [BuildList.create_from_file_system(
+                'list %d' % ndx, data_path, sk_priv.publickey())
+                for ndx in range(3)]
+            for blist in lists:
+                blist.sign(client)
+                self.assertTrue(blist.verify())
+                with self.assertRaises(BLError):
+                    blist.sign(client)
+            root_sig = lists[0].sign_root(client)
+            self.assertTrue(lists[0].verify_root(root_sig))
+
+            # a batch of digests is signed in one request
+            unsigned = [BuildList('list %d' % ndx, sk_priv.publickey(),
+                                  blist.tree)
+                        for ndx, blist in enumerate(lists)]
+            shas = [blist._get_build_list_sha1() for blist in unsigned]
+            sigs = client.sign_digests([sha.digest() for sha in shas])
+            self.assertEqual(len(sigs), 3)
+            for blist, sig in zip(unsigned, sigs):
+                blist.dig_sig = sig
+                self.assertTrue(blist.verify())
+
+        # a list signed with someone else's key is refused
+        other_key = os.path.join(self.test_path, 'other.pem')
+        generate_rsa_key(other_key, 1024)
+        other = BuildList.create_from_file_system(
+            'other', data_path, read_rsa_key(other_key).publickey())
+        with AgentClient(self.sock) as client:
+            with self.assertRaises(BLError):
+                other.sign(client)
+
+    def test_list_gen(self):
+        """ list_gen signs through the agent when it holds the key. """
+        data_path = os.path.join(self.test_path, 'dataDir')
+        self.rng.next_data_dir(data_path, 2, 3, 256, 1)
+        for agent_socket in [self.sock, '']:
+            dvcz_dir = os.path.join(self.test_path,
+                                    'dvcz_agent' if agent_socket else 'dvcz')
+            os.makedirs(dvcz_dir)
+            # the key file itself is not needed while the agent holds it
+            if agent_socket:
+                os.rename(self.key_file, self.key_file + '.bak')
+            try:
+                blist = BuildList.list_gen(
+                    'title', data_path, dvcz_dir, key_file=self.key_file,
+                    hashtype=HashTypes.SHA2, use_cache=False,
+                    agent_socket=agent_socket,
+                    agent_fingerprint=self.agent.fingerprint)
+            finally:
+                if agent_socket:
+                    os.rename(self.key_file + '.bak', self.key_file)
+            self.assertTrue(blist.verify())
+            with open(os.path.join(dvcz_dir, 'lastBuildList'), 'rb') as file:
+                data = file.read()
+            self.assertEqual(data, blist.to_string().encode('utf-8'))
+            self.assertTrue(BuildList.parse(data, HashTypes.SHA2).verify())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# test_aio.py
+
+""" Test the asyncio facade against the blocking API. """
+
+import asyncio
+import filecmp
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlu import UDir
+from buildlist import BuildList, generate_rsa_key
+from buildlist.aio import acheck_in_u_dir, alist_gen, apopulate_data_dir
+from buildlist.walker import walk_leaves
+
+
+class TestAio(unittest.TestCase):
+    """ Test the asyncio facade against the blocking API. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.loop = asyncio.new_event_loop()
+        self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.test_path):
+            self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        self.data_path = os.path.join(self.test_path, 'dataDir')
+        self.rng.next_data_dir(self.data_path, 3, 4, 512, 1)
+        self.key_file = os.path.join(self.test_path, 'skPriv.pem')
+        generate_rsa_key(self.key_file, 1024)
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.test_path, ignore_errors=True)
+
+    def run_coro(self, coro):
+        """ Run a coroutine to completion on the test's loop. """
+        return self.loop.run_until_complete(coro)
+
+    def do_list_gen_test(self, hashtype, use_cache):
+        """ alist_gen() writes what list_gen() writes. """
+        results = []
+        for name in ['sync', 'async']:
+            dvcz_dir = os.path.join(self.test_path, 'dvcz_%s' % name)
+            u_path = os.path.join(self.test_path, 'u_%s' % name)
+            os.makedirs(dvcz_dir, exist_ok=True)
+            UDir.discover(u_path, hashtype=hashtype)
+            kwargs = dict(dvcz_dir=dvcz_dir, key_file=self.key_file,
+                          logging=True, u_path=u_path, hashtype=hashtype,
+                          use_cache=use_cache, agent_socket='')
+            if name == 'sync':
+                blist = BuildList.list_gen('title', self.data_path, **kwargs)
+            else:
+                blist = self.run_coro(alist_gen(
+                    'title', self.data_path, workers=3, **kwargs))
+            self.assertTrue(blist.verify())
+            with open(os.path.join(dvcz_dir, 'lastBuildList'), 'rb') as file:
+                self.assertEqual(file.read(),
+                                 blist.to_string().encode('utf-8'))
+            results.append((blist, u_path))
+
+        (sync_list, sync_u), (async_list, async_u) = results
+        self.assertEqual(async_list.tree, sync_list.tree)
+        self.assertEqual(async_list.u_stats, sync_list.u_stats)
+        self.assertEqual(sorted(os.listdir(async_u)),
+                         sorted(os.listdir(sync_u)))
+        self.assertEqual(self.run_coro(acheck_in_u_dir(async_list, async_u)),
+                         [])
+        return async_list, async_u
+
+    def test_list_gen(self):
+        """ The lists and U directories produced are the same. """
+        for hashtype in [HashTypes.SHA1, HashTypes.SHA2]:
+            for use_cache in [False, True]:
+                self.do_list_gen_test(hashtype, use_cache)
+                for name in ['sync', 'async']:
+                    shutil.rmtree(os.path.join(self.test_path,
+                                               'dvcz_%s' % name))
+                    shutil.rmtree(os.path.join(self.test_path,
+                                               'u_%s' % name))
+
+    def test_populate_and_check(self):
+        """ Populating and checking agree with the blocking methods. """
+        blist, u_path = self.do_list_gen_test(HashTypes.SHA2, False)
+        target = os.path.join(self.test_path, 'out', 'dataDir')
+        self.run_coro(apopulate_data_dir(blist, u_path, target, workers=2))
+        compare = filecmp.dircmp(self.data_path, target)
+        self.assertEqual(compare.left_only + compare.right_only +
+                         compare.diff_files, [])
+        with self.assertRaises(RuntimeError):
+            self.run_coro(apopulate_data_dir(
+                blist, u_path, os.path.join(self.test_path, 'wrongName')))
+
+        # remove some objects from U
+        u_dir = UDir.discover(u_path)
+        keys = [bin_hash.hex() for _, bin_hash in walk_leaves(blist.tree)]
+        for key in keys[::2]:
+            if u_dir.exists(key):
+                os.unlink(u_dir.get_path_for_key(key))
+        self.assertEqual(self.run_coro(acheck_in_u_dir(blist, u_path)),
+                         blist.check_in_u_dir(u_path))
+        with self.assertRaises(RuntimeError):
+            self.run_coro(apopulate_data_dir(
+                blist, u_path, os.path.join(self.test_path, 'again',
+                                            'dataDir')))
+
+    def test_cancel(self):
+        """ A cancelled alist_gen() leaves no list behind. """
+        dvcz_dir = os.path.join(self.test_path, 'dvcz')
+        os.makedirs(dvcz_dir)
+
+        async def start_and_cancel():
+            """ Cancel the coroutine as soon as it has started. """
+            task = asyncio.ensure_future(alist_gen(
+                'title', self.data_path, dvcz_dir=dvcz_dir,
+                key_file=self.key_file, hashtype=HashTypes.SHA2,
+                use_cache=False, agent_socket=''))
+            await asyncio.sleep(0)
+            task.cancel()
+            try:
+                await task
+            finally:
+                await asyncio.sleep(0.5)    # let running jobs finish
+
+        with self.assertRaises(asyncio.CancelledError):
+            self.run_coro(start_and_cancel())
+        self.assertFalse(os.path.exists(
+            os.path.join(dvcz_dir, 'lastBuildList')))
+
+
+if __name__ == '__main__':
+    unittest.main()
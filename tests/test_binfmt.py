@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# test_binfmt.py
+
+""" Test the memory-mapped binary form of a BuildList. """
+
+import os
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import BinaryBuildList, BuildList
+from buildlist.walker import walk_leaves
+
+
+class TestBinFmt(unittest.TestCase):
+    """ Test the memory-mapped binary form of a BuildList. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def make_unique(self, below):
+        """ Return the path to a new unique subdirectory of below. """
+        dir_path = os.path.join(below, self.rng.next_file_name(8))
+        while os.path.exists(dir_path):
+            dir_path = os.path.join(below, self.rng.next_file_name(8))
+        os.makedirs(dir_path, mode=0o755)
+        return dir_path
+
+    def do_round_trip(self, blist):
+        """ Write blist in binary form, read it back, and compare. """
+        test_path = self.make_unique('tmp')
+        path_to_bin = os.path.join(test_path, 'list.bin')
+        with open(path_to_bin, 'wb') as file:
+            count = blist.write_binary(file)
+        self.assertEqual(count, os.path.getsize(path_to_bin))
+
+        with BinaryBuildList(path_to_bin) as bbl:
+            self.assertEqual(bbl.title, blist.title)
+            self.assertEqual(bbl.when, blist.when)
+            self.assertEqual(bbl.hashtype, blist.hashtype)
+            for path, bin_hash in walk_leaves(blist.tree):
+                self.assertEqual(bbl.get_hash(path), bin_hash)
+            self.assertIsNone(bbl.get_hash('no/such/file'))
+
+        bl2 = BuildList.from_binary(path_to_bin)
+        self.assertEqual(bl2.to_string(), blist.to_string())
+        self.assertEqual(bl2.signed, blist.signed)
+        if blist.signed:
+            self.assertTrue(bl2.verify())
+
+    def test_example(self):
+        """ The signed SHA1 example survives the round trip. """
+        with open(os.path.join('example1', 'example.bld'), 'r') as file:
+            blist = BuildList.parse(file.read(), HashTypes.SHA1)
+        self.assertTrue(blist.verify())
+        self.do_round_trip(blist)
+
+    def test_random_dirs(self):
+        """ Signed and unsigned lists over random directories. """
+        sk_priv = RSA.generate(1024)
+        sk_ = sk_priv.publickey()
+        for hashtype in HashTypes:
+            data_path = os.path.join(self.make_unique('tmp'), 'dataDir')
+            self.rng.next_data_dir(data_path, 3, 6, 1024, 1)
+            blist = BuildList.create_from_file_system(
+                'a list', data_path, sk_, hashtype=hashtype)
+            self.do_round_trip(blist)
+            blist.sign(sk_priv)
+            self.do_round_trip(blist)
+
+
+if __name__ == '__main__':
+    unittest.main()
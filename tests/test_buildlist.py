@@ -3,6 +3,7 @@
 
 """ Test basic buildlist functionality. """
 
+import io
 import os
 import time
 import unittest
@@ -88,6 +89,40 @@ class TestBuildList(unittest.TestCase):
         self.assertEqual(blist, blist)  # same list, but signed now
         # self.assertEqual(bl, bl2)     # XXX timestamps may not be equal
 
+        # streaming serializer --------------------------------------
+        self.assertEqual(list(blist.iter_lines()), blist.to_strings())
+        out = io.BytesIO()
+        count = blist.write_to(out)
+        self.assertEqual(out.getvalue(), bl_string.encode('utf-8'))
+        self.assertEqual(count, len(out.getvalue()))
+
+        # signing while serializing ---------------------------------
+        bl4 = BuildList.create_from_file_system(
+            'a trial list', path_to_data, sk_, hashtype=hashtype)
+        out = io.BytesIO()
+        bl4.write_to(out, sk_priv)
+        self.assertTrue(bl4.signed)
+        self.assertTrue(bl4.verify())
+        self.assertEqual(out.getvalue(), bl4.to_string().encode('utf-8'))
+        bl5 = BuildList.parse(out.getvalue().decode('utf-8'), hashtype)
+        self.assertTrue(bl5.verify())
+
+        # streaming parser ------------------------------------------
+        bl3 = BuildList.parse_stream(
+            io.BytesIO(bl_string.encode('utf-8')), hashtype)
+        self.assertEqual(bl3.tree.__str__(), tree_string)
+        self.assertEqual(bl3, bl2)
+        self.assertTrue(bl3.verify())
+
+    def test_parse_stream(self):
+        """ Parse the example BuildLists with the streaming parser. """
+        with open(os.path.join('example1', 'example.bld'), 'rb') as file:
+            blist = BuildList.parse_stream(file, HashTypes.SHA1)
+        with open(os.path.join('example1', 'example.bld'), 'r') as file:
+            bl2 = BuildList.parse(file.read(), HashTypes.SHA1)
+        self.assertEqual(blist, bl2)
+        self.assertTrue(blist.verify())
+
     def test_build_list(self):
         """ Test buildlist functionality for suppored hash types. """
         for hashtype in HashTypes:
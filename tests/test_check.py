@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# test_check.py
+
+""" Test incremental checking of a data directory against a BuildList. """
+
+import os
+import shutil
+import time
+import unittest
+
+from Crypto.Hash import SHA
+from Crypto.PublicKey import RSA
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import BLIntegrityCheckFailure, BuildList, StatCache
+
+DATA_DIRS = {
+    HashTypes.SHA1: os.path.join('example1', 'dataDir'),
+    HashTypes.SHA2: os.path.join('example2', 'dataDir'),
+    HashTypes.SHA3: os.path.join('example3', 'dataDir'),
+    HashTypes.BLAKE2B: os.path.join('example4', 'dataDir'),
+}
+
+
+class TestCheck(unittest.TestCase):
+    """ Test incremental checking of a data directory against a BuildList. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def make_unique(self, below):
+        """ Return the path to a new unique subdirectory of below. """
+        dir_path = os.path.join(below, self.rng.next_file_name(8))
+        while os.path.exists(dir_path):
+            dir_path = os.path.join(below, self.rng.next_file_name(8))
+        os.makedirs(dir_path, mode=0o755)
+        return dir_path
+
+    def do_check_test(self, hashtype, sk_):
+        """ Check a copy of an example data directory as it is changed. """
+        test_path = self.make_unique('tmp')
+        data_path = os.path.join(test_path, 'dataDir')
+        shutil.copytree(DATA_DIRS[hashtype], data_path)
+        blist = BuildList.create_from_file_system(
+            'a list', DATA_DIRS[hashtype], sk_, hashtype=hashtype)
+        cache = StatCache(os.path.join(test_path, StatCache.FILE_NAME))
+
+        result = blist.check_data_dir(data_path, cache=cache)
+        self.assertEqual(result, ([], [], []))
+        cache.save()
+
+        os.unlink(os.path.join(data_path, 'data2'))
+        with open(os.path.join(data_path, 'subDir1', 'data11'), 'ab') as file:
+            file.write(b'extra bytes')
+        os.makedirs(os.path.join(data_path, 'subDir2'), exist_ok=True)
+        with open(os.path.join(data_path, 'subDir2', 'data21'), 'wb') as file:
+            file.write(b'a new file')
+
+        result = blist.check_data_dir(data_path, cache=cache, workers=4)
+        self.assertEqual(result.missing, ['data2'])
+        self.assertEqual(result.extra, ['subDir2/data21'])
+        self.assertEqual(result.changed, ['subDir1/data11'])
+
+        # empty directories are compared too
+        os.makedirs(os.path.join(data_path, 'emptyDir'))
+        result = blist.check_data_dir(data_path, cache=cache)
+        self.assertEqual(result.extra, ['subDir2/data21', 'emptyDir/'])
+        blist = BuildList.create_from_file_system(
+            'a list', data_path, sk_, hashtype=hashtype)
+        os.rmdir(os.path.join(data_path, 'emptyDir'))
+        result = blist.check_data_dir(data_path, cache=cache)
+        self.assertEqual(result, (['emptyDir/'], [], []))
+
+    def test_verify_while_parsing(self):
+        """ Check data_dir and U while parsing example1/example.bld. """
+        path_to_list = os.path.join('example1', 'example.bld')
+        data_path = os.path.join('example1', 'dataDir')
+        u_path = os.path.join('example1', 'uDir')
+
+        failures = []
+        sha = SHA.new()
+        with open(path_to_list, 'rb') as file:
+            blist = BuildList.parse_stream(
+                file, HashTypes.SHA1, root_path=data_path, u_path=u_path,
+                failures=failures, digest=sha)
+        self.assertEqual(failures, [])
+        self.assertTrue(blist.verify(sha))
+
+        # a copy of the data directory with one file changed
+        test_path = self.make_unique('tmp')
+        copy_path = os.path.join(test_path, 'dataDir')
+        shutil.copytree(data_path, copy_path)
+        with open(os.path.join(copy_path, 'data1'), 'ab') as file:
+            file.write(b'extra bytes')
+        os.unlink(os.path.join(copy_path, 'data2'))
+        with open(path_to_list, 'rb') as file:
+            BuildList.parse_stream(file, HashTypes.SHA1, root_path=copy_path,
+                                   failures=failures)
+        self.assertEqual(failures, [('data1', 'changed'),
+                                    ('data2', 'missing')])
+
+        # without a list of failures, the first one raises
+        with open(path_to_list, 'rb') as file:
+            self.assertRaises(BLIntegrityCheckFailure,
+                              BuildList.parse_stream, file, HashTypes.SHA1,
+                              root_path=copy_path)
+
+    def test_check(self):
+        """ Run the incremental check for each supported hashtype. """
+        sk_priv = RSA.generate(1024)
+        sk_ = sk_priv.publickey()
+        for hashtype in HashTypes:
+            self.do_check_test(hashtype, sk_)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# test_chunks.py
+
+""" Test storing large files in U as content-defined chunks. """
+
+import filecmp
+import hashlib
+import io
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlu import UDir
+from buildlist import BuildList, UIndex, generate_rsa_key
+from buildlist import chunks as chunks_module
+from buildlist.chunks import (assemble, find_missing_files, iter_chunks,
+                              manifest_keys, put_chunked, read_manifest)
+from buildlist.uindex import scan_keys
+
+# small enough to give many chunks from a modest file
+MIN_SIZE = 256
+AVG_BITS = 10
+MAX_SIZE = 4096
+
+
+class TestChunks(unittest.TestCase):
+    """ Test storing large files in U as content-defined chunks. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.test_path):
+            self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.test_path)
+        self.u_path = os.path.join(self.test_path, 'U')
+        self.u_dir = UDir.discover(self.u_path, hashtype=HashTypes.SHA2)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path, ignore_errors=True)
+
+    def chunks_of(self, data):
+        """ Return the small chunks of data. """
+        return list(iter_chunks(io.BytesIO(data), MIN_SIZE, AVG_BITS,
+                                MAX_SIZE))
+
+    def test_iter_chunks(self):
+        """ Chunks are within bounds and resynchronize after an edit. """
+        self.assertEqual(self.chunks_of(b''), [])
+        self.assertEqual(self.chunks_of(b'x' * 100), [b'x' * 100])
+
+        data = self.rng.some_bytes(64 * 1024)
+        chunks = self.chunks_of(data)
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(len(chunks) > 4)
+        for chunk in chunks[:-1]:
+            self.assertTrue(MIN_SIZE <= len(chunk) <= MAX_SIZE)
+        # runs without cut points are cut at max_size
+        for chunk in self.chunks_of(b'\0' * 10000)[:-1]:
+            self.assertEqual(len(chunk), MAX_SIZE)
+
+        # an insertion near the start changes only the chunks near it
+        edited = data[:100] + b'inserted' + data[100:]
+        new_chunks = self.chunks_of(edited)
+        self.assertEqual(b''.join(new_chunks), edited)
+        shared = set(chunks).intersection(new_chunks)
+        self.assertTrue(len(shared) >= len(chunks) - 2)
+
+    @unittest.skipIf(chunks_module.numpy is None, 'numpy is not installed')
+    def test_numpy_search(self):
+        """ The numpy boundary search finds the cuts the loop does. """
+        # pylint: disable=protected-access
+        data = self.rng.some_bytes(200 * 1024) + b'\0' * 1000
+        for avg_bits in (4, 10, 16):
+            mask = ((1 << avg_bits) - 1) << (64 - avg_bits)
+            for start, end in ((0, len(data)), (7, 300),
+                               (1000, 150 * 1024), (200 * 1024, len(data))):
+                cut = chunks_module._find_cut_numpy(data, start, end, mask)
+                numpy = chunks_module.numpy
+                chunks_module.numpy = None
+                try:
+                    expected = chunks_module._find_cut(data, start, end, mask)
+                finally:
+                    chunks_module.numpy = numpy
+                self.assertEqual(cut, expected)
+
+    def write_file(self, name, data):
+        """ Write data to a file in the test directory. """
+        path = os.path.join(self.test_path, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_put_and_assemble(self):
+        """ A file stored as chunks can be found and reassembled. """
+        data = self.rng.some_bytes(3 * 2**20)
+        key = hashlib.sha256(data).hexdigest()
+        path = self.write_file('big', data)
+        length, written, hash_back = put_chunked(
+            self.u_dir, self.u_path, path, key, HashTypes.SHA2)
+        self.assertEqual((length, hash_back), (len(data), key))
+        self.assertTrue(written > length)
+        self.assertEqual(manifest_keys(self.u_path), {key})
+        hashtype, length, chunks = read_manifest(self.u_path, key)
+        self.assertEqual((hashtype, length), (HashTypes.SHA2, len(data)))
+        self.assertTrue(len(chunks) > 1)
+
+        # storing it again writes only the manifest
+        _, again, _ = put_chunked(
+            self.u_dir, self.u_path, path, key, HashTypes.SHA2)
+        self.assertTrue(again < 1024)
+
+        out = os.path.join(self.test_path, 'out')
+        self.assertEqual(assemble(self.u_dir, self.u_path, key, out),
+                         len(data))
+        self.assertTrue(filecmp.cmp(path, out, shallow=False))
+
+        other = hashlib.sha256(b'other').hexdigest()
+        self.assertEqual(find_missing_files(self.u_path, [key, other, key]),
+                         [other])
+
+        # a missing chunk makes the whole file missing
+        os.unlink(self.u_dir.get_path_for_key(chunks[-1][0]))
+        self.assertEqual(
+            find_missing_files(self.u_path, [key], verify=True), [key])
+        self.assertEqual(find_missing_files(self.u_path, [key]), [])
+
+        # nor does an index over U change that: it holds only the chunks
+        UIndex.build(self.u_path, HashTypes.SHA2)
+        self.assertNotIn(key, scan_keys(self.u_path))
+        self.assertEqual(
+            find_missing_files(self.u_path, [key, other], verify=True),
+            [key, other])
+        self.assertEqual(find_missing_files(self.u_path, [key, other]),
+                         [other])
+        with self.assertRaises(RuntimeError):
+            assemble(self.u_dir, self.u_path, key,
+                     os.path.join(self.test_path, 'again'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.test_path, 'again.tmp')))
+
+    def test_list_gen(self):
+        """ list_gen() stores large files as chunks, usable as ever. """
+        data_path = os.path.join(self.test_path, 'dataDir')
+        self.rng.next_data_dir(data_path, 2, 3, 256, 1)
+        self.write_file(os.path.join('dataDir', 'big'),
+                        self.rng.some_bytes(2 * 2**20))
+        dvcz_dir = os.path.join(self.test_path, 'dvcz')
+        os.makedirs(dvcz_dir)
+        key_file = os.path.join(self.test_path, 'skPriv.pem')
+        generate_rsa_key(key_file, 1024)
+
+        blist = BuildList.list_gen(
+            'title', data_path, dvcz_dir, key_file=key_file,
+            u_path=self.u_path, hashtype=HashTypes.SHA2, use_cache=False,
+            agent_socket='', chunk_threshold=2**20)
+        self.assertEqual(len(manifest_keys(self.u_path)), 1)
+        self.assertEqual(blist.check_in_u_dir(self.u_path), [])
+        failures = []
+        with open(os.path.join(dvcz_dir, 'lastBuildList'), 'rb') as file:
+            BuildList.parse_stream(file, HashTypes.SHA2, u_path=self.u_path,
+                                   failures=failures)
+        self.assertEqual(failures, [])
+
+        target = os.path.join(self.test_path, 'out', 'dataDir')
+        blist.populate_data_dir(self.u_path, target)
+        compare = filecmp.dircmp(data_path, target)
+        self.assertEqual(compare.left_only + compare.right_only +
+                         compare.diff_files, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
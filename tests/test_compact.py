@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# test_compact.py
+
+""" Test the memory-compact representation of a BuildList's tree. """
+
+import os
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+
+from nlhtree import NLHTree
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import BuildList, CompactTree
+from buildlist.walker import iter_tree_lines, walk_leaves
+
+
+class TestCompact(unittest.TestCase):
+    """ Test the memory-compact representation of a BuildList's tree. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def test_example(self):
+        """ A compact parse of the example matches the usual one. """
+        path_to_list = os.path.join('example1', 'example.bld')
+        with open(path_to_list, 'rb') as file:
+            blist = BuildList.parse_stream(file, HashTypes.SHA1)
+        with open(path_to_list, 'rb') as file:
+            compact = BuildList.parse_stream(file, HashTypes.SHA1,
+                                             compact=True)
+        self.assertTrue(isinstance(compact.tree, CompactTree))
+        self.assertEqual(compact, blist)
+        self.assertEqual(blist, compact)
+        self.assertEqual(compact.to_string(), blist.to_string())
+        self.assertTrue(compact.verify())
+        self.assertEqual(compact.tree.__str__(), blist.tree.__str__())
+        self.assertEqual(list(walk_leaves(compact.tree)),
+                         list(walk_leaves(blist.tree)))
+        self.assertEqual(compact.check_in_u_dir(
+            os.path.join('example1', 'uDir')), [])
+
+    def test_random_dirs(self):
+        """ from_tree() is lossless over random directories. """
+        for hashtype in HashTypes:
+            path_to_dir = os.path.join('tmp', self.rng.next_file_name(8))
+            while os.path.exists(path_to_dir):
+                path_to_dir = os.path.join('tmp', self.rng.next_file_name(8))
+            self.rng.next_data_dir(path_to_dir, 3, 6, 1024, 1)
+            tree = NLHTree.create_from_file_system(path_to_dir, hashtype)
+            compact = CompactTree.from_tree(tree)
+            self.assertEqual(compact, tree)
+            self.assertEqual(list(iter_tree_lines(compact)),
+                             list(iter_tree_lines(tree)))
+            self.assertEqual(compact.check_in_data_dir(path_to_dir), [])
+
+            sk_ = RSA.generate(1024).publickey()
+            blist = BuildList('a list', sk_, compact)
+            self.assertEqual(blist, BuildList('a list', sk_, tree))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# test_delta.py
+
+""" Test storing BuildLists in U as deltas against earlier lists. """
+
+import os
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlu import UDir
+from buildlist import BLIntegrityCheckFailure, BuildList
+from buildlist.delta import (MAX_DEPTH, apply_delta, make_delta,
+                             path_to_delta, put_list, read_list,
+                             stored_depth)
+from buildlist.hashing import new_hash
+
+
+class TestDelta(unittest.TestCase):
+    """ Test storing BuildLists in U as deltas against earlier lists. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def make_unique(self, below):
+        """ Return the path to a new unique subdirectory of below. """
+        dir_path = os.path.join(below, self.rng.next_file_name(8))
+        while os.path.exists(dir_path):
+            dir_path = os.path.join(below, self.rng.next_file_name(8))
+        os.makedirs(dir_path, mode=0o755)
+        return dir_path
+
+    def test_round_trip(self):
+        """ apply_delta() undoes make_delta() for assorted edits. """
+        base = b''.join(b'line %d\n' % ndx for ndx in range(100))
+        lines = base.split(b'\n')
+        targets = [
+            base,
+            b'',
+            base + b'one more\n',
+            b'first\n' + base,
+            b'\n'.join(lines[:40] + [b'changed'] + lines[41:]),
+            b'\n'.join(lines[50:] + lines[:50]),
+            b'\n'.join(lines[:10] + [b''] + lines[10:]).rstrip(b'\n'),
+        ]
+        for target in targets:
+            delta = make_delta(base, target, 'f' * 40, 1)
+            self.assertEqual(apply_delta(base, delta), target)
+
+    def test_chain(self):
+        """ Store successive lists in U, bounding the chain depth. """
+        hashtype = HashTypes.SHA2
+        test_path = self.make_unique('tmp')
+        u_path = os.path.join(test_path, 'uDir')
+        UDir.discover(u_path, hashtype=hashtype)
+        path_to_file = os.path.join(test_path, 'list')
+
+        lines = [b'entry %d' % ndx for ndx in range(200)]
+        base = base_key = None
+        keys = {}
+        for version in range(MAX_DEPTH + 3):
+            lines[version] = b'entry %d changed' % version
+            data = b'\n'.join(lines) + b'\n'
+            sha = new_hash(hashtype)
+            sha.update(data)
+            key = sha.hexdigest()
+            with open(path_to_file, 'wb') as file:
+                file.write(data)
+            put_list(u_path, path_to_file, key, base, base_key)
+            depth = stored_depth(u_path, key)
+            self.assertEqual(depth, version % (MAX_DEPTH + 1))
+            keys[key] = data
+            base, base_key = data, key
+
+        for key, data in keys.items():
+            self.assertEqual(read_list(u_path, key, hashtype), data)
+
+        # a damaged delta is detected
+        with open(path_to_delta(u_path, base_key), 'ab') as file:
+            file.write(b'I 1\nextra\n')
+        with self.assertRaises(RuntimeError):
+            read_list(u_path, base_key, hashtype)
+
+    def test_parse_from_u(self):
+        """ A list stored as a delta parses as the original. """
+        hashtype = HashTypes.SHA1
+        test_path = self.make_unique('tmp')
+        u_path = os.path.join(test_path, 'uDir')
+        UDir.discover(u_path, hashtype=hashtype)
+
+        with open(os.path.join('example1', 'example.bld'), 'rb') as file:
+            base = file.read()
+        blist = BuildList.parse(base.decode('utf-8'), hashtype)
+        target = base.replace(blist.title.encode('utf-8'), b'a new title')
+        keys = []
+        for data in [base, target]:
+            sha = new_hash(hashtype)
+            sha.update(data)
+            keys.append(sha.hexdigest())
+        path_to_file = os.path.join(test_path, 'list')
+        with open(path_to_file, 'wb') as file:
+            file.write(base)
+        put_list(u_path, path_to_file, keys[0])
+        with open(path_to_file, 'wb') as file:
+            file.write(target)
+        put_list(u_path, path_to_file, keys[1], base, keys[0])
+
+        bl2 = BuildList.parse_from_u(u_path, keys[1], hashtype)
+        self.assertEqual(bl2.title, 'a new title')
+        self.assertEqual(bl2.tree, blist.tree)
+        with self.assertRaises(BLIntegrityCheckFailure):
+            BuildList.parse_from_u(u_path, 'e' * 40, hashtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# test_diff.py
+
+""" Test the single-pass comparison of two BuildLists. """
+
+import os
+import shutil
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import BuildList, DiffEntry
+from buildlist.hashing import file_bin_hash, scan_dir
+
+
+class TestDiff(unittest.TestCase):
+    """ Test the single-pass comparison of two BuildLists. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def do_diff_test(self, hashtype):
+        """ Change, add, and remove files, then diff the lists. """
+        sk_ = RSA.generate(1024).publickey()
+        test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(test_path):
+            test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        data_path = os.path.join(test_path, 'dataDir')
+        self.rng.next_data_dir(data_path, 3, 6, 1024, 1)
+        old = BuildList.create_from_file_system(
+            'old', data_path, sk_, hashtype=hashtype)
+        self.assertEqual(list(old.diff(old)), [])
+
+        paths = []
+        scan_dir(data_path, paths=paths)
+        self.assertTrue(len(paths) >= 2)
+        rel = [os.path.relpath(path, data_path) for path in paths]
+        old_hash = file_bin_hash(paths[0], hashtype)
+        with open(paths[0], 'ab') as file:
+            file.write(b'changed')
+        removed_hash = file_bin_hash(paths[1], hashtype)
+        os.unlink(paths[1])
+        # a name sorting between a directory and its contents as strings
+        os.makedirs(os.path.join(data_path, 'a'), exist_ok=True)
+        shutil.copyfile(paths[0], os.path.join(data_path, 'a.b'))
+        shutil.copyfile(paths[0], os.path.join(data_path, 'a', 'c'))
+
+        new = BuildList.create_from_file_system(
+            'new', data_path, sk_, hashtype=hashtype)
+        new_hash = file_bin_hash(paths[0], hashtype)
+        expected = sorted([
+            DiffEntry('changed', rel[0], old_hash, new_hash),
+            DiffEntry('removed', rel[1], removed_hash, None),
+            DiffEntry('added', 'a.b', None, new_hash),
+            DiffEntry('added', 'a/c', None, new_hash),
+        ])
+        self.assertEqual(sorted(old.diff(new)), expected)
+
+        # the reverse diff swaps added and removed
+        reverse = {'added': 'removed', 'removed': 'added',
+                   'changed': 'changed'}
+        self.assertEqual(
+            sorted(new.diff(old)),
+            sorted(DiffEntry(reverse[entry.kind], entry.path,
+                             entry.new_hash, entry.old_hash)
+                   for entry in expected))
+
+    def test_diff(self):
+        """ Test diff for each supported hashtype. """
+        for hashtype in HashTypes:
+            self.do_diff_test(hashtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
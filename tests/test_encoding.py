@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# test_encoding.py
+
+""" Test compressed objects in U. """
+
+import filecmp
+import hashlib
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlu import UDir
+from buildlist import BuildList, generate_rsa_key
+from buildlist.chunks import manifest_keys
+from buildlist.encoding import (ENCODINGS, MAGIC, copy_object, get_encoding,
+                                has_encoding, put_bytes, put_encoded,
+                                read_object, set_encoding)
+from buildlist.walker import walk_leaves
+
+TEXT = b''.join(b'line %d of some text which compresses well\n' % ndx
+                for ndx in range(2000))
+
+
+class TestEncoding(unittest.TestCase):
+    """ Test compressed objects in U. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.test_path):
+            self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.test_path)
+        self.u_path = os.path.join(self.test_path, 'U')
+        self.u_dir = UDir.discover(self.u_path, hashtype=HashTypes.SHA2)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path, ignore_errors=True)
+
+    def write_file(self, name, data):
+        """ Write data to a file in the test directory. """
+        path = os.path.join(self.test_path, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_setting(self):
+        """ The encoding is recorded per store. """
+        self.assertFalse(has_encoding(self.u_path))
+        self.assertEqual(get_encoding(self.u_path), 'none')
+        set_encoding(self.u_path, 'none')
+        self.assertFalse(has_encoding(self.u_path))
+        set_encoding(self.u_path, 'lzma')
+        self.assertTrue(has_encoding(self.u_path))
+        self.assertEqual(get_encoding(self.u_path), 'lzma')
+        with self.assertRaises(ValueError):
+            set_encoding(self.u_path, 'rot13')
+
+    def test_round_trip(self):
+        """ Whatever the encoding, what is put in is what is read out. """
+        incompressible = self.rng.some_bytes(4096)
+        for encoding in ENCODINGS:
+            for data in [TEXT, incompressible, MAGIC + TEXT, b'']:
+                key = hashlib.sha256(data).hexdigest()
+                path = self.write_file('in', data)
+                length, written, hash_back = put_encoded(
+                    self.u_dir, self.u_path, path, HashTypes.SHA2, encoding)
+                self.assertEqual((length, hash_back), (len(data), key))
+                self.assertTrue(self.u_dir.exists(key))
+                self.assertEqual(
+                    os.path.getsize(self.u_dir.get_path_for_key(key)),
+                    written)
+                if encoding != 'none' and data == TEXT:
+                    self.assertTrue(written < len(data) // 4)
+                if data == incompressible:
+                    self.assertEqual(written, len(data))
+                if encoding == 'none':
+                    # 'none' comes first, so nothing has marked the store
+                    self.assertEqual(written, len(data))
+                    self.assertFalse(has_encoding(self.u_path))
+                self.assertEqual(read_object(self.u_dir, key), data)
+                out = os.path.join(self.test_path, 'out')
+                copy_object(self.u_dir, key, out)
+                self.assertTrue(filecmp.cmp(path, out, shallow=False))
+                os.unlink(self.u_dir.get_path_for_key(key))
+
+                put_bytes(self.u_dir, self.u_path, key, data, encoding)
+                self.assertEqual(read_object(self.u_dir, key), data)
+                os.unlink(self.u_dir.get_path_for_key(key))
+        # storing compressed objects marks the store, after which a file
+        # which looks encoded is given a header saying that it isn't
+        self.assertTrue(has_encoding(self.u_path))
+        set_encoding(self.u_path, 'none')
+        self.assertTrue(has_encoding(self.u_path))
+        data = MAGIC + TEXT
+        key = hashlib.sha256(data).hexdigest()
+        path = self.write_file('in', data)
+        _, written, _ = put_encoded(self.u_dir, self.u_path, path,
+                                    HashTypes.SHA2, 'none')
+        self.assertEqual(written, len(data) + 17)
+        self.assertEqual(read_object(self.u_dir, key), data)
+        self.assertFalse(os.listdir(os.path.join(self.u_path, 'tmp')))
+
+    def test_corrupt(self):
+        """ A damaged object is reported rather than copied out. """
+        key = hashlib.sha256(TEXT).hexdigest()
+        put_bytes(self.u_dir, self.u_path, key, TEXT, 'zlib')
+        path = self.u_dir.get_path_for_key(key)
+        with open(path, 'rb') as file:
+            data = file.read()
+        with open(path, 'wb') as file:
+            file.write(data[:len(data) // 2])
+        with self.assertRaises(RuntimeError):
+            read_object(self.u_dir, key)
+        out = os.path.join(self.test_path, 'out')
+        with self.assertRaises(RuntimeError):
+            copy_object(self.u_dir, key, out)
+        self.assertFalse(os.path.exists(out))
+
+    def test_list_gen(self):
+        """ A store may hold objects in either encoding. """
+        data_path = os.path.join(self.test_path, 'dataDir')
+        self.rng.next_data_dir(data_path, 2, 3, 256, 1)
+        self.write_file(os.path.join('dataDir', 'text'), TEXT)
+        self.write_file(os.path.join('dataDir', 'big'), TEXT * 20)
+        dvcz_dir = os.path.join(self.test_path, 'dvcz')
+        os.makedirs(dvcz_dir)
+        key_file = os.path.join(self.test_path, 'skPriv.pem')
+        generate_rsa_key(key_file, 1024)
+
+        def list_gen():
+            """ Build the list, saving to U. """
+            return BuildList.list_gen(
+                'title', data_path, dvcz_dir, key_file=key_file,
+                u_path=self.u_path, hashtype=HashTypes.SHA2,
+                use_cache=False, agent_socket='', chunk_threshold=2**20)
+
+        list_gen()
+        set_encoding(self.u_path, 'lzma')
+        self.write_file(os.path.join('dataDir', 'more'), TEXT + b'more\n')
+        blist = list_gen()
+        self.assertEqual(len(manifest_keys(self.u_path)), 1)
+        key = hashlib.sha256(TEXT + b'more\n').hexdigest()
+        self.assertTrue(os.path.getsize(self.u_dir.get_path_for_key(key)) <
+                        len(TEXT) // 4)
+        self.assertEqual(blist.check_in_u_dir(self.u_path), [])
+
+        # the list itself can be read back from U
+        with open(os.path.join(dvcz_dir, 'lastBuildList'), 'rb') as file:
+            list_key = hashlib.sha256(file.read()).hexdigest()
+        parsed = BuildList.parse_from_u(self.u_path, list_key,
+                                        HashTypes.SHA2)
+        self.assertEqual(
+            [bin_hash for _, bin_hash in walk_leaves(parsed.tree)],
+            [bin_hash for _, bin_hash in walk_leaves(blist.tree)])
+
+        for workers in [1, 3]:
+            target = os.path.join(self.test_path, 'out%d' % workers,
+                                  'dataDir')
+            blist.populate_data_dir(self.u_path, target, workers)
+            compare = filecmp.dircmp(data_path, target)
+            self.assertEqual(compare.left_only + compare.right_only +
+                             compare.diff_files, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# test_history.py
+
+""" Test the indexed history of the builds log. """
+
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import BuildHistory, BuildList, BuildRecord, generate_rsa_key
+
+LOG = [
+    "2018-01-01 10:00:00 v0.1.0 aa01\n",
+    "2018-01-02 10:00:00 v0.1.0 bb02\n",
+    "not a build\n",
+    "2018-02-01 00:00:00 v0.2.0 cc03\n",
+]
+
+
+class TestHistory(unittest.TestCase):
+    """ Test the indexed history of the builds log. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.dvcz_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.dvcz_dir):
+            self.dvcz_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        os.makedirs(self.dvcz_dir)
+        self.path_to_log = os.path.join(self.dvcz_dir, 'builds')
+
+    def tearDown(self):
+        shutil.rmtree(self.dvcz_dir, ignore_errors=True)
+
+    def append(self, text):
+        """ Append text to the builds log. """
+        with open(self.path_to_log, 'a') as file:
+            file.write(text)
+
+    def test_queries(self):
+        """ Queries return the builds logged. """
+        self.append(''.join(LOG))
+        with BuildHistory.open(self.dvcz_dir) as history:
+            self.assertEqual(len(history), 3)
+            self.assertEqual(history.bad_lines(), [(2, 'not a build')])
+            self.assertEqual(
+                history.latest(),
+                BuildRecord(3, '2018-02-01 00:00:00', '0.2.0', 'cc03'))
+            self.assertEqual(history.latest('0.1.0').list_hash, 'bb02')
+            self.assertIsNone(history.latest('9.9.9'))
+            self.assertEqual([rec.seq for rec in history.for_version('0.1.0')],
+                             [0, 1])
+            self.assertEqual(
+                [rec.list_hash for rec in
+                 history.between('2018-01-02', '2018-02-01 00:00:00')],
+                ['bb02'])
+            self.assertEqual(len(history.between(since='2018-01-02')), 2)
+            self.assertEqual(history.for_hash('aa01')[0].seq, 0)
+            self.assertEqual(
+                history.versions(),
+                [('0.1.0', 2, '2018-01-01 10:00:00', '2018-01-02 10:00:00'),
+                 ('0.2.0', 1, '2018-02-01 00:00:00', '2018-02-01 00:00:00')])
+
+    def test_sync(self):
+        """ The history follows the log as it is appended to and replaced. """
+        self.append(''.join(LOG[:2]) + LOG[3][:10])
+        with BuildHistory.open(self.dvcz_dir) as history:
+            # the torn last line is left until it is complete
+            self.assertEqual(len(history), 2)
+            self.append(LOG[3][10:])
+            self.assertEqual(history.sync(), 1)
+            self.assertEqual(history.sync(), 0)
+            self.assertEqual(history.latest().seq, 2)
+
+        # rewritten in place, as by an editor
+        with open(self.path_to_log, 'w') as file:
+            file.write(LOG[0].replace('v0.1.0', 'v0.1.1'))
+        with BuildHistory.open(self.dvcz_dir) as history:
+            self.assertEqual([rec.version for rec in history.records()],
+                             ['0.1.1'])
+
+        # replaced, as by fix_builds
+        os.rename(self.path_to_log, self.path_to_log + '.bak')
+        self.append(''.join(LOG))
+        with BuildHistory.open(self.dvcz_dir) as history:
+            self.assertEqual(len(history), 3)
+            self.assertEqual(history.rebuild(), 4)
+            self.assertEqual(len(history), 3)
+
+        os.unlink(self.path_to_log)
+        with BuildHistory.open(self.dvcz_dir) as history:
+            self.assertEqual(len(history), 0)
+
+    def test_load(self):
+        """ A history loaded into memory writes nothing and reads it all. """
+        self.append(''.join(LOG[:2]) + LOG[3][:-1])
+        with open(self.path_to_log, 'rb') as file:
+            before = file.read()
+        with BuildHistory.load(self.dvcz_dir) as history:
+            self.assertEqual(history.path, ':memory:')
+            self.assertEqual(len(history), 3)
+            self.assertEqual(history.latest().list_hash, 'cc03')
+        self.assertEqual(os.listdir(self.dvcz_dir), ['builds'])
+        with open(self.path_to_log, 'rb') as file:
+            self.assertEqual(file.read(), before)
+
+    def test_list_gen(self):
+        """ Builds logged by list_gen() are in the history. """
+        data_path = os.path.join(self.dvcz_dir, 'dataDir')
+        self.rng.next_data_dir(data_path, 2, 3, 256, 1)
+        key_file = os.path.join(self.dvcz_dir, 'skPriv.pem')
+        generate_rsa_key(key_file, 1024)
+        keys = []
+        for _ in range(2):
+            with open(os.path.join(data_path, 'extra'), 'ab') as file:
+                file.write(self.rng.some_bytes(16))
+            BuildList.list_gen('title', data_path, self.dvcz_dir,
+                               key_file=key_file, logging=True,
+                               hashtype=HashTypes.SHA2, use_cache=False)
+            with open(self.path_to_log, 'r') as file:
+                keys.append(file.readlines()[-1].split()[-1])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.dvcz_dir, BuildHistory.FILE_NAME)))
+        with BuildHistory.open(self.dvcz_dir) as history:
+            self.assertEqual([rec.list_hash for rec in history.records()],
+                             keys)
+            self.assertEqual(history.latest().list_hash, keys[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
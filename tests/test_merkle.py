@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# test_merkle.py
+
+""" Test Merkle digests over a BuildList's directories. """
+
+import os
+import shutil
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+
+from nlhtree import NLHLeaf
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import BuildList, CompactTree
+from buildlist.diff import diff_trees
+from buildlist.hashing import scan_dir
+from buildlist.walker import walk_leaves
+
+
+class TestMerkle(unittest.TestCase):
+    """ Test Merkle digests over a BuildList's directories. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def do_merkle_test(self, hashtype):
+        """ Compare digests and diffs before and after edits. """
+        sk_priv = RSA.generate(1024)
+        sk_ = sk_priv.publickey()
+        test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(test_path):
+            test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        data_path = os.path.join(test_path, 'dataDir')
+        self.rng.next_data_dir(data_path, 3, 6, 1024, 1)
+
+        old = BuildList.create_from_file_system(
+            'a list', data_path, sk_, hashtype=hashtype)
+        same = BuildList.create_from_file_system(
+            'a list', data_path, sk_, hashtype=hashtype)
+        self.assertEqual(old.root_digest, same.root_digest)
+        self.assertEqual(old, same)
+        # the digests are kept, not recomputed, while the tree is unseen
+        self.assertIs(old.merkle_digests, old.merkle_digests)
+
+        # the root digest does not cover the root's name, but equality does
+        renamed_path = os.path.join(test_path, 'renamed')
+        shutil.copytree(data_path, renamed_path)
+        renamed = BuildList.create_from_file_system(
+            'a list', renamed_path, sk_, hashtype=hashtype)
+        self.assertEqual(renamed.root_digest, old.root_digest)
+        self.assertNotEqual(renamed, old)
+        shutil.rmtree(renamed_path)
+        compact = BuildList('a list', sk_, CompactTree.from_tree(old.tree))
+        self.assertEqual(compact.merkle_digests, old.merkle_digests)
+
+        paths = []
+        scan_dir(data_path, paths=paths)
+        with open(paths[-1], 'ab') as file:
+            file.write(b'changed')
+        os.makedirs(os.path.join(data_path, 'zz'), exist_ok=True)
+        shutil.copyfile(paths[0], os.path.join(data_path, 'zz', 'copy'))
+        new = BuildList.create_from_file_system(
+            'a list', data_path, sk_, hashtype=hashtype)
+        self.assertNotEqual(old.root_digest, new.root_digest)
+        self.assertNotEqual(old, new)
+
+        # digests follow changes made to the tree in place
+        before = same.root_digest
+        _, bin_hash = next(walk_leaves(same.tree))
+        same.tree.insert(NLHLeaf('zzz', bin_hash, hashtype))
+        self.assertNotEqual(same.root_digest, before)
+
+        expected = list(diff_trees(old.tree, new.tree))
+        self.assertEqual(len(expected), 2)
+        self.assertEqual(list(old.diff(new)), expected)
+        self.assertEqual(list(new.diff(old)),
+                         list(diff_trees(new.tree, old.tree)))
+
+        # the root signature covers the root digest
+        new.sign(sk_priv)
+        root_sig = new.sign_root(sk_priv)
+        self.assertTrue(new.verify_root(root_sig))
+        self.assertFalse(old.verify_root(root_sig))
+        self.assertFalse(new.verify_root('not base64!'))
+
+    def test_merkle(self):
+        """ Test Merkle digests for each supported hashtype. """
+        for hashtype in HashTypes:
+            self.do_merkle_test(hashtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# test_parallel_hash.py
+
+""" Verify that hashing with a pool of workers yields the serial tree. """
+
+import os
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+
+from nlhtree import NLHTree
+from rnglib import SimpleRNG
+from xlattice import HashTypes, check_hashtype
+from xlutil import make_ex_re
+from buildlist import BuildList
+from buildlist.hashing import tree_from_file_system
+
+DATA_DIRS = {
+    HashTypes.SHA1: os.path.join('example1', 'dataDir'),
+    HashTypes.SHA2: os.path.join('example2', 'dataDir'),
+    HashTypes.SHA3: os.path.join('example3', 'dataDir'),
+    HashTypes.BLAKE2B: os.path.join('example4', 'dataDir'),
+}
+
+
+class TestParallelHash(unittest.TestCase):
+    """ Verify that hashing with a pool of workers yields the serial tree. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def do_random_dir_test(self, hashtype):
+        """ Compare serial and parallel trees over a random directory. """
+        check_hashtype(hashtype)
+        path_to_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(path_to_dir):
+            path_to_dir = os.path.join('tmp', self.rng.next_file_name(8))
+        self.rng.next_data_dir(path_to_dir, 3, 8, 4 * BuildList.BLOCK_SIZE, 0)
+
+        ex_re = make_ex_re(['build', ])
+        serial = NLHTree.create_from_file_system(path_to_dir, hashtype,
+                                                 ex_re=ex_re)
+        for workers in [2, 8]:
+            tree = tree_from_file_system(path_to_dir, hashtype, ex_re,
+                                         workers=workers)
+            self.assertEqual(tree, serial)
+            self.assertEqual(tree.__str__(), serial.__str__())
+
+    def test_example_dirs(self):
+        """ Compare serial and parallel trees over example{1,2,3,4}. """
+        for hashtype in HashTypes:
+            path_to_dir = DATA_DIRS[hashtype]
+            serial = NLHTree.create_from_file_system(path_to_dir, hashtype)
+            tree = tree_from_file_system(path_to_dir, hashtype, workers=4)
+            self.assertEqual(tree, serial)
+            self.assertEqual(tree.__str__(), serial.__str__())
+
+    def test_random_dirs(self):
+        """ Compare serial and parallel trees over random directories. """
+        for hashtype in HashTypes:
+            self.do_random_dir_test(hashtype)
+
+    def test_build_list(self):
+        """ The workers option passes through BuildList unchanged. """
+        sk_priv = RSA.generate(1024)
+        sk_ = sk_priv.publickey()
+        for hashtype in HashTypes:
+            path_to_dir = DATA_DIRS[hashtype]
+            serial = BuildList.create_from_file_system(
+                'a list', path_to_dir, sk_, hashtype=hashtype)
+            blist = BuildList.create_from_file_system(
+                'a list', path_to_dir, sk_, hashtype=hashtype, workers=4)
+            self.assertEqual(blist, serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
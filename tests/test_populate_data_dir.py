@@ -14,11 +14,13 @@ from argparse import ArgumentParser
 
 from Crypto.PublicKey import RSA
 
+from nlhtree import NLHTree
 from rnglib import SimpleRNG
 from xlattice import HashTypes, check_hashtype
 from xlu import UDir
 from xlutil import timestamp
-from buildlist import BuildList
+from buildlist import BuildList, USaveStats
+from buildlist.walker import walk_leaves
 
 
 class TestPopulateDataDir(unittest.TestCase):
@@ -143,6 +145,16 @@ class TestPopulateDataDir(unittest.TestCase):
         blist.populate_data_dir(original_u, data_path)
         self.assertEqual(len(bl2.check_in_data_dir(data_path)), 0)
 
+        # a pool of workers must produce the same directory
+        par_path = os.path.join(test_path, 'par')
+        os.mkdir(par_path)
+        blist.populate_data_dir(original_u,
+                                os.path.join(par_path, blist.tree.name),
+                                workers=4)
+        par_tree = NLHTree.create_from_file_system(
+            os.path.join(par_path, blist.tree.name), hashtype)
+        self.assertEqual(par_tree, blist.tree)
+
         bl2.tree.save_to_u_dir(data_path, u_path, hashtype)
         self.assertEqual(len(bl2.check_in_u_dir(u_path)), 0)
 
@@ -151,6 +163,20 @@ class TestPopulateDataDir(unittest.TestCase):
         # this writes the buildlist to dvczPath/lastBuildList:
         blist3 = BuildList.list_gen("title", data_path, dvcz_path,
                                     u_path=u_path, hashtype=hashtype)
+
+        # everything was already in U, so nothing was copied
+        leaf_count = len(list(walk_leaves(blist.tree)))
+        self.assertEqual(blist3.u_stats, USaveStats(0, leaf_count, 0))
+
+        # a fresh U gets one copy of each distinct content key
+        u2_path = os.path.join(test_path, 'uDir2')
+        UDir.discover(u2_path, hashtype=hashtype)
+        stats = blist.save_to_u_dir(data_path, u2_path)
+        keys = set(bin_hash for _, bin_hash in walk_leaves(blist.tree))
+        self.assertEqual(stats.written, len(keys))
+        self.assertEqual(stats.skipped, leaf_count - len(keys))
+        self.assertTrue(stats.bytes_written > 0)
+        self.assertEqual(len(blist.check_in_u_dir(u2_path)), 0)
         path_to_list = os.path.join(dvcz_path, 'lastBuildList')
         with open(path_to_list, 'r') as file:
             ser4 = file.read()
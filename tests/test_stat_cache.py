@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# test_stat_cache.py
+
+""" Test the persistent stat cache used by list_gen. """
+
+import os
+import time
+import unittest
+
+from nlhtree import NLHTree
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import StatCache
+from buildlist.hashing import scan_dir, tree_from_file_system
+
+
+class TestStatCache(unittest.TestCase):
+    """ Test the persistent stat cache used by list_gen. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def make_unique(self, below):
+        """ Return the path to a new unique subdirectory of below. """
+        dir_path = os.path.join(below, self.rng.next_file_name(8))
+        while os.path.exists(dir_path):
+            dir_path = os.path.join(below, self.rng.next_file_name(8))
+        os.makedirs(dir_path, mode=0o755)
+        return dir_path
+
+    def do_cache_test(self, hashtype):
+        """ Exercise the cache for a specific hashtype. """
+        test_path = self.make_unique('tmp')
+        data_path = os.path.join(test_path, 'dataDir')
+        self.rng.next_data_dir(data_path, 2, 6, 4096, 1)
+        paths = []
+        scan_dir(data_path, paths=paths)
+        file_count = len(paths)
+        self.assertTrue(file_count > 0)
+
+        # first pass: everything is hashed
+        cache = StatCache(os.path.join(test_path, StatCache.FILE_NAME))
+        tree = tree_from_file_system(data_path, hashtype, cache=cache)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, file_count)
+        cache.save()
+        self.assertEqual(
+            tree, NLHTree.create_from_file_system(data_path, hashtype))
+
+        # second pass, reloading from disk: nothing is hashed
+        cache = StatCache(os.path.join(test_path, StatCache.FILE_NAME))
+        self.assertEqual(len(cache), file_count)
+        tree2 = tree_from_file_system(data_path, hashtype, cache=cache)
+        self.assertEqual(cache.hits, file_count)
+        self.assertEqual(cache.misses, 0)
+        self.assertEqual(tree2, tree)
+        cache.save()
+
+        # change one file: only that one is hashed
+        with open(paths[0], 'ab') as file:
+            file.write(b'more data')
+        cache = StatCache(os.path.join(test_path, StatCache.FILE_NAME))
+        tree3 = tree_from_file_system(data_path, hashtype, cache=cache,
+                                      workers=4)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, file_count - 1)
+        self.assertEqual(
+            tree3, NLHTree.create_from_file_system(data_path, hashtype))
+        self.assertNotEqual(tree3, tree)
+
+        # rehash ignores what is on disk
+        cache = StatCache(os.path.join(test_path, StatCache.FILE_NAME),
+                          rehash=True)
+        self.assertEqual(len(cache), 0)
+
+    def test_stat_cache(self):
+        """ Exercise the cache for each supported hashtype. """
+        for hashtype in HashTypes:
+            self.do_cache_test(hashtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
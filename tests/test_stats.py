@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# test_stats.py
+
+""" Test per-phase timing and I/O statistics. """
+
+import json
+import os
+import shutil
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlu import UDir
+from buildlist import BuildList, StatsCollector
+from buildlist.stats import STATS_FILE, active, collecting, count, phase
+from buildlist.walker import walk_leaves
+
+
+class TestStats(unittest.TestCase):
+    """ Test per-phase timing and I/O statistics. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def make_test_path(self):
+        """ Return a path under tmp/ which does not yet exist. """
+        test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(test_path):
+            test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        return test_path
+
+    def test_inactive(self):
+        """ Nothing is recorded unless a collector is active. """
+        self.assertIsNone(active())
+        with phase('idle'):
+            count('idle', files=1)
+        with collecting() as collector:
+            self.assertIs(active(), collector)
+            with phase('busy'):
+                count('busy', files=2, bytes_read=10)
+            with phase('busy'):
+                pass
+        self.assertIsNone(active())
+        self.assertEqual(list(collector.phases), ['busy'])
+        busy = collector.phases['busy']
+        self.assertEqual(busy.calls, 2)
+        self.assertEqual(busy.files, 2)
+        self.assertEqual(busy.bytes_read, 10)
+        self.assertTrue(busy.process_peak_rss_kb > 0)
+        self.assertTrue(busy.peak_rss_growth_kb >= 0)
+
+    def do_test_phases(self, hashtype):
+        """ Each operation reports into the phases it belongs to. """
+        sk_priv = RSA.generate(1024)
+        test_path = self.make_test_path()
+        data_path = os.path.join(test_path, 'dataDir')
+        u_path = os.path.join(test_path, 'uDir')
+        self.rng.next_data_dir(data_path, 3, 4, 1024, 1)
+        UDir.discover(u_path, hashtype=hashtype)
+        try:
+            with collecting(StatsCollector()) as collector:
+                blist = BuildList.create_from_file_system(
+                    'a title', data_path, sk_priv.publickey(),
+                    hashtype=hashtype)
+                blist.sign(sk_priv)
+                self.assertTrue(blist.verify())
+                blist.save_to_u_dir(data_path, u_path)
+                self.assertEqual(blist.check_in_u_dir(u_path), [])
+                blist.populate_data_dir(
+                    u_path, os.path.join(test_path, 'out', 'dataDir'))
+            leaves = list(walk_leaves(blist.tree))
+            phases = collector.phases
+            for name in ['walk', 'hash', 'sign', 'verify', 'u_write',
+                         'check_in_u_dir', 'populate']:
+                self.assertEqual(phases[name].calls, 1)
+            self.assertEqual(phases['hash'].files, len(leaves))
+            total = sum(os.path.getsize(os.path.join(data_path, path))
+                        for path, _ in leaves)
+            self.assertEqual(phases['hash'].bytes_read, total)
+            self.assertEqual(phases['populate'].bytes_written, total)
+            self.assertEqual(phases['check_in_u_dir'].files, len(leaves))
+
+            collector.append_to(test_path, tool='test')
+            collector.append_to(test_path, tool='test')
+            with open(os.path.join(test_path, STATS_FILE), 'r') as file:
+                records = [json.loads(line) for line in file]
+            self.assertEqual(len(records), 2)
+            self.assertEqual(records[0]['tool'], 'test')
+            self.assertEqual(records[0]['phases']['hash']['files'],
+                             len(leaves))
+        finally:
+            shutil.rmtree(test_path, ignore_errors=True)
+
+    def test_phases(self):
+        """ Collect statistics using various hash types. """
+        for hashtype in HashTypes:
+            self.do_test_phases(hashtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
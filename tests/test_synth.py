@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# test_synth.py
+
+""" Test the synthetic data directories and benchmark report. """
+
+import os
+import shutil
+import time
+import unittest
+import zlib
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist.bench import run_benchmarks
+from buildlist.synth import make_data_dir
+
+
+def snapshot(path_to_dir):
+    """ Return a sorted list of (relative path, contents) under a dir. """
+    found = []
+    for dir_path, _, files in os.walk(path_to_dir):
+        for name in files:
+            path = os.path.join(dir_path, name)
+            with open(path, 'rb') as file:
+                found.append((os.path.relpath(path, path_to_dir),
+                              file.read()))
+    return sorted(found)
+
+
+class TestSynth(unittest.TestCase):
+    """ Test the synthetic data directories and benchmark report. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def make_test_path(self):
+        """ Return a path under tmp/ which does not yet exist. """
+        test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(test_path):
+            test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        return test_path
+
+    def test_deterministic(self):
+        """ The same parameters give the same tree, others do not. """
+        test_path = self.make_test_path()
+        try:
+            total = make_data_dir(os.path.join(test_path, 'a'), 300, 7, 3)
+            make_data_dir(os.path.join(test_path, 'b'), 300, 7, 3)
+            make_data_dir(os.path.join(test_path, 'c'), 300, 8, 3)
+            snap_a = snapshot(os.path.join(test_path, 'a'))
+            self.assertEqual(len(snap_a), 300)
+            self.assertEqual(sum(len(data) for _, data in snap_a), total)
+            self.assertEqual(snap_a, snapshot(os.path.join(test_path, 'b')))
+            self.assertNotEqual(snap_a,
+                                snapshot(os.path.join(test_path, 'c')))
+            depth = max(path.count(os.sep) for path, _ in snap_a)
+            self.assertTrue(depth <= 2)
+        finally:
+            shutil.rmtree(test_path, ignore_errors=True)
+
+    def test_text(self):
+        """ Text content is deterministic and compresses. """
+        test_path = self.make_test_path()
+        try:
+            total = make_data_dir(os.path.join(test_path, 'a'), 50, 7, 2,
+                                  content='text')
+            make_data_dir(os.path.join(test_path, 'b'), 50, 7, 2,
+                          content='text')
+            snap_a = snapshot(os.path.join(test_path, 'a'))
+            self.assertEqual(sum(len(data) for _, data in snap_a), total)
+            self.assertEqual(snap_a, snapshot(os.path.join(test_path, 'b')))
+            text = b''.join(data for _, data in snap_a)
+            self.assertTrue(len(zlib.compress(text)) < len(text) // 2)
+        finally:
+            shutil.rmtree(test_path, ignore_errors=True)
+
+    def test_bad_params(self):
+        """ Unknown distributions and impossible depths are rejected. """
+        test_path = self.make_test_path()
+        with self.assertRaises(ValueError):
+            make_data_dir(test_path, 10, sizes='huge')
+        with self.assertRaises(ValueError):
+            make_data_dir(test_path, 10, depth=0)
+        with self.assertRaises(ValueError):
+            make_data_dir(test_path, 10, content='video')
+        self.assertFalse(os.path.exists(test_path))
+
+    def test_report(self):
+        """ A small run times every operation. """
+        test_path = self.make_test_path()
+        try:
+            report = run_benchmarks(test_path, 100, sizes='tiny',
+                                    hashtype=HashTypes.SHA2, key_bits=1024)
+        finally:
+            shutil.rmtree(test_path, ignore_errors=True)
+        self.assertEqual(report['params']['files'], 100)
+        self.assertEqual(
+            sorted(report['results']),
+            ['bl_check', 'check_in_u_dir', 'list_gen', 'parse',
+             'populate_data_dir', 'sign', 'to_string', 'verify'])
+        for result in report['results'].values():
+            self.assertTrue(result['seconds'] > 0)
+            self.assertTrue(result['peak_rss_kb'] > 0)
+        self.assertEqual(report['u_store']['encoding'], 'none')
+
+    def test_report_encoded(self):
+        """ Compressing U is reported as space saved. """
+        test_path = self.make_test_path()
+        try:
+            report = run_benchmarks(test_path, 50, sizes='source',
+                                    hashtype=HashTypes.SHA2, key_bits=1024,
+                                    encoding='zlib', content='text')
+        finally:
+            shutil.rmtree(test_path, ignore_errors=True)
+        u_store = report['u_store']
+        self.assertEqual(u_store['encoding'], 'zlib')
+        self.assertTrue(u_store['stored_bytes'] < u_store['data_bytes'])
+        self.assertTrue(u_store['ratio'] > 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
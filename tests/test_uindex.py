@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# test_uindex.py
+
+""" Test the memory-mapped index of the keys in U. """
+
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from buildlist import UIndex
+from buildlist.uindex import find_missing_keys, note_keys_put, scan_keys
+
+U_DIRS = {
+    HashTypes.SHA1: os.path.join('example1', 'uDir'),
+    HashTypes.SHA2: os.path.join('example2', 'uDir'),
+}
+
+
+class TestUIndex(unittest.TestCase):
+    """ Test the memory-mapped index of the keys in U. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def make_u_copy(self, hashtype):
+        """ Copy an example U directory to a unique path under tmp/. """
+        u_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(u_path):
+            u_path = os.path.join('tmp', self.rng.next_file_name(8))
+        shutil.copytree(U_DIRS[hashtype], u_path)
+        return u_path
+
+    def do_index_test(self, hashtype):
+        """ Build, search, and extend the index for one hashtype. """
+        u_path = self.make_u_copy(hashtype)
+        keys = sorted(name for name in os.listdir(u_path))
+        width = 40 if hashtype == HashTypes.SHA1 else 64
+        absent = ['%02x' % ndx * (width // 2) for ndx in range(3)]
+        absent = [key for key in absent if key not in keys]
+
+        # a scan finds every key, of either width or that given
+        self.assertEqual(scan_keys(u_path), set(keys))
+        self.assertEqual(scan_keys(u_path, width // 2), set(keys))
+        self.assertEqual(scan_keys(u_path, 52 - width // 2), set())
+
+        # no index: everything is looked for on disk
+        self.assertIsNone(UIndex.open(u_path))
+        seen = []
+
+        def exists(key):
+            """ Record the keys falling through to the disk. """
+            seen.append(key)
+            return os.path.exists(os.path.join(u_path, key))
+        self.assertEqual(
+            find_missing_keys(u_path, keys + absent + keys, exists), absent)
+        self.assertEqual(len(seen), len(keys) + len(absent))
+
+        # with an index only the absent keys reach the disk
+        self.assertEqual(UIndex.build(u_path, hashtype), len(keys))
+        with UIndex.open(u_path) as index:
+            self.assertEqual(len(index), len(keys))
+        seen = []
+        self.assertEqual(
+            find_missing_keys(u_path, absent + keys, exists), absent)
+        self.assertEqual(sorted(seen), sorted(absent))
+
+        # a key added without updating the index is still found ...
+        new_key = absent[0]
+        with open(os.path.join(u_path, new_key), 'wb') as file:
+            file.write(b'not really')
+        self.assertEqual(find_missing_keys(u_path, [new_key], exists), [])
+
+        # ... and once noted, no longer reaches the disk
+        note_keys_put(u_path, [new_key])
+        seen = []
+        self.assertEqual(find_missing_keys(u_path, [new_key], exists), [])
+        self.assertEqual(seen, [])
+
+        # a damaged index is ignored
+        with open(os.path.join(u_path, UIndex.FILE_NAME), 'ab') as file:
+            file.write(b'x')
+        self.assertIsNone(UIndex.open(u_path))
+        self.assertEqual(find_missing_keys(u_path, keys, exists), [])
+
+    def test_uindex(self):
+        """ Test the index for SHA1 and SHA2 stores. """
+        for hashtype in U_DIRS:
+            self.do_index_test(hashtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# test_verify.py
+
+""" Test verifying every BuildList logged in a builds file. """
+
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlu import UDir
+from buildlist import BuildList, ListCheck, generate_rsa_key
+from buildlist.verify import (keys_from_builds, make_report, read_builds,
+                              verify_lists)
+from buildlist.walker import walk_leaves
+
+
+class TestVerify(unittest.TestCase):
+    """ Test verifying every BuildList logged in a builds file. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def tearDown(self):
+        pass
+
+    def do_verify_test(self, hashtype, workers):
+        """ Log three builds, damage U, and check what is reported. """
+        test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(test_path):
+            test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        data_path = os.path.join(test_path, 'dataDir')
+        dvcz_dir = os.path.join(test_path, 'dvcz')
+        u_path = os.path.join(test_path, 'uDir')
+        key_file = os.path.join(test_path, 'skPriv.pem')
+        self.rng.next_data_dir(data_path, 3, 4, 512, 1)
+        os.makedirs(dvcz_dir)
+        UDir.discover(u_path, hashtype=hashtype)
+        generate_rsa_key(key_file, 1024)
+        try:
+            lists = []
+            for ndx in range(3):
+                with open(os.path.join(data_path, 'extra%d' % ndx),
+                          'wb') as file:
+                    file.write(self.rng.some_bytes(64 + ndx))
+                lists.append(BuildList.list_gen(
+                    'build %d' % ndx, data_path, dvcz_dir,
+                    key_file=key_file, logging=True, u_path=u_path,
+                    hashtype=hashtype, use_cache=False))
+                time.sleep(1)       # so that each list is distinct
+
+            path_to_builds = os.path.join(dvcz_dir, 'builds')
+            entries = read_builds(path_to_builds)
+            self.assertEqual(len(entries), 3)
+            sources = keys_from_builds([path_to_builds, path_to_builds])
+            keys = list(sources)
+            self.assertEqual(keys, [key for _, _, key in entries])
+            self.assertEqual(sources[keys[0]], [path_to_builds])
+
+            # remove the file only the last list has from U
+            u_dir = UDir.discover(u_path)
+            last_only = dict(walk_leaves(lists[2].tree))['extra2'].hex()
+            os.unlink(u_dir.get_path_for_key(last_only))
+            bogus = '0' * len(keys[0])
+
+            results = verify_lists(u_path, keys + [keys[0], bogus],
+                                   hashtype, workers)
+            self.assertEqual(len(results), 4)
+            self.assertTrue(all(isinstance(r, ListCheck) for r in results))
+            self.assertEqual([r.key for r in results], keys + [bogus])
+            self.assertEqual([r.status for r in results],
+                             ['ok', 'ok', 'missing_content', 'unreadable'])
+            self.assertEqual(results[2].missing, [last_only])
+            self.assertEqual(results[0].file_count,
+                             len(list(walk_leaves(lists[0].tree))))
+
+            report = make_report(results, u_path, hashtype, sources)
+            self.assertEqual(report['list_count'], 4)
+            self.assertEqual(report['ok_count'], 2)
+            self.assertEqual(report['missing_content_keys'], 1)
+            self.assertEqual(report['lists'][3]['sources'], [])
+        finally:
+            shutil.rmtree(test_path, ignore_errors=True)
+
+    def test_verify(self):
+        """ Verify serially and in a pool of processes. """
+        for hashtype in [HashTypes.SHA1, HashTypes.SHA2]:
+            for workers in [1, 2]:
+                self.do_verify_test(hashtype, workers)
+
+
+if __name__ == '__main__':
+    unittest.main()
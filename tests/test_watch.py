@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# test_watch.py
+
+""" Test keeping a BuildList current as its data directory changes. """
+
+import os
+import shutil
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlutil import make_ex_re
+from buildlist import BuildList, generate_rsa_key, read_rsa_key
+from buildlist.watch import (PollingWatcher, TreeState, make_watcher,
+                             watch_data_dir)
+
+
+class TestWatch(unittest.TestCase):
+    """ Test keeping a BuildList current as its data directory changes. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        while os.path.exists(self.test_path):
+            self.test_path = os.path.join('tmp', self.rng.next_file_name(8))
+        self.data_path = os.path.join(self.test_path, 'dataDir')
+        self.rng.next_data_dir(self.data_path, 3, 3, 256, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path, ignore_errors=True)
+
+    def change_files(self):
+        """
+        Change, add, and remove files and directories under the data
+        directory, returning the relative paths affected.
+        """
+        changed = []
+        for dir_path, _, files in os.walk(self.data_path):
+            if files:
+                rel_dir = os.path.relpath(dir_path, self.data_path)
+                name = sorted(files)[0]
+                with open(os.path.join(dir_path, name), 'ab') as file:
+                    file.write(self.rng.some_bytes(17))
+                changed.append(os.path.normpath(os.path.join(rel_dir, name)))
+                break
+        os.makedirs(os.path.join(self.data_path, 'new', 'deeper'))
+        with open(os.path.join(self.data_path, 'new', 'deeper', 'x'),
+                  'wb') as file:
+            file.write(self.rng.some_bytes(33))
+        changed.append('new')
+        removed = sorted(name for name in os.listdir(self.data_path)
+                         if os.path.isfile(os.path.join(self.data_path,
+                                                        name)))
+        if removed:
+            os.unlink(os.path.join(self.data_path, removed[-1]))
+            changed.append(removed[-1])
+        return changed
+
+    def test_tree_state(self):
+        """ Updating the paths changed gives the tree a rescan would. """
+        for hashtype in [HashTypes.SHA1, HashTypes.SHA2]:
+            blist = BuildList.create_from_file_system(
+                'title', self.data_path, None, hashtype)
+            tree = blist.tree
+            state = TreeState.from_tree(tree, self.data_path)
+            self.assertEqual(state.to_tree(), tree)
+            self.assertEqual(state.root_digest(), blist.root_digest)
+
+            touched = state.update(self.change_files())
+            self.assertIn('new/deeper/x', touched)
+            fresh = BuildList.create_from_file_system(
+                'title', self.data_path, None, hashtype)
+            self.assertEqual(state.to_tree(), fresh.tree)
+            self.assertEqual(state.root_digest(), fresh.root_digest)
+            self.assertEqual(state.update([]), [])
+            shutil.rmtree(os.path.join(self.data_path, 'new'))
+
+    def test_watch_data_dir(self):
+        """ Changes are noticed and a signed list rewritten once. """
+        dvcz_dir = os.path.join(self.test_path, 'dvcz')
+        os.makedirs(dvcz_dir)
+        key_file = os.path.join(self.test_path, 'skPriv.pem')
+        generate_rsa_key(key_file, 1024)
+        sk_priv = read_rsa_key(key_file)
+        ex_re = make_ex_re(['build'])
+        for poll in [True, False]:
+            watcher = make_watcher(self.data_path, ex_re, dvcz_dir,
+                                   poll=poll, interval=0.1)
+            if poll:
+                self.assertIsInstance(watcher, PollingWatcher)
+            blist = BuildList.list_gen(
+                'title', self.data_path, dvcz_dir, key_file=key_file,
+                hashtype=HashTypes.SHA2, use_cache=False)
+            written = []
+            self.change_files()
+
+            def stop():
+                """ Stop after the first write. """
+                return len(written) > 0
+
+            last = watch_data_dir(
+                blist, self.data_path, dvcz_dir, sk_priv, HashTypes.SHA2,
+                ex_re, debounce=0.2, watcher=watcher, stop=stop,
+                on_write=lambda blist, key: written.append(key))
+            self.assertEqual(len(written), 1)
+            self.assertTrue(last.verify())
+            fresh = BuildList.create_from_file_system(
+                'title', self.data_path, None, HashTypes.SHA2, ex_re).tree
+            self.assertEqual(last.tree, fresh)
+            with open(os.path.join(dvcz_dir, 'lastBuildList'), 'rb') as file:
+                self.assertEqual(file.read(),
+                                 last.to_string().encode('utf-8'))
+            shutil.rmtree(os.path.join(self.data_path, 'new'))
+
+
+    def test_symlinks(self):
+        """ Links are followed, and changes to their targets reported. """
+        outside = os.path.join(self.test_path, 'outside')
+        os.makedirs(os.path.join(outside, 'sub'))
+        target = os.path.join(outside, 'file')
+        with open(target, 'wb') as file:
+            file.write(self.rng.some_bytes(19))
+        os.symlink(os.path.abspath(target),
+                   os.path.join(self.data_path, 'link'))
+        os.symlink(os.path.abspath(os.path.join(outside, 'sub')),
+                   os.path.join(self.data_path, 'linked_dir'))
+        blist = BuildList.create_from_file_system(
+            'title', self.data_path, None, HashTypes.SHA2)
+        state = TreeState(self.data_path, HashTypes.SHA2)
+        state.rescan()
+        self.assertEqual(state.to_tree(), blist.tree)
+        self.assertIsNotNone(state.hash_of('link'))
+
+        for poll in [True, False]:
+            watcher = make_watcher(self.data_path, poll=poll, interval=0.1)
+            try:
+                with open(target, 'ab') as file:
+                    file.write(b'more')
+                with open(os.path.join(outside, 'sub', 'new'), 'wb') as file:
+                    file.write(b'new')
+                changed = set()
+                deadline = time.time() + 2
+                while time.time() < deadline and \
+                        not {'link', 'linked_dir/new'} <= changed:
+                    changed |= watcher.changes(0.2)
+                self.assertIn('link', changed)
+                self.assertIn('linked_dir/new', changed)
+            finally:
+                watcher.close()
+            os.unlink(os.path.join(outside, 'sub', 'new'))
+
+
+if __name__ == '__main__':
+    unittest.main()